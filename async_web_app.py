@@ -0,0 +1,422 @@
+"""
+Async (ASGI) variant of the web app, for holding many conversations that are waiting on the model
+
+    hypercorn async_web_app:app --bind 0.0.0.0:5001      (or: python run_web_app.py --asgi)
+
+Serves /start_session, /send_message, /download_report and /end_session, the
+/start_session/stream and /send_message/stream variants - plus /,
+/health and /ready - with the same requests and responses as web_app.py, sharing its
+session store, caches and turn logic. In web_app.py every request holds a thread for
+as long as it waits on the LLM; here a waiting request is a suspended coroutine, so
+one process can have hundreds of turns in flight. The admission queue still bounds
+how many of them reach the backend at once.
+
+Each turn runs the same synchronous conversation code as web_app.py inside
+AsyncSession.run_sync(): its database I/O goes through the asyncio driver, and its
+LLM calls are awaited through the backend's asyncio client (see utils/async_bridge.py),
+so neither blocks the event loop. The streaming routes send the same Server-Sent
+Events as web_app.py, passed from the turn to the response through an asyncio queue.
+
+Differences from web_app.py:
+- The next question is not prefetched; prefetching runs on worker threads.
+- CBT_WRITE_BEHIND is not supported, since commits are already awaited off the request's critical path.
+
+Needs `pip install quart hypercorn` plus the asyncio database driver (see
+get_async_engine), and httpx for the OpenAI-compatible backends.
+"""
+
+from quart import Quart, Response, render_template, request, jsonify, session, make_response
+from utils.cbt_database import get_async_engine, get_async_session_factory, get_or_create_user
+from utils.conversation_manager import INTRO_GREETING
+from utils.prompt_loader import load_prompt_template
+from utils.llm_admission import LLMQueueFullError
+from utils import async_bridge, llm
+import web_app
+from web_app import session_store, log_turn, new_chat_session, resume_chat_session, run_turn, stream_turn_events, sse_event, generate_conversation_report
+import asyncio
+import os
+import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime
+from sqlalchemy import text
+
+if web_app.write_behind is not None:
+    raise RuntimeError("CBT_WRITE_BEHIND is not supported by the async server; unset it to use async_web_app")
+
+app = Quart(__name__)
+# Same cookie signing as web_app.py, so a browser's session works against either server
+app.secret_key = web_app.app.secret_key
+
+# Create the asyncio engine up front so a missing driver fails at startup, not on the first chat
+get_async_engine()
+
+@app.after_serving
+async def shutdown():
+    """Stop the shared background threads and close the asyncio engine's connections"""
+    web_app.shutdown()
+    await get_async_engine().dispose()
+
+# The session store may do blocking file I/O (SQLite), so it is used from a thread
+
+async def load_chat_session(session_id, user_identifier=None):
+    """The chat for this request, resumed from the database if the store has lost it"""
+    if not session_id:
+        return None
+    session_data = await asyncio.to_thread(session_store.get, session_id)
+    if session_data is None and user_identifier:
+        async with get_async_session_factory()() as db_session:
+            session_data = await db_session.run_sync(
+                lambda sync_session: resume_chat_session(sync_session, session_id, user_identifier)
+            )
+        if session_data is not None:
+            await save_chat_session(session_data)
+    return session_data
+
+async def save_chat_session(session_data):
+    await asyncio.to_thread(web_app.save_chat_session, session_data)
+
+async def delete_chat_session(session_id):
+    await asyncio.to_thread(session_store.delete, session_id)
+
+def overloaded_response():
+    """503 response telling the client to retry once the LLM queue has drained"""
+    retry_after = llm.admission.retry_after()
+    response = jsonify({
+        'error': 'The assistant is busy right now. Please try again in a moment.',
+        'retry_after': retry_after,
+        'queue_depth': llm.admission.stats()['queued']
+    })
+    response.status_code = 503
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+def sse_response(messages):
+    """Wrap an async generator of SSE messages in a streaming response"""
+    return Response(
+        messages,
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+def forward(events, emit):
+    """Pass each message of a synchronous SSE generator to emit(); returns the generator's return value"""
+    while True:
+        try:
+            emit(next(events))
+        except StopIteration as stop:
+            return stop.value
+
+async def stream_events(produce):
+    """Yield the SSE messages that produce(emit) passes to emit() while it runs as a task.
+
+    The synchronous turn code emits from inside run_sync(), so its messages are handed
+    over through a queue. If the client goes away the task is cancelled, which rolls
+    back the turn just as a closed stream does in web_app.py.
+    """
+    queue = asyncio.Queue()
+    finished = object()
+    task = asyncio.ensure_future(produce(queue.put_nowait))
+    task.add_done_callback(lambda task: queue.put_nowait(finished))
+    try:
+        while (message := await queue.get()) is not finished:
+            yield message
+    finally:
+        task.cancel()
+
+@app.route('/')
+async def index():
+    """Serve the main chat interface"""
+    return await render_template('chat.html')
+
+@app.route('/health', methods=['GET'])
+async def health():
+    """Report the cached LLM backend health and load"""
+    status = llm.health()
+    return jsonify({
+        'llm': status,
+        'admission': llm.admission.stats(),
+        'write_behind': None,
+        'sessions': await asyncio.to_thread(session_store.stats)
+    }), 200 if status['ok'] else 503
+
+@app.route('/ready', methods=['GET'])
+async def ready():
+    """Readiness probe: the app is loaded and can reach the database"""
+    try:
+        async with get_async_engine().connect() as connection:
+            await connection.execute(text("SELECT 1"))
+    except Exception as e:
+        return jsonify({'ready': False, 'error': str(e), 'pid': os.getpid()}), 503
+    return jsonify({'ready': True, 'pid': os.getpid()})
+
+@asynccontextmanager
+async def request_db_session(session_data):
+    """Open an AsyncSession for one request and bind the chat's memory to its synchronous facade.
+
+    The chat's code must then run inside `await db_session.run_sync(...)`.
+    """
+    cbt_memory = session_data['cbt_memory']
+    async with get_async_session_factory()() as db_session:
+        cbt_memory.bind(db_session.sync_session)
+        try:
+            yield db_session
+        finally:
+            cbt_memory.release()
+
+async def create_chat_session(personalization_type):
+    """Create the per-chat components and register them in the session store"""
+    session_id = str(uuid.uuid4())
+    session['session_id'] = session_id
+
+    user_identifier = str(uuid.uuid4())
+    # Kept in the signed cookie so the chat can be resumed from the database after a restart
+    session['user_identifier'] = user_identifier
+    async with get_async_session_factory()() as db_session:
+        user_id = await db_session.run_sync(lambda sync_session: get_or_create_user(sync_session, user_identifier).id)
+
+    session_data = new_chat_session(session_id, user_id, user_identifier, personalization_type, write_behind=None)
+    await save_chat_session(session_data)
+    return session_id, session_data
+
+async def record_greeting(session_data, starter):
+    """Persist the opening message and add it to the conversation history"""
+    async with request_db_session(session_data) as db_session:
+        await db_session.run_sync(lambda sync_session: log_turn(session_data, "", starter))
+
+    session_data['conversation_history'].append({
+        'timestamp': datetime.now(),
+        'sender': 'AI',
+        'message': starter,
+        'phase': 'introduction'
+    })
+    await save_chat_session(session_data)
+
+@app.route('/start_session', methods=['POST'])
+async def start_session():
+    """Initialize a new chat session"""
+    if llm.admission.is_saturated():
+        return overloaded_response()
+
+    try:
+        data = await request.get_json()
+        personalization_type = data.get('personalization_type', 'with_personalization')
+
+        session_id, session_data = await create_chat_session(personalization_type)
+        conversation_manager = session_data['conversation_manager']
+
+        # Load base prompt
+        try:
+            load_prompt_template("cbt", "with_context")
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 500
+
+        # Create initial greeting; the model call is awaited on the event loop
+        starter = await async_bridge.spawn(conversation_manager._rephrase_question_with_ai, INTRO_GREETING, 'introduction')
+        starter = starter.strip('"').strip("'").strip()
+
+        # Save initial conversation
+        await record_greeting(session_data, starter)
+
+        return jsonify({
+            'success': True,
+            'message': starter,
+            'session_id': session_id,
+            'personalization_type': personalization_type
+        })
+
+    except Exception as e:
+        return jsonify({'error': f'Failed to start session: {str(e)}'}), 500
+
+@app.route('/start_session/stream', methods=['POST'])
+async def start_session_stream():
+    """Initialize a new chat session and stream the greeting as it is generated"""
+    if llm.admission.is_saturated():
+        return overloaded_response()
+
+    try:
+        data = await request.get_json()
+        personalization_type = data.get('personalization_type', 'with_personalization')
+
+        session_id, session_data = await create_chat_session(personalization_type)
+        conversation_manager = session_data['conversation_manager']
+
+        # Validate the prompt template before committing to a stream
+        load_prompt_template("cbt", "with_context")
+    except Exception as e:
+        return jsonify({'error': f'Failed to start session: {str(e)}'}), 500
+
+    def greeting_events():
+        starter = INTRO_GREETING
+        streamed = False
+        for kind, text in conversation_manager.stream_rephrase_question_with_ai(INTRO_GREETING, 'introduction'):
+            if kind == 'token':
+                streamed = True
+                yield sse_event('token', {'text': text})
+            else:
+                starter = text
+        if not streamed:
+            # Banked, cached or the model missed the budget - show the greeting before it is saved
+            yield sse_event('token', {'text': starter})
+        return starter
+
+    async def produce(emit):
+        try:
+            starter = await async_bridge.spawn(forward, greeting_events(), emit)
+
+            # Persist once the stream has finished
+            await record_greeting(session_data, starter)
+
+            emit(sse_event('done', {
+                'success': True,
+                'message': starter,
+                'session_id': session_id,
+                'personalization_type': personalization_type
+            }))
+        except Exception as e:
+            emit(sse_event('error', {'error': f'Failed to start session: {str(e)}'}))
+
+    return sse_response(stream_events(produce))
+
+async def begin_turn():
+    """Validate an incoming chat message and record it in the conversation history.
+
+    Returns (session_data, user_input, response) where response is a ready-made
+    JSON response when the turn should not be processed any further.
+    """
+    data = await request.get_json()
+    user_input = data.get('message', '').strip()
+    session_id = session.get('session_id')
+    session_data = await load_chat_session(session_id, session.get('user_identifier'))
+
+    if session_data is None:
+        return None, user_input, (jsonify({'error': 'Session not found. Please start a new session.'}), 400)
+
+    if not user_input:
+        return None, user_input, (jsonify({'error': 'Message cannot be empty'}), 400)
+
+    # Turn away new work while the LLM queue is full, before any state changes
+    if llm.admission.is_saturated():
+        return None, user_input, overloaded_response()
+
+    session_data['conversation_history'].append({
+        'timestamp': datetime.now(),
+        'sender': 'User',
+        'message': user_input,
+        'phase': session_data['conversation_manager'].get_current_phase()
+    })
+
+    # Check for exit commands
+    if user_input.lower() in ["exit", "quit", "end session"]:
+        print(f"\n📊 USER STUDY LOG - User {session_data['user_id']} ({session_data['personalization_type'].upper()}) ENDED SESSION EARLY")
+        print(f"   Timestamp: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+
+        # An ended chat is not resumed
+        await delete_chat_session(session_id)
+        session.pop('user_identifier', None)
+        return None, user_input, jsonify({
+            'success': True,
+            'message': "Thank you for sharing. Take care! 🌱",
+            'session_ended': True
+        })
+
+    return session_data, user_input, None
+
+@app.route('/send_message', methods=['POST'])
+async def send_message():
+    """Handle user message and return AI response"""
+    try:
+        session_data, user_input, early_response = await begin_turn()
+        if early_response is not None:
+            return early_response
+
+        conversation_manager = session_data['conversation_manager']
+
+        async with request_db_session(session_data) as db_session:
+            ai_response, session_ended = await db_session.run_sync(lambda sync_session: run_turn(user_input, session_data))
+        await save_chat_session(session_data)
+
+        return jsonify({
+            'success': True,
+            'message': ai_response,
+            'phase': conversation_manager.get_current_phase(),
+            'session_ended': session_ended
+        })
+
+    except LLMQueueFullError:
+        return overloaded_response()
+    except Exception as e:
+        return jsonify({'error': f'Failed to process message: {str(e)}'}), 500
+
+@app.route('/send_message/stream', methods=['POST'])
+async def send_message_stream():
+    """Handle user message and stream the AI response as it is generated"""
+    try:
+        session_data, user_input, early_response = await begin_turn()
+        if early_response is not None:
+            return early_response
+    except Exception as e:
+        return jsonify({'error': f'Failed to process message: {str(e)}'}), 500
+
+    async def produce(emit):
+        try:
+            async with request_db_session(session_data) as db_session:
+                done = await db_session.run_sync(
+                    lambda sync_session: forward(stream_turn_events(user_input, session_data), emit)
+                )
+            await save_chat_session(session_data)
+
+            # The database session is released before the final event is sent
+            emit(sse_event('done', done))
+        except Exception as e:
+            emit(sse_event('error', {'error': f'Failed to process message: {str(e)}'}))
+
+    return sse_response(stream_events(produce))
+
+@app.route('/download_report', methods=['GET'])
+async def download_report():
+    """Generate and download conversation report"""
+    try:
+        session_data = await load_chat_session(session.get('session_id'), session.get('user_identifier'))
+
+        if session_data is None:
+            return jsonify({'error': 'Session not found'}), 400
+
+        personalization_type = session_data['personalization_type']
+        report_content = generate_conversation_report(
+            session_data['conversation_history'],
+            personalization_type,
+            session_data['session_start_time'],
+            session_data['user_identifier']
+        )
+
+        response = await make_response(report_content.encode('utf-8'))
+
+        # Generate filename with timestamp (ASCII-safe)
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        session_type = 'with_personalization' if personalization_type == 'with_personalization' else 'pure_cbt'
+        filename = f'CBT_Session_Report_{session_type}_{timestamp}.txt'
+
+        response.headers['Content-Type'] = 'text/plain; charset=utf-8'
+        response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+        response.headers['Cache-Control'] = 'no-cache'
+
+        return response
+
+    except Exception as e:
+        return jsonify({'error': f'Failed to generate report: {str(e)}'}), 500
+
+@app.route('/end_session', methods=['POST'])
+async def end_session():
+    """End the current session"""
+    session_id = session.get('session_id')
+
+    if session_id:
+        await delete_chat_session(session_id)
+
+    session.pop('session_id', None)
+    session.pop('user_identifier', None)
+
+    return jsonify({'success': True, 'message': 'Session ended successfully'})
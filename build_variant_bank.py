@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+"""
+Pre-generate validated question rephrasings into an on-disk variant bank.
+
+With a bank in place the app picks question variants from it instead of calling
+the model for every rephrase.
+"""
+
+import argparse
+import os
+import sys
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the offline question variant bank")
+    parser.add_argument('--count', type=int, default=10, help="Variants to generate per question (default: 10)")
+    parser.add_argument('--output', default=os.environ.get('VARIANT_BANK_PATH', 'variant_bank.bin'),
+                        help="Bank file to write (default: $VARIANT_BANK_PATH or variant_bank.bin)")
+    args = parser.parse_args()
+
+    from utils.conversation_manager import ConversationManager
+    from utils.variant_bank import build_variant_bank
+
+    print("🧠 Empathetic AI - Building question variant bank")
+    print("=" * 50)
+
+    # Rephrasing needs no memory, so no database session is required
+    conversation_manager = ConversationManager(None)
+    counts = build_variant_bank(conversation_manager, args.output, per_question=args.count)
+
+    short = [phase for (_, phase), count in counts.items() if count < args.count]
+    print(f"\n✅ Wrote {sum(counts.values())} variants for {len(counts)} questions to {args.output}")
+    if short:
+        print(f"⚠️  Fewer than {args.count} valid variants for: {', '.join(short)}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,57 @@
+"""
+Gunicorn settings for running the web app in production
+
+    python run_web_app.py                      (or: gunicorn -c gunicorn.conf.py web_app:app)
+
+The app is preloaded in the master - prompts read, database engine created and
+migrated - and then forked into CBT_WORKERS processes of CBT_THREADS threads each.
+Each worker opens its own connections and starts its own background threads
+(web_app.init_worker). On SIGTERM workers finish their requests within
+CBT_GRACEFUL_TIMEOUT seconds and write out queued turns before exiting
+(web_app.shutdown).
+
+Readiness: GET /ready answers 200 once a worker can serve, and CBT_READY_FILE, if
+set, is created once the master is listening and removed when it exits.
+
+Several workers only share chats with CBT_SESSION_STORE=sqlite; with the default
+in-process store keep CBT_WORKERS=1 and scale with threads.
+"""
+
+import os
+
+# The app checks this at import to leave its background threads to post_fork
+os.environ.setdefault('CBT_PRELOAD_APP', '1')
+
+bind = os.environ.get('CBT_BIND', '0.0.0.0:5001')
+workers = int(os.environ.get('CBT_WORKERS', 1))
+# Threads keep a worker serving while requests wait on the LLM or stream tokens
+worker_class = 'gthread'
+threads = int(os.environ.get('CBT_THREADS', 16))
+# Formulation streams can run for minutes; a worker is only killed if it stops responding
+timeout = int(os.environ.get('CBT_WORKER_TIMEOUT', 300))
+graceful_timeout = int(os.environ.get('CBT_GRACEFUL_TIMEOUT', 60))
+keepalive = 5
+
+preload_app = True
+chdir = os.path.dirname(os.path.abspath(__file__))
+accesslog = os.environ.get('CBT_ACCESS_LOG', '-')
+
+READY_FILE = os.environ.get('CBT_READY_FILE')
+
+def when_ready(server):
+    server.log.info(f"App preloaded; starting {workers} worker(s) x {threads} thread(s) on {bind}")
+    if READY_FILE:
+        with open(READY_FILE, 'w') as file:
+            file.write(str(os.getpid()))
+
+def post_fork(server, worker):
+    import web_app
+    web_app.init_worker()
+
+def worker_exit(server, worker):
+    import web_app
+    web_app.shutdown()
+
+def on_exit(server):
+    if READY_FILE and os.path.exists(READY_FILE):
+        os.remove(READY_FILE)
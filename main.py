@@ -1,9 +1,12 @@
-import ollama
+from utils import llm
+from utils.llm_routing import TASK_FRAMING
 from utils.prompt_loader import load_prompt_template
 from utils.cbt_database import init_cbt_db, get_or_create_user, save_conversation, get_user_by_name
 from utils.cbt_memory import CBTMemoryManager
-from utils.conversation_manager import ConversationManager
+from utils.conversation_manager import ConversationManager, INTRO_GREETING
 from utils.cbt_nlp_extractor import CBTNLPExtractor
+from utils.rephrase_cache import RephraseCache
+from utils.variant_bank import get_variant_bank
 import json
 import uuid
 import os
@@ -28,7 +31,7 @@ def run_chat():
     user_identifier, session = get_user_identifier()
     user = get_or_create_user(session, user_identifier)
     cbt_memory = CBTMemoryManager(session, user)
-    conversation_manager = ConversationManager(cbt_memory)
+    conversation_manager = ConversationManager(cbt_memory, rephrase_cache=RephraseCache(), variant_bank=get_variant_bank())
     
     print("\n🧠 CBT-Informed AI Assistant")
     print("Choose session type:")
@@ -56,8 +59,7 @@ def run_chat():
     print(f"\n🧠 Using CBT approach {'with personalization' if personalization_type == 'with_personalization' else 'without personalization'}. Type 'exit' to quit.\n")
     
     # Start structured CBT assessment (both versions use same structure)
-    intro_base = "Hi! I'm here to support you today through a structured conversation that will help us understand your thinking patterns. What's been on your mind lately?"
-    starter = conversation_manager._rephrase_question_with_ai(intro_base, 'introduction')
+    starter = conversation_manager._rephrase_question_with_ai(INTRO_GREETING, 'introduction')
     print(f"AI > {starter}\n")
     
     context = cbt_memory.get_context_for_conversation()
@@ -69,87 +71,91 @@ def run_chat():
             print("Goodbye! 🌱")
             break
 
-        # Handle structured CBT assessment
-        if personalization_type == "with_personalization":
-            # Save the user's response to appropriate database table
-            conversation_manager.save_response_data(user_input)
-            
-            # Advance to next phase after saving response
-            conversation_manager.advance_phase()
-            
-            # Get current phase for system prompt
-            phase = conversation_manager.get_current_phase()
-            
-            # Check if we're at the final analysis phase
-            if phase == 'complete':
-                # Generate improved CBT formulation based on actual stored data
-                print("\n📋 Generating CBT Formulation...")
-                ai_response = conversation_manager.generate_improved_cbt_formulation()
-                
-                print(f"\nAI > {ai_response}\n")
-                
-                context = cbt_memory.get_context_for_conversation()
-                save_conversation(session, user.id, "CBT Formulation", ai_response, context, personalization_type)
-                
-                # End conversation after formulation
-                print("CBT Assessment complete! 🌱")
-                break
-            
-            else:
-                # Get next structured question WITH personalization
-                next_question = conversation_manager.get_contextual_starter()
-                
-                if next_question:
-                    # CRITICAL FIX: Use the personalized question directly 
-                    # Don't overwrite with additional AI framing - it destroys the bold formatting!
-                    ai_response = next_question
+        # Everything the turn writes is committed once; a failure rolls it back so the
+        # same question can be answered again
+        try:
+            with conversation_manager.turn():
+                # Handle structured CBT assessment
+                if personalization_type == "with_personalization":
+                    # Save the user's response to appropriate database table
+                    conversation_manager.save_response_data(user_input)
                     
-                    print(f"\nAI > {ai_response}\n")
+                    # Advance to next phase after saving response
+                    conversation_manager.advance_phase()
                     
-                    context = cbt_memory.get_context_for_conversation()
-                    save_conversation(session, user.id, user_input, ai_response, context, personalization_type)
+                    # Get current phase for system prompt
+                    phase = conversation_manager.get_current_phase()
                     
+                    # Check if we're at the final analysis phase
+                    if phase == 'complete':
+                        # Generate improved CBT formulation based on actual stored data
+                        print("\n📋 Generating CBT Formulation...")
+                        ai_response = conversation_manager.generate_improved_cbt_formulation()
+                        
+                        print(f"\nAI > {ai_response}\n")
+                        
+                        context = cbt_memory.get_context_for_conversation()
+                        save_conversation(session, user.id, "CBT Formulation", ai_response, context, personalization_type)
+                        
+                        # End conversation after formulation
+                        print("CBT Assessment complete! 🌱")
+                        break
+                    
+                    else:
+                        # Get next structured question WITH personalization
+                        next_question = conversation_manager.get_contextual_starter()
+                        
+                        if next_question:
+                            # CRITICAL FIX: Use the personalized question directly 
+                            # Don't overwrite with additional AI framing - it destroys the bold formatting!
+                            ai_response = next_question
+                            
+                            print(f"\nAI > {ai_response}\n")
+                            
+                            context = cbt_memory.get_context_for_conversation()
+                            save_conversation(session, user.id, user_input, ai_response, context, personalization_type)
+                        
+                        else:
+                            # No more questions - shouldn't happen in this flow
+                            print("Assessment complete!\n")
+                            break
+
+                # Handle structured CBT assessment WITHOUT personalization 
                 else:
-                    # No more questions - shouldn't happen in this flow
-                    print("Assessment complete!\n")
-                    break
-
-        # Handle structured CBT assessment WITHOUT personalization 
-        else:
-            # Save the user's response to appropriate database table
-            conversation_manager.save_response_data(user_input)
-            
-            # Advance to next phase after saving response
-            conversation_manager.advance_phase()
-            
-            # Get current phase for system prompt
-            phase = conversation_manager.get_current_phase()
-            
-            # Check if we're at the final analysis phase
-            if phase == 'complete':
-                # Generate improved CBT formulation based on actual stored data
-                print("\n📋 Generating CBT Formulation...")
-                ai_response = conversation_manager.generate_improved_cbt_formulation()
-                
-                print(f"\nAI > {ai_response}\n")
-                
-                context = cbt_memory.get_context_for_conversation()
-                save_conversation(session, user.id, "CBT Formulation", ai_response, context, personalization_type)
-                
-                # End conversation after formulation
-                print("CBT Assessment complete! 🌱")
-                break
-            
-            else:
-                # Get next structured question WITHOUT personalization
-                next_question = conversation_manager.get_contextual_starter_without_personalization()
-                
-                if next_question:
-                    # Generate AI response with natural framing
-                    phase = conversation_manager.get_current_collection_phase()
+                    # Save the user's response to appropriate database table
+                    conversation_manager.save_response_data(user_input)
+                    
+                    # Advance to next phase after saving response
+                    conversation_manager.advance_phase()
+                    
+                    # Get current phase for system prompt
+                    phase = conversation_manager.get_current_phase()
                     
-                    if phase == 'introduction':
-                        framing_prompt = f"""The user shared their presenting concern: "{user_input}"
+                    # Check if we're at the final analysis phase
+                    if phase == 'complete':
+                        # Generate improved CBT formulation based on actual stored data
+                        print("\n📋 Generating CBT Formulation...")
+                        ai_response = conversation_manager.generate_improved_cbt_formulation()
+                        
+                        print(f"\nAI > {ai_response}\n")
+                        
+                        context = cbt_memory.get_context_for_conversation()
+                        save_conversation(session, user.id, "CBT Formulation", ai_response, context, personalization_type)
+                        
+                        # End conversation after formulation
+                        print("CBT Assessment complete! 🌱")
+                        break
+                    
+                    else:
+                        # Get next structured question WITHOUT personalization
+                        next_question = conversation_manager.get_contextual_starter_without_personalization()
+                        
+                        if next_question:
+                            # Generate AI response with natural framing
+                            phase = conversation_manager.get_current_collection_phase()
+                            
+                            if phase == 'introduction':
+                                framing_prompt = f"""The user shared their presenting concern: "{user_input}"
 
 You need to naturally deliver this question: "{next_question}"
 
@@ -158,9 +164,9 @@ CRITICAL RULES:
 - Don't separate acknowledgment and question - blend them together smoothly
 - Keep it warm, empathetic, and professional
 - Total response should be 30-50 words as ONE complete statement"""
-                    
-                    elif phase == 'cbt_assessment':
-                        framing_prompt = f"""The user responded: "{user_input}"
+                            
+                            elif phase == 'cbt_assessment':
+                                framing_prompt = f"""The user responded: "{user_input}"
 
 You need to naturally ask this question: "{next_question}"
 
@@ -169,9 +175,9 @@ CRITICAL RULES:
 - Don't separate acknowledgment and question - make it one smooth statement
 - Keep it therapeutic and supportive
 - Total response should be 25-45 words as ONE complete statement"""
-                    
-                    elif phase == 'patterns_beliefs':
-                        framing_prompt = f"""The user shared: "{user_input}"
+                            
+                            elif phase == 'patterns_beliefs':
+                                framing_prompt = f"""The user shared: "{user_input}"
 
 You need to ask: "{next_question}"
 
@@ -180,34 +186,37 @@ CRITICAL RULES:
 - Don't separate acknowledgment and question - blend them together
 - Keep it thoughtful and encouraging
 - Total response should be 40-60 words as ONE complete statement"""
-                    
-                    else:
-                        framing_prompt = f"""The user responded: "{user_input}"
+                            
+                            else:
+                                framing_prompt = f"""The user responded: "{user_input}"
 
 You need to ask: "{next_question}"
 
 Create ONE natural, flowing response that incorporates the question smoothly."""
 
-                    system_prompt = conversation_manager.format_system_prompt(base_prompt)
-                    
-                    response = ollama.chat(
-                        model="llama3.2",
-                        messages=[
-                            {"role": "system", "content": system_prompt},
-                            {"role": "user", "content": framing_prompt}
-                        ]
-                    )
-                    
-                    ai_response = response['message']['content']
-                    print(f"\nAI > {ai_response}\n")
-                    
-                    context = cbt_memory.get_context_for_conversation()
-                    save_conversation(session, user.id, user_input, ai_response, context, personalization_type)
-                    
-                else:
-                    # No more questions - shouldn't happen in this flow
-                    print("Assessment complete!\n")
-                    break
+                            system_prompt = conversation_manager.format_system_prompt(base_prompt)
+                            
+                            response = llm.chat(
+                                messages=[
+                                    {"role": "system", "content": system_prompt},
+                                    {"role": "user", "content": framing_prompt}
+                                ],
+                                task=TASK_FRAMING
+                            )
+                            
+                            ai_response = response['message']['content']
+                            print(f"\nAI > {ai_response}\n")
+                            
+                            context = cbt_memory.get_context_for_conversation()
+                            save_conversation(session, user.id, user_input, ai_response, context, personalization_type)
+                        
+                        else:
+                            # No more questions - shouldn't happen in this flow
+                            print("Assessment complete!\n")
+                            break
+        except Exception as e:
+            print(f"\nAI > I'm sorry, I encountered an error. Could you please try again? Error: {str(e)}\n")
+            continue
 
 if __name__ == "__main__":
     run_chat()
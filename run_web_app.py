@@ -1,8 +1,13 @@
 #!/usr/bin/env python3
 """
 Startup script for the Empathetic AI Web Application
+
+By default the app is served by gunicorn with the settings in gunicorn.conf.py;
+--dev runs the Flask development server with the debugger and reloader instead, and
+--asgi serves the async variant (async_web_app.py) with hypercorn.
 """
 
+import argparse
 import os
 import sys
 import subprocess
@@ -12,7 +17,6 @@ def check_dependencies():
     """Check if required dependencies are installed"""
     try:
         import flask
-        import ollama
         from utils.cbt_database import init_cbt_db
         print("✅ All dependencies are available")
         return True
@@ -22,30 +26,35 @@ def check_dependencies():
         print("pip install -r requirements_web.txt")
         return False
 
-def check_ollama():
-    """Check if Ollama is running and has the required model"""
+def check_llm_backend():
+    """Check if the configured LLM backend is running and has the required model"""
     try:
-        import ollama
-        # Try to list models to see if Ollama is running
-        models = ollama.list()
-        
-        # Check if llama3.2 model is available
-        model_names = [model['name'] for model in models.get('models', [])]
-        if not any('llama3.2' in name for name in model_names):
-            print("⚠️  WARNING: llama3.2 model not found")
-            print("Please install it with: ollama pull llama3.2")
-            return False
-        
-        print("✅ Ollama is running with llama3.2 model")
-        return True
-        
+        from utils import llm
+        backend = llm.get_backend()
+        status = llm.health()
     except Exception as e:
-        print(f"❌ Ollama not available: {e}")
-        print("Please make sure Ollama is installed and running:")
-        print("1. Install Ollama from https://ollama.ai")
-        print("2. Start Ollama service")
-        print("3. Pull the model: ollama pull llama3.2")
+        status = {'ok': False, 'error': str(e)}
+        backend = None
+    
+    if not status['ok']:
+        print(f"❌ LLM backend not available: {status['error']}")
+        if backend is None or backend.name == 'ollama':
+            print("Please make sure Ollama is installed and running:")
+            print("1. Install Ollama from https://ollama.ai")
+            print("2. Start Ollama service")
+            print("3. Pull the model: ollama pull llama3.2")
+        else:
+            print(f"Please make sure the {backend.name} server is running at {backend.base_url}")
+        return False
+    
+    # Check if llama3.2 model is available
+    if backend.name == 'ollama' and not any('llama3.2' in name for name in status['models']):
+        print("⚠️  WARNING: llama3.2 model not found")
+        print("Please install it with: ollama pull llama3.2")
         return False
+    
+    print(f"✅ LLM backend '{backend.name}' is running ({', '.join(status['models']) or 'no models listed'})")
+    return True
 
 def create_directories():
     """Create necessary directories"""
@@ -53,7 +62,52 @@ def create_directories():
     templates_dir.mkdir(exist_ok=True)
     print("✅ Templates directory ready")
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Start the Empathetic AI web application")
+    parser.add_argument('--dev', action='store_true',
+                        help="Run the single-process Flask development server with the debugger")
+    parser.add_argument('--asgi', action='store_true',
+                        help="Serve the async variant with hypercorn; waiting turns do not hold threads")
+    parser.add_argument('--workers', type=int, help="Worker processes (CBT_WORKERS, default 1)")
+    parser.add_argument('--threads', type=int, help="Threads per worker (CBT_THREADS, default 16)")
+    parser.add_argument('--bind', help="Address to listen on (CBT_BIND, default 0.0.0.0:5001)")
+    return parser.parse_args()
+
+def start_production_server(args):
+    """Replace this process with gunicorn, configured by gunicorn.conf.py"""
+    try:
+        import gunicorn
+    except ImportError:
+        print("❌ gunicorn is not installed: pip install -r requirements_web.txt")
+        print("   (or run the development server with --dev)")
+        return 1
+    
+    for name, value in (('CBT_WORKERS', args.workers), ('CBT_THREADS', args.threads), ('CBT_BIND', args.bind)):
+        if value is not None:
+            os.environ[name] = str(value)
+    
+    config = str(Path(__file__).resolve().parent / 'gunicorn.conf.py')
+    os.execvp(sys.executable, [sys.executable, '-m', 'gunicorn', '-c', config, 'web_app:app'])
+
+def start_asgi_server(args):
+    """Replace this process with hypercorn serving async_web_app.py"""
+    try:
+        import hypercorn, quart
+    except ImportError as e:
+        print(f"❌ The async server needs quart and hypercorn: {e}")
+        print("   (see the optional packages in requirements_web.txt)")
+        return 1
+    
+    bind = args.bind or os.environ.get('CBT_BIND', '0.0.0.0:5001')
+    workers = args.workers or int(os.environ.get('CBT_WORKERS', 1))
+    graceful_timeout = os.environ.get('CBT_GRACEFUL_TIMEOUT', '60')
+    os.chdir(Path(__file__).resolve().parent)
+    os.execvp(sys.executable, [sys.executable, '-m', 'hypercorn', '--bind', bind, '--workers', str(workers),
+                               '--graceful-timeout', graceful_timeout, 'async_web_app:app'])
+
 def main():
+    args = parse_args()
+    
     print("🧠 Empathetic AI - Web Application Startup")
     print("=" * 50)
     
@@ -61,9 +115,9 @@ def main():
     if not check_dependencies():
         return 1
     
-    # Check Ollama
-    if not check_ollama():
-        print("\n⚠️  Continuing anyway, but the app may not work properly without Ollama")
+    # Check the LLM backend
+    if not check_llm_backend():
+        print("\n⚠️  Continuing anyway, but the app may not work properly without an LLM backend")
     
     # Create directories
     create_directories()
@@ -82,7 +136,12 @@ def main():
     print("🔄 Press Ctrl+C to stop the server")
     print("-" * 50)
     
-    # Start the Flask app
+    if args.asgi:
+        return start_asgi_server(args)
+    if not args.dev:
+        return start_production_server(args)
+    
+    # Start the Flask development server
     try:
         from web_app import app
         app.run(debug=True, host='0.0.0.0', port=5001)
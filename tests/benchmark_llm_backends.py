@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark script comparing LLM backends side by side on the app's own prompts
+
+Usage: python tests/benchmark_llm_backends.py ollama llamacpp vllm --runs 5
+Each backend is configured through the usual LLM_BASE_URL / OLLAMA_HOST settings.
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import argparse
+import statistics
+import time
+
+from utils.llm_backends import create_backend
+from utils.conversation_manager import ConversationManager, REPHRASE_MODEL
+
+def time_stream(backend, model, messages):
+    """Return (time to first token, total time) for one streamed reply"""
+    started = time.perf_counter()
+    first_token = None
+    for chunk in backend.stream(model, messages):
+        if first_token is None and chunk['message']['content']:
+            first_token = time.perf_counter() - started
+    total = time.perf_counter() - started
+    return first_token if first_token is not None else total, total
+
+def benchmark_backend(name, model, runs):
+    print(f"\n🧠 Backend: {name}")
+    print("-" * 50)
+
+    backend = create_backend(name)
+    status = backend.health()
+    if not status['ok']:
+        print(f"❌ {name} unavailable: {status['error']}")
+        return
+
+    # Rephrasing needs no memory, so no database session is required
+    conversation_manager = ConversationManager(None)
+    phase = 'situation_1'
+    prompt = conversation_manager._build_rephrase_prompt(conversation_manager.get_base_question(phase), phase)
+    messages = [{"role": "system", "content": prompt}]
+
+    first_tokens, totals = [], []
+    for _ in range(runs):
+        try:
+            first_token, total = time_stream(backend, model, messages)
+        except Exception as e:
+            print(f"❌ Request failed: {e}")
+            continue
+        first_tokens.append(first_token)
+        totals.append(total)
+
+    if not totals:
+        return
+
+    print(f"   Runs: {len(totals)}/{runs}")
+    print(f"   Time to first token: median {statistics.median(first_tokens):.2f}s, max {max(first_tokens):.2f}s")
+    print(f"   Total time:          median {statistics.median(totals):.2f}s, max {max(totals):.2f}s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare LLM backends on the rephrasing prompt")
+    parser.add_argument('backends', nargs='+', help="Backend names (ollama, openai, llamacpp, vllm, fake)")
+    parser.add_argument('--model', default=REPHRASE_MODEL, help=f"Model name to request (default: {REPHRASE_MODEL})")
+    parser.add_argument('--runs', type=int, default=5, help="Requests per backend (default: 5)")
+    args = parser.parse_args()
+
+    print("📊 LLM Backend Benchmark")
+    print("=" * 50)
+
+    for name in args.backends:
+        benchmark_backend(name, args.model, args.runs)
+
+if __name__ == "__main__":
+    main()
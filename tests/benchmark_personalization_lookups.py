@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark script showing personalization lookups as the study database grows
+
+Fills a scratch database with synthetic memory rows spread across many users and
+times ConversationManager._personalize_question (the per-turn memory lookup) at
+each size, with and without the composite (user_id, timestamp) indexes.
+
+Usage: python tests/benchmark_personalization_lookups.py --sizes 10000 100000 1000000
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import argparse
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import Session
+
+from utils.cbt_database import Base, User, Situation, AutomaticThought, Emotion, Behavior, BackgroundInfo
+from utils.conversation_manager import ConversationManager
+
+MEMORY_TABLES = [Situation, AutomaticThought, Emotion, Behavior]
+BATCH_SIZE = 50000
+
+def grow_table(connection, model, start, stop, users):
+    """Insert rows with ids in [start, stop) spread randomly across users"""
+    base_time = datetime(2024, 1, 1)
+    for batch_start in range(start, stop, BATCH_SIZE):
+        rows = []
+        for row_id in range(batch_start, min(stop, batch_start + BATCH_SIZE)):
+            row = {'user_id': random.randint(1, users), 'timestamp': base_time + timedelta(seconds=row_id)}
+            if model is Situation:
+                row['description'] = f"Situation {row_id}"
+            elif model is AutomaticThought:
+                row['thought'] = f"Thought {row_id}"
+            elif model is Emotion:
+                row['emotion'] = f"Emotion {row_id}"
+            else:
+                row['action'] = f"Behavior {row_id}"
+            rows.append(row)
+        connection.execute(insert(model), rows)
+
+def time_lookups(engine, users, lookups):
+    """Median and p95 milliseconds for one personalized question lookup"""
+    conversation_manager = ConversationManager(None)
+    base_question = conversation_manager.get_base_question('situation_1')
+    timings = []
+    with Session(bind=engine) as session:
+        for _ in range(lookups):
+            user_id = random.randint(2, users)
+            started = time.perf_counter()
+            conversation_manager._personalize_question(base_question, 'situation_1', session, user_id)
+            timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return statistics.median(timings), timings[int(0.95 * (len(timings) - 1))]
+
+def set_indexes(engine, enabled):
+    for model in MEMORY_TABLES + [BackgroundInfo]:
+        for index in model.__table__.indexes:
+            if enabled:
+                index.create(engine, checkfirst=True)
+            else:
+                index.drop(engine, checkfirst=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Time personalization lookups as the memory tables grow")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000], help="Rows per memory table at each step")
+    parser.add_argument('--users', type=int, default=5000, help="Number of study participants (default: 5000)")
+    parser.add_argument('--lookups', type=int, default=200, help="Lookups timed per step (default: 200)")
+    args = parser.parse_args()
+
+    print("📊 Personalization Lookup Benchmark")
+    print("=" * 70)
+    print(f"{'rows/table':>12} {'indexed median':>16} {'indexed p95':>12} {'no index median':>17} {'no index p95':>13}")
+
+    with tempfile.TemporaryDirectory() as scratch:
+        engine = create_engine(f"sqlite:///{os.path.join(scratch, 'benchmark.db')}")
+        Base.metadata.create_all(engine)
+
+        with engine.begin() as connection:
+            connection.execute(insert(User), [{'identifier': f"user-{i}"} for i in range(1, args.users + 1)])
+            connection.execute(insert(BackgroundInfo), [
+                {'user_id': i, 'stress_response_patterns': f"Pattern {i}"} for i in range(1, args.users + 1)
+            ])
+
+        rows = 0
+        for size in sorted(args.sizes):
+            with engine.begin() as connection:
+                for model in MEMORY_TABLES:
+                    grow_table(connection, model, rows + 1, size + 1, args.users)
+            rows = size
+
+            set_indexes(engine, True)
+            indexed = time_lookups(engine, args.users, args.lookups)
+            set_indexes(engine, False)
+            unindexed = time_lookups(engine, args.users, args.lookups)
+            set_indexes(engine, True)
+
+            print(f"{size:>12,} {indexed[0]:>14.2f}ms {indexed[1]:>10.2f}ms {unindexed[0]:>15.2f}ms {unindexed[1]:>11.2f}ms")
+
+if __name__ == "__main__":
+    main()
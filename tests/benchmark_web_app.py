@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+
+"""
+Load test for a running web app: concurrent participants each complete a full assessment
+
+Every participant starts a session and answers all 14 questions over HTTP, as the
+browser does. Reports completed turns per second and per-turn latency; 503
+responses (LLM queue full) are counted separately from errors.
+
+Usage: python tests/benchmark_web_app.py --url http://localhost:5001 --participants 8 20 50
+Start the server with LLM_BACKEND=fake to measure the app itself rather than the model.
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import argparse
+import http.cookiejar
+import json
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+
+ANSWERS = [
+    "Work has been really stressful lately",
+    "My manager criticised my report in front of the whole team",
+    "I thought everyone could see I'm not good enough for this job",
+    "Embarrassed and anxious, my face went hot and my chest was tight",
+    "I kept quiet for the rest of the meeting and left early",
+    "My friend didn't reply to my message for two days",
+    "I assumed she was angry with me and didn't want to be friends",
+    "Sad and worried, I couldn't sleep properly",
+    "I checked my phone constantly and avoided messaging anyone else",
+    "I got a B on an exam I'd studied hard for",
+    "I thought I'm just not smart enough and never will be",
+    "Disappointed and hopeless, I felt heavy and tired",
+    "I stopped revising for the next exam",
+    "I usually expect the worst and withdraw; talking to my sister helps"
+]
+
+class Participant:
+    """One browser: a cookie jar for the Flask session and the timings of its turns"""
+
+    def __init__(self, url, personalization_type):
+        self.url = url.rstrip('/')
+        self.personalization_type = personalization_type
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+        self.latencies = []
+        self.overloaded = 0
+        self.errors = []
+
+    def post(self, path, payload):
+        request = urllib.request.Request(
+            self.url + path, data=json.dumps(payload).encode('utf-8'),
+            headers={'Content-Type': 'application/json'}
+        )
+        started = time.perf_counter()
+        try:
+            with self.opener.open(request, timeout=600) as response:
+                body = json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            if e.code == 503:
+                self.overloaded += 1
+            else:
+                self.errors.append(f"{path}: HTTP {e.code}")
+            return None
+        except Exception as e:
+            self.errors.append(f"{path}: {e}")
+            return None
+        self.latencies.append(time.perf_counter() - started)
+        return body
+
+    def run(self):
+        if self.post('/start_session', {'personalization_type': self.personalization_type}) is None:
+            return
+        for answer in ANSWERS:
+            if self.post('/send_message', {'message': answer}) is None:
+                return
+
+def run_load(url, participants, personalization_type):
+    """All participants at once; returns the summary row"""
+    crowd = [Participant(url, personalization_type) for _ in range(participants)]
+    threads = [threading.Thread(target=participant.run) for participant in crowd]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency for participant in crowd for latency in participant.latencies)
+    errors = [error for participant in crowd for error in participant.errors]
+    return {
+        'participants': participants,
+        'requests': len(latencies),
+        'seconds': elapsed,
+        'throughput': len(latencies) / elapsed,
+        'p50': statistics.median(latencies) if latencies else 0,
+        'p95': latencies[int(len(latencies) * 0.95) - 1] if latencies else 0,
+        'max': latencies[-1] if latencies else 0,
+        'overloaded': sum(participant.overloaded for participant in crowd),
+        'errors': errors
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test a running web app")
+    parser.add_argument('--url', default='http://localhost:5001')
+    parser.add_argument('--participants', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--personalization-type', default='with_personalization',
+                        choices=['with_personalization', 'without_personalization'])
+    args = parser.parse_args()
+
+    with urllib.request.urlopen(args.url.rstrip('/') + '/ready', timeout=30) as response:
+        print(f"✅ Server ready: {json.loads(response.read())}")
+
+    print(f"\n📊 {len(ANSWERS) + 1} requests per participant ({args.personalization_type})")
+    print(f"{'participants':>12} {'requests':>9} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8} {'503s':>5} {'errors':>7}")
+    for participants in args.participants:
+        row = run_load(args.url, participants, args.personalization_type)
+        print(f"{row['participants']:>12} {row['requests']:>9} {row['throughput']:>8.1f} "
+              f"{row['p50'] * 1000:>8.0f} {row['p95'] * 1000:>8.0f} {row['max'] * 1000:>8.0f} "
+              f"{row['overloaded']:>5} {len(row['errors']):>7}")
+        for error in row['errors'][:5]:
+            print(f"   ❌ {error}")
+
+if __name__ == "__main__":
+    main()
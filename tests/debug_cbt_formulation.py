@@ -12,7 +12,7 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 from utils.cbt_database import init_cbt_db, get_or_create_user, Situation, AutomaticThought, Emotion, Behavior, BackgroundInfo
 from utils.cbt_memory import CBTMemoryManager
 from utils.conversation_manager import ConversationManager
-import ollama
+from utils import llm
 
 def debug_data_storage_and_formulation():
     """Debug the entire data flow from storage to formulation"""
@@ -141,7 +141,7 @@ SITUATIONS EXPLORED:
         print("-" * 50)
         
         try:
-            response = ollama.chat(
+            response = llm.chat(
                 model=model,
                 messages=[
                     {"role": "system", "content": system_prompt},
@@ -183,7 +183,7 @@ CRITICAL INSTRUCTIONS:
 Create a CBT formulation that directly addresses the user's actual experiences with binge eating, academic stress, family conflicts, and restriction patterns."""
     
     try:
-        response = ollama.chat(
+        response = llm.chat(
             model="llama3.2",
             messages=[
                 {"role": "system", "content": explicit_prompt},
@@ -0,0 +1,17 @@
+"""
+Points the app's database, chat store, rephrase cache and variant bank at a temporary directory
+Import before web_app or utils.cbt_database so a test run leaves no files in the working directory
+"""
+
+import atexit
+import os
+import shutil
+import tempfile
+
+TEST_DIRECTORY = tempfile.mkdtemp(prefix='cbt_tests_')
+atexit.register(shutil.rmtree, TEST_DIRECTORY, ignore_errors=True)
+
+os.environ.setdefault('CBT_DATABASE_URL', f"sqlite:///{os.path.join(TEST_DIRECTORY, 'cbt_chatbot.db')}")
+os.environ.setdefault('CBT_SESSION_STORE_PATH', os.path.join(TEST_DIRECTORY, 'chat_sessions.db'))
+os.environ.setdefault('REPHRASE_CACHE_PATH', os.path.join(TEST_DIRECTORY, 'rephrase_cache.db'))
+os.environ.setdefault('VARIANT_BANK_PATH', os.path.join(TEST_DIRECTORY, 'variant_bank.bin'))
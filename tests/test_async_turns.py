@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+
+"""
+Test script for running conversation turns on an event loop, as async_web_app.py does
+Turns run inside AsyncSession.run_sync() share one thread while they wait on the model,
+and the Quart app serves a chat through its JSON and streaming routes
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import isolated_paths  # before the app's modules read their file paths
+
+import asyncio
+import json
+import pytest
+import tempfile
+import threading
+import time
+from sqlalchemy.orm import sessionmaker
+
+from utils import llm
+from utils.cbt_database import Base, Situation, Conversation, create_cbt_engine, async_database_url, get_or_create_user, save_conversation
+from utils.cbt_memory import CBTMemoryManager
+from utils.conversation_manager import ConversationManager
+from utils.formulation_engine import CBTFormulationEngine, FORMULATION_SECTIONS
+from utils.llm_admission import AdmissionController
+from utils.llm_backends import FakeBackend
+
+CHATS = 20
+MODEL_SECONDS = 0.2
+
+class SlowBackend(FakeBackend):
+    """Fake model that takes MODEL_SECONDS to answer and records which thread awaited it"""
+
+    def __init__(self):
+        super().__init__()
+        self.threads = set()
+
+    async def achat(self, model, messages, options=None, **kwargs):
+        self.threads.add(threading.get_ident())
+        await asyncio.sleep(MODEL_SECONDS)
+        return await super().achat(model, messages, options=options, **kwargs)
+
+def test_concurrent_async_turns():
+    """Twenty chats waiting on a slow model overlap on one thread, and their turns are saved"""
+    print("🔄 Testing conversation turns on an event loop")
+    print("="*70)
+
+    pytest.importorskip('greenlet')
+    pytest.importorskip('aiosqlite')
+    from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+
+    backend = SlowBackend()
+    saved_backend, saved_admission = llm._backend, llm.admission
+    llm.set_backend(backend)
+    llm.admission = AdmissionController(max_concurrent=CHATS)
+
+    with tempfile.TemporaryDirectory() as directory:
+        url = f"sqlite:///{os.path.join(directory, 'async_turns.db')}"
+        engine = create_cbt_engine(url)
+        Base.metadata.create_all(engine)
+        with sessionmaker(bind=engine)() as session:
+            chats = [
+                ConversationManager(CBTMemoryManager(None, user_id=get_or_create_user(session, f"async_user_{n}").id))
+                for n in range(CHATS)
+            ]
+
+        async_engine = create_async_engine(async_database_url(url))
+
+        def run_turn(conversation_manager, text):
+            # The same synchronous code the threaded app runs
+            with conversation_manager.turn():
+                conversation_manager.save_response_data(text)
+                conversation_manager.advance_phase()
+                question = conversation_manager.get_contextual_starter_without_personalization()
+                save_conversation(conversation_manager.memory.session, conversation_manager.memory.user_id, text, question, {})
+            return question
+
+        async def answer(conversation_manager, text):
+            async with AsyncSession(async_engine) as session:
+                conversation_manager.memory.bind(session.sync_session)
+                try:
+                    return await session.run_sync(lambda sync_session: run_turn(conversation_manager, text))
+                finally:
+                    conversation_manager.memory.release()
+
+        async def formulate(conversation_manager):
+            async with AsyncSession(async_engine) as session:
+                conversation_manager.memory.bind(session.sync_session)
+                try:
+                    return await session.run_sync(lambda sync_session: CBTFormulationEngine(conversation_manager).generate())
+                finally:
+                    conversation_manager.memory.release()
+
+        async def run_chats():
+            await asyncio.gather(*(answer(chat, "Work has been stressful") for chat in chats))
+            await asyncio.gather(*(answer(chat, "My boss criticised my report") for chat in chats))
+            started = time.perf_counter()
+            formulation = await formulate(chats[0])
+            return formulation, time.perf_counter() - started
+
+        try:
+            started = time.perf_counter()
+            formulation, formulation_seconds = asyncio.run(run_chats())
+            elapsed = time.perf_counter() - started - formulation_seconds
+        finally:
+            llm.set_backend(saved_backend)
+            llm.admission = saved_admission
+        asyncio.run(async_engine.dispose())
+
+        print(f"   {CHATS * 2} turns in {elapsed:.2f}s with a {MODEL_SECONDS}s model; formulation in {formulation_seconds:.2f}s")
+        # Serialized, the rephrasing calls alone would take CHATS * 2 * MODEL_SECONDS
+        assert elapsed < CHATS * MODEL_SECONDS
+        assert formulation_seconds < len(FORMULATION_SECTIONS) * MODEL_SECONDS
+        assert backend.threads == {threading.main_thread().ident}
+        assert len(backend.calls) >= CHATS * 2 + len(FORMULATION_SECTIONS)
+
+        with sessionmaker(bind=engine)() as session:
+            assert session.query(Conversation).count() == CHATS * 2
+            assert session.query(Situation).count() == CHATS
+        assert all(chat.get_current_phase() == 'thoughts_1' for chat in chats)
+        assert formulation.startswith("Based on everything you've shared")
+
+    print(f"\n🎉 Async turns overlapped while waiting on the model!")
+
+def sse_events(body):
+    """(event, payload) pairs from a Server-Sent Events response body"""
+    events = []
+    for message in body.split('\n\n'):
+        lines = dict(line.split(': ', 1) for line in message.splitlines() if ': ' in line)
+        if 'event' in lines:
+            events.append((lines['event'], json.loads(lines['data'])))
+    return events
+
+def test_async_app_routes():
+    """A chat started, answered and downloaded through the Quart app, plain and streamed"""
+    print("🔄 Testing the async web app routes")
+    print("="*70)
+
+    pytest.importorskip('quart')
+    pytest.importorskip('greenlet')
+    pytest.importorskip('aiosqlite')
+    import async_web_app
+    from utils.cbt_database import get_async_engine
+
+    async def run_chat():
+        client = async_web_app.app.test_client()
+
+        response = await client.post('/start_session', json={'personalization_type': 'without_personalization'})
+        assert response.status_code == 200
+        greeting = (await response.get_json())['message']
+
+        response = await client.post('/send_message', json={'message': "Work has been stressful"})
+        assert response.status_code == 200
+        answer = await response.get_json()
+
+        response = await client.post('/send_message/stream', json={'message': "My boss criticised my report"})
+        assert response.status_code == 200
+        assert response.mimetype == 'text/event-stream'
+        events = sse_events(await response.get_data(as_text=True))
+
+        response = await client.get('/download_report')
+        assert response.status_code == 200
+        report = await response.get_data(as_text=True)
+
+        response = await client.post('/start_session/stream', json={'personalization_type': 'without_personalization'})
+        greeting_events = sse_events(await response.get_data(as_text=True))
+
+        await get_async_engine().dispose()
+        return greeting, answer, events, report, greeting_events
+
+    saved_backend = llm._backend
+    llm.set_backend(FakeBackend())
+    try:
+        greeting, answer, events, report, greeting_events = asyncio.run(run_chat())
+    finally:
+        llm.set_backend(saved_backend)
+
+    print(f"   Greeting: {greeting[:60]}...")
+    print(f"   Streamed events: {[event for event, _ in events]}")
+    assert greeting
+    assert answer['success'] and answer['phase'] == 'situation_1'
+
+    event, done = events[-1]
+    assert event == 'done'
+    assert done['phase'] == 'thoughts_1' and not done['session_ended']
+    assert any(event == 'token' for event, _ in events)
+
+    assert "Work has been stressful" in report and "My boss criticised my report" in report
+    assert done['message'] in report
+
+    event, done = greeting_events[-1]
+    assert event == 'done' and done['message'] and done['session_id']
+    assert greeting_events[0][0] == 'token'
+
+    print(f"\n🎉 Async app served the chat over JSON and SSE!")
+
+if __name__ == "__main__":
+    test_concurrent_async_turns()
+    test_async_app_routes()
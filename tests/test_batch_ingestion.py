@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+"""
+Test script for batch ingestion of NLP extractions
+A whole extraction is written in one transaction, one INSERT per table, with links resolved
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from utils.cbt_database import Base, Situation, AutomaticThought, ThoughtMeaning, Emotion, Behavior, get_or_create_user
+from utils.cbt_memory import CBTMemoryManager
+from utils.cbt_nlp_extractor import CBTNLPExtractor
+
+def make_extraction(n):
+    """An extraction shaped like CBTNLPExtractor output with two linked situations"""
+    return {
+        'situations': [
+            {'description': f"Presentation {n}", 'context': "work", 'category': "work"},
+            {'description': f"Argument {n}", 'category': "family"}
+        ],
+        'automatic_thoughts': [
+            {'thought': f"I'll embarrass myself {n}", 'situation_description': f"Presentation {n}"},
+            {'thought': f"Nobody listens {n}", 'situation_description': f"Argument {n}"}
+        ],
+        'thought_meanings': [
+            {'meaning': f"I'm incompetent {n}", 'linked_thought': f"I'll embarrass myself {n}"}
+        ],
+        'emotions': [
+            {'emotion': "anxiety", 'intensity': "high", 'linked_situation': f"Presentation {n}", 'linked_thought': f"I'll embarrass myself {n}"},
+            {'emotion': "anger", 'intensity': "medium", 'linked_situation': f"Argument {n}"}
+        ],
+        'behaviors': [
+            {'action': f"Avoided eye contact {n}", 'behavior_type': "avoidance", 'linked_thought': f"I'll embarrass myself {n}"}
+        ],
+        'core_beliefs': ["I am not good enough"],
+        'coping_strategies': [f"Deep breathing {n}"]
+    }
+
+def build_memory():
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    return engine, session, CBTMemoryManager(session, get_or_create_user(session, "batch_user"))
+
+def test_update_cbt_memory_single_transaction():
+    """update_cbt_memory writes a rich extraction with one commit and one INSERT statement per table"""
+    print("🔄 Testing batch ingestion of one extraction")
+    print("="*70)
+
+    engine, session, memory = build_memory()
+    commits, inserts = [], []
+    event.listen(engine, 'commit', lambda conn: commits.append(conn))
+    event.listen(engine, 'before_cursor_execute',
+                 lambda conn, cursor, statement, *args: statement.startswith('INSERT') and inserts.append(statement))
+
+    created = CBTNLPExtractor().update_cbt_memory(memory, make_extraction(1))
+
+    print(f"   {len(commits)} commit(s), {len(set(inserts))} INSERT statement(s) run {len(inserts)} time(s)")
+    assert len(commits) == 1
+    # One per memory table, plus the new beliefs record. SQLite runs each once per row,
+    # as it cannot otherwise return the new ids in parameter order
+    assert len(set(inserts)) == 6
+    assert [len(created[table]) for table in ('situations', 'automatic_thoughts', 'thought_meanings', 'emotions', 'behaviors')] == [2, 2, 1, 2, 1]
+
+    presentation = session.get(Situation, created['situations'][0])
+    thought = session.get(AutomaticThought, created['automatic_thoughts'][0])
+    assert thought.situation_id == presentation.id
+    assert session.get(ThoughtMeaning, created['thought_meanings'][0]).automatic_thought_id == thought.id
+    anxiety = session.get(Emotion, created['emotions'][0])
+    assert (anxiety.situation_id, anxiety.automatic_thought_id) == (presentation.id, thought.id)
+    anger = session.get(Emotion, created['emotions'][1])
+    assert anger.situation_id == created['situations'][1] and anger.automatic_thought_id is None
+    assert session.get(Behavior, created['behaviors'][0]).automatic_thought_id == thought.id
+    assert memory.get_beliefs().core_beliefs == ["I am not good enough"]
+
+    print(f"\n🎉 Extraction stored in one transaction with links resolved!")
+
+def test_add_extractions_backfill():
+    """Many extractions share one transaction and link only within their own extraction"""
+    print("🔄 Testing backfill of many extractions")
+    print("="*70)
+
+    engine, session, memory = build_memory()
+    commits = []
+    event.listen(engine, 'commit', lambda conn: commits.append(conn))
+
+    created = memory.add_extractions([make_extraction(n) for n in range(50)])
+
+    print(f"   50 extractions -> {len(commits)} commit(s)")
+    assert len(commits) == 1
+    assert len(created) == 50
+    assert session.query(Situation).count() == 100
+    for n, ids in enumerate(created):
+        thought = session.get(AutomaticThought, ids['automatic_thoughts'][1])
+        assert thought.situation.description == f"Argument {n}"
+    beliefs = memory.get_beliefs()
+    assert beliefs.core_beliefs == ["I am not good enough"]
+    assert len(beliefs.coping_strategies) == 50
+
+    print(f"\n🎉 Backfill stored in one transaction!")
+
+if __name__ == "__main__":
+    test_update_cbt_memory_single_transaction()
+    test_add_extractions_backfill()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+"""
+Test script to pin the number of SQL statements used to build the conversation context
+Linked situations and thoughts must be loaded with their rows, not lazily one row at a time
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from utils.cbt_database import Base, get_or_create_user
+from utils.cbt_memory import CBTMemoryManager
+
+# situations, thoughts, emotions, behaviors, beliefs and background
+EXPECTED_STATEMENTS = 6
+
+def build_memory(rows):
+    """Fresh in-memory database with `rows` linked situation/thought/emotion/behavior sets"""
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    user = get_or_create_user(session, "query_count_user")
+    memory = CBTMemoryManager(session, user)
+
+    linked = []
+    for i in range(rows):
+        situation = memory.add_situation(f"Linked situation {i}")
+        thought = memory.add_automatic_thought(f"Linked thought {i}", situation)
+        linked.append((situation, thought))
+    # Newer rows push the linked situations out of the recent situations list, and
+    # the emotions and behaviors link to thoughts outside the recent thoughts list
+    for i in range(5):
+        memory.add_situation(f"Recent situation {i}")
+        memory.add_automatic_thought(f"Recent thought {i}")
+    for i, (situation, thought) in enumerate(linked):
+        memory.add_emotion(f"Emotion {i}", "medium", situation=situation, automatic_thought=thought)
+        memory.add_behavior(f"Behavior {i}", situation=situation, automatic_thought=thought)
+    memory.update_beliefs({'core_beliefs': ["I am not good enough"]})
+    memory.update_background_info({'functioning': {'chief_complaint': "Work stress"}})
+    session.close()
+
+    # Start from a new session with an empty identity map, as a new request would
+    session = sessionmaker(bind=engine)()
+    return engine, CBTMemoryManager(session, get_or_create_user(session, "query_count_user"))
+
+def count_context_statements(rows):
+    engine, memory = build_memory(rows)
+    statements = []
+    event.listen(engine, 'before_cursor_execute', lambda conn, cursor, statement, *args: statements.append(statement))
+
+    context = memory.get_context_for_conversation()
+
+    assert len(context['recent_emotions']) == min(rows, 5)
+    if rows:
+        assert context['recent_emotions'][0]['linked_situation'] is not None
+        assert context['recent_behaviors'][0]['linked_thought'] is not None
+    return len(statements)
+
+def test_context_query_count():
+    """The statement count is fixed and does not grow with the number of rows"""
+    print("🔄 Testing get_context_for_conversation query count")
+    print("="*70)
+
+    for rows in (1, 5, 20):
+        count = count_context_statements(rows)
+        print(f"   {rows:>2} linked rows -> {count} statements")
+        assert count == EXPECTED_STATEMENTS, f"expected {EXPECTED_STATEMENTS} statements, got {count}"
+
+    print(f"\n🎉 Context builds in {EXPECTED_STATEMENTS} statements regardless of row count!")
+
+def test_cached_context_query_count():
+    """An unchanged context costs no statements; a write rebuilds only its own section"""
+    print("🔄 Testing cached context invalidation")
+    print("="*70)
+
+    engine, memory = build_memory(5)
+    statements = []
+    event.listen(engine, 'before_cursor_execute', lambda conn, cursor, statement, *args: statements.append(statement))
+
+    memory.get_context_for_conversation()
+    statements.clear()
+    memory.get_context_for_conversation()
+    print(f"   Unchanged context -> {len(statements)} statements")
+    assert len(statements) == 0
+
+    memory.add_situation("A brand new situation")
+    statements.clear()
+    context = memory.get_context_for_conversation()
+    print(f"   After a new situation -> {len(statements)} statements")
+    # The situations query, plus reloading the user the commit expired
+    assert len(statements) <= 2
+    assert context['recent_situations'][0]['description'] == "A brand new situation"
+
+    print(f"\n🎉 Cached context is reused and invalidated per section!")
+
+if __name__ == "__main__":
+    test_context_query_count()
+    test_cached_context_query_count()
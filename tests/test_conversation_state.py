@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+"""
+Test script for serializing a chat's ConversationManager state
+A chat rebuilt from its state blob on another worker carries on exactly where it left off
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import json
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from utils.cbt_database import Base, Emotion, Situation, get_or_create_user
+from utils.cbt_memory import CBTMemoryManager
+from utils.conversation_manager import ConversationManager
+
+def answer(session_factory, conversation_manager, text):
+    """One request: bind a fresh session, save the answer and move on"""
+    with session_factory() as session:
+        conversation_manager.memory.bind(session)
+        try:
+            with conversation_manager.turn():
+                conversation_manager.save_response_data(text)
+                conversation_manager.advance_phase()
+        finally:
+            conversation_manager.memory.release()
+
+def test_state_round_trip():
+    """Phase, name and situation ids survive JSON, and later answers link to the stored situation"""
+    print("🔄 Testing ConversationManager state round trip")
+    print("="*70)
+
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    session_factory = sessionmaker(bind=engine)
+    with session_factory() as session:
+        memory = CBTMemoryManager(session, get_or_create_user(session, "state_user"))
+        memory.release()
+
+    conversation_manager = ConversationManager(memory)
+    for text in ["Work has been stressful", "My boss criticised my report", "I'm going to get fired"]:
+        answer(session_factory, conversation_manager, text)
+
+    blob = json.dumps(conversation_manager.to_state(), separators=(',', ':'))
+    print(f"   State blob: {len(blob)} bytes")
+    assert len(blob) < 300
+
+    # Another worker rebuilds the chat from the blob alone
+    restored = ConversationManager.from_state(json.loads(blob))
+    assert restored.get_current_phase() == conversation_manager.get_current_phase() == 'emotions_1'
+    assert restored.memory.user_id == memory.user_id
+    assert restored.current_situation_data == conversation_manager.current_situation_data
+
+    answer(session_factory, restored, "Anxious and shaky")
+    with session_factory() as session:
+        emotion = session.query(Emotion).one()
+        assert emotion.situation_id == session.query(Situation).one().id
+    assert restored.get_current_phase() == 'behavior_1'
+
+    try:
+        ConversationManager.from_state({**json.loads(blob), 'version': 0})
+        assert False, "an unknown state version must be rejected"
+    except ValueError:
+        pass
+
+    print(f"\n🎉 Rebuilt chat continued where it left off!")
+
+if __name__ == "__main__":
+    test_state_round_trip()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+
+"""
+Test script for running the CBT database on a configurable backend
+Runs against CBT_TEST_DATABASE_URL (e.g. a local PostgreSQL) or an in-memory SQLite stand-in
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import asyncio
+from sqlalchemy import inspect, select, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.schema import CreateTable
+
+from utils.cbt_database import (Base, User, CBTBeliefs, Conversation, Emotion, Situation, create_cbt_engine,
+                                async_database_url, get_or_create_user, save_conversation)
+from utils.cbt_memory import CBTMemoryManager
+from utils.conversation_manager import ConversationManager
+from utils.memory_snapshot import MemorySnapshot
+from utils.migrations import run_migrations
+
+TEST_DATABASE_URL = os.environ.get('CBT_TEST_DATABASE_URL', 'sqlite://')
+
+ANSWERS = ["Work has been stressful", "My boss criticised my report in front of the whole team",
+           "I'm going to get fired", "Anxious and shaky, my chest was tight and I couldn't stop replaying the meeting"]
+
+def make_engine():
+    """A clean schema on the test database"""
+    engine = create_cbt_engine(TEST_DATABASE_URL)
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    run_migrations(engine)
+    return engine
+
+def test_postgresql_schema():
+    """JSON columns become JSONB and every table compiles for PostgreSQL"""
+    print("🔄 Testing the PostgreSQL schema")
+    print("="*70)
+
+    dialect = postgresql.dialect()
+    for column in (CBTBeliefs.core_beliefs, CBTBeliefs.intermediate_beliefs, CBTBeliefs.coping_strategies, Conversation.context):
+        assert isinstance(column.type.dialect_impl(dialect), JSONB), column
+    for table in Base.metadata.sorted_tables:
+        CreateTable(table).compile(dialect=dialect)
+
+    assert async_database_url('postgresql+psycopg2://cbt@localhost/cbt').drivername == 'postgresql+asyncpg'
+    assert async_database_url('sqlite:///cbt_chatbot.db').drivername == 'sqlite+aiosqlite'
+
+    print(f"\n🎉 Schema is PostgreSQL-ready!")
+
+def test_conversation_on_backend():
+    """A chat's turns, extraction, context and snapshot work the same on the test database"""
+    print(f"🔄 Testing a conversation on {make_url(TEST_DATABASE_URL).get_backend_name()}")
+    print("="*70)
+
+    engine = make_engine()
+    session_factory = sessionmaker(bind=engine)
+    with session_factory() as session:
+        memory = CBTMemoryManager(session, get_or_create_user(session, "backend_user"))
+        conversation_manager = ConversationManager(memory)
+        for answer in ANSWERS:
+            with conversation_manager.turn():
+                conversation_manager.save_response_data(answer)
+                conversation_manager.advance_phase()
+                save_conversation(session, memory.user_id, answer, "Next question", memory.get_context_for_conversation())
+
+        memory.add_extraction({
+            'situations': [{'description': "Team meeting", 'category': "work"}],
+            'automatic_thoughts': [{'thought': "Everyone thinks I'm useless", 'situation_description': "Team meeting"}],
+            'core_beliefs': ["I am not good enough"],
+            'coping_strategies': ["Deep breathing"]
+        })
+        memory.update_beliefs({'core_beliefs': ["I am not good enough", "I am unlovable"]})
+
+        context = memory.get_context_for_conversation()
+        snapshot = MemorySnapshot.load(session, [memory.user_id])
+        user_id = memory.user_id
+
+    with session_factory() as session:
+        beliefs = session.query(CBTBeliefs).filter_by(user_id=user_id).one()
+        assert beliefs.core_beliefs == ["I am not good enough", "I am unlovable"]
+        assert beliefs.coping_strategies == ["Deep breathing"]
+
+        logged = session.scalars(select(Conversation).order_by(Conversation.id)).all()
+        assert len(logged) == len(ANSWERS)
+        assert logged[-1].context['recent_situations'][0]['description'] == ANSWERS[1]
+
+        emotion = session.query(Emotion).one()
+        assert emotion.emotion == ANSWERS[3]
+        assert emotion.situation.description == ANSWERS[1]
+        assert session.query(Situation).count() == 2
+
+    assert context['recent_automatic_thoughts'][0]['thought'] == "Everyone thinks I'm useless"
+    assert [row.description for row in snapshot.recent('situations')] == ["Team meeting", ANSWERS[1]]
+
+    print(f"   {len(logged)} turns logged, beliefs {beliefs.core_beliefs}")
+    print(f"\n🎉 Conversation stored and read back on the test database!")
+
+def test_async_engine():
+    """The asyncio engine reads what the synchronous engine wrote, when its driver is installed"""
+    print("🔄 Testing the asyncio engine")
+    print("="*70)
+
+    try:
+        from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+        url = async_database_url(TEST_DATABASE_URL)
+        async_engine = create_async_engine(url)
+    except ImportError as e:
+        print(f"   Skipped - asyncio driver not installed: {e}")
+        return
+
+    if url.database in (None, '', ':memory:'):
+        print("   Skipped - an in-memory database is not shared between engines")
+        return
+
+    engine = make_engine()
+    with sessionmaker(bind=engine)() as session:
+        get_or_create_user(session, "async_user")
+
+    async def read_user_count():
+        async with AsyncSession(async_engine) as session:
+            # Synchronous ORM code runs unchanged through run_sync
+            return await session.run_sync(lambda sync_session: sync_session.query(User).filter_by(identifier="async_user").count())
+
+    assert asyncio.run(read_user_count()) == 1
+    asyncio.run(async_engine.dispose())
+
+    print(f"\n🎉 Asyncio engine shares the database!")
+
+def test_migrations_create_model_indexes():
+    """A database from before the indexes were added ends up with every index the models declare"""
+    print("🔄 Testing migrations against the models' indexes")
+    print("="*70)
+
+    engine = create_cbt_engine(TEST_DATABASE_URL)
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.drop(connection)
+        connection.execute(text("DROP TABLE IF EXISTS schema_version"))
+
+    applied = run_migrations(engine)
+    print(f"   Applied migrations {applied}")
+
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        expected = {index.name for index in table.indexes}
+        missing = expected - {index['name'] for index in inspector.get_indexes(table.name)}
+        assert not missing, f"no migration creates {sorted(missing)} on {table.name}"
+
+    print(f"\n🎉 Migrations create every model index!")
+
+if __name__ == "__main__":
+    test_postgresql_schema()
+    test_conversation_on_backend()
+    test_async_engine()
+    test_migrations_create_model_indexes()
@@ -12,7 +12,7 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 from utils.cbt_database import init_cbt_db, get_or_create_user
 from utils.cbt_memory import CBTMemoryManager
 from utils.conversation_manager import ConversationManager
-import ollama
+from utils import llm
 
 def simulate_full_conversation(personalization_type, user_responses):
     """Simulate full conversation with given personalization type"""
@@ -150,7 +150,7 @@ SITUATIONS EXPLORED:
         formulation_context += f"\nIDENTIFIED PATTERNS:\n{background.stress_response_patterns}\n"
     
     try:
-        response = ollama.chat(
+        response = llm.chat(
             model="llama3.2",
             messages=[
                 {"role": "system", "content": system_prompt},
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+"""
+Test script for the Ollama health probe
+Model lists from old and new clients are read, and an unreadable one does not trip the circuit
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+
+from utils.llm_health import CircuitBreaker, HealthMonitor, CIRCUIT_CLOSED
+
+class StubClient:
+    """Stands in for ollama.Client, returning a fixed model list"""
+
+    def __init__(self, models):
+        self.models = models
+
+    def list(self):
+        return self.models
+
+def ollama_backend(models):
+    """OllamaBackend whose server answers list() with `models`"""
+    pytest.importorskip('ollama')
+    from utils.llm_backends import OllamaBackend
+
+    backend = OllamaBackend(host='http://localhost:11434')
+    backend._client = StubClient(models)
+    return backend
+
+def test_ollama_health_reads_model_names():
+    """Entries named 'model' (current clients) and 'name' (older clients) are both listed"""
+    print("🔄 Testing the Ollama health probe")
+    print("="*70)
+    pytest.importorskip('ollama')
+
+    from ollama import ListResponse
+
+    status = ollama_backend(ListResponse(models=[{'model': 'llama3.2:latest'}])).health()
+    print(f"   {status}")
+    assert status == {'ok': True, 'models': ['llama3.2:latest'], 'error': None}
+
+    assert ollama_backend({'models': [{'name': 'llama3.2'}]}).health()['models'] == ['llama3.2']
+
+    print(f"\n🎉 Model names read from both client versions!")
+
+def test_unreadable_model_list_is_degraded():
+    """A server that answers with something unexpected is degraded, not failing"""
+    print("🔄 Testing an unreadable model list")
+    print("="*70)
+
+    backend = ollama_backend(['not', 'a', 'model', 'list'])
+    breaker = CircuitBreaker(failure_threshold=1)
+    monitor = HealthMonitor(backend.health, breaker)
+
+    for _ in range(3):
+        status = monitor.check()
+    print(f"   {status}")
+    assert status['ok'] and status['degraded']
+    assert breaker.state == CIRCUIT_CLOSED
+
+    print(f"\n🎉 Degraded probe left the circuit closed!")
+
+if __name__ == "__main__":
+    test_ollama_health_reads_model_names()
+    test_unreadable_model_list_is_degraded()
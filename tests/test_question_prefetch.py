@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+"""
+Test script for collecting a speculatively prefetched question
+A prefetch still running when the turn needs it is abandoned within the latency budget
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import threading
+import time
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from utils import llm
+from utils.cbt_database import Base, get_or_create_user
+from utils.cbt_memory import CBTMemoryManager
+from utils.conversation_manager import ConversationManager
+from utils.llm_latency import LatencyBudget
+
+BUDGET = 0.2
+
+class StuckPrefetch(ConversationManager):
+    """Chat whose background question build waits until released, like one queued behind the model"""
+
+    def __init__(self, memory_manager):
+        super().__init__(memory_manager)
+        self.release_prefetch = threading.Event()
+
+    def _build_question(self, phase, personalized, session, user_id, rephrase=True):
+        if threading.current_thread().name.startswith('question-prefetch'):
+            self.release_prefetch.wait(10)
+            return "Late rephrased question", []
+        return super()._build_question(phase, personalized, session, user_id, rephrase=rephrase)
+
+def test_slow_prefetch_falls_back():
+    """The turn stops waiting after the budget and asks the base question"""
+    print("🔄 Testing a prefetch that misses the latency budget")
+    print("="*70)
+
+    engine = create_engine('sqlite://', connect_args={'check_same_thread': False})
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    conversation_manager = StuckPrefetch(CBTMemoryManager(session, get_or_create_user(session, "prefetch_user")))
+
+    saved_budget = llm.budget
+    llm.budget = LatencyBudget(llm.latency, default_budget=BUDGET, min_budget=BUDGET, max_budget=BUDGET)
+    try:
+        conversation_manager.prefetch_next_question(personalized=False)
+        conversation_manager.advance_phase()
+
+        started = time.perf_counter()
+        question = conversation_manager.get_contextual_starter_without_personalization()
+        elapsed = time.perf_counter() - started
+    finally:
+        conversation_manager.release_prefetch.set()
+        llm.budget = saved_budget
+
+    print(f"   Question after {elapsed:.2f}s: {question[:60]}...")
+    assert elapsed < BUDGET + 0.5
+    assert question == conversation_manager.get_base_question('situation_1')
+
+    print(f"\n🎉 Slow prefetch abandoned within the budget!")
+
+if __name__ == "__main__":
+    test_slow_prefetch_falls_back()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+"""
+Test script for resuming a chat from the database after a restart
+The phase, situation ids and name come back from a few indexed reads, without the LLM
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from utils.cbt_database import Base, Emotion, Situation, get_conversation_log, get_or_create_user, save_conversation
+from utils.cbt_memory import CBTMemoryManager
+from utils.conversation_manager import ConversationManager
+
+ANSWERS = [
+    "I'm Sam and work has been stressful",
+    "My boss criticised my report",
+    "I'm going to get fired",
+    "Anxious and shaky",
+    "I left the meeting early",
+    "My friend didn't reply to my message"
+]
+
+def answer(session_factory, conversation_manager, text):
+    """One request: save the answer, move on and log the exchange, as the web app does"""
+    with session_factory() as session:
+        conversation_manager.memory.bind(session)
+        try:
+            with conversation_manager.turn():
+                conversation_manager.save_response_data(text)
+                conversation_manager.advance_phase()
+                save_conversation(session, conversation_manager.memory.user_id, text, f"Question for {conversation_manager.get_current_phase()}", {})
+        finally:
+            conversation_manager.memory.release()
+
+def test_resume_from_database():
+    """A chat rebuilt from its committed rows carries on exactly where the live one was"""
+    print("🔄 Testing session resume from the database")
+    print("="*70)
+
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    session_factory = sessionmaker(bind=engine)
+    with session_factory() as session:
+        user_id = get_or_create_user(session, "resume_user").id
+        save_conversation(session, user_id, "", "Greeting", {})
+
+    live = ConversationManager(CBTMemoryManager(None, user_id=user_id))
+    for text in ANSWERS:
+        answer(session_factory, live, text)
+
+    # The server restarts: only the database is left
+    statements = []
+    event.listen(engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+    with session_factory() as session:
+        log = get_conversation_log(session, user_id)
+        resumed = ConversationManager.from_database(session, user_id, [row.message for row in log[1:]])
+
+    print(f"   Resumed at {resumed.get_current_phase()} with {len(statements)} statement(s)")
+    assert len(statements) == 2
+    assert resumed.get_current_phase() == live.get_current_phase() == 'thoughts_2'
+    assert resumed.current_situation_data == live.current_situation_data
+    assert set(resumed.current_situation_data) == {'situation_1', 'situation_2'}
+    assert resumed.user_name == live.user_name == 'Sam'
+
+    # The next answer links to the second situation, as it would have without the restart
+    answer(session_factory, resumed, "She must be angry with me")
+    answer(session_factory, resumed, "Sad and worried")
+    with session_factory() as session:
+        emotion = session.query(Emotion).order_by(Emotion.id.desc()).first()
+        assert emotion.situation_id == resumed.current_situation_data['situation_2']
+        assert session.get(Situation, emotion.situation_id).description == ANSWERS[5]
+    assert resumed.get_current_phase() == 'behavior_2'
+
+    # A chat that has only seen the greeting resumes at the introduction
+    with session_factory() as session:
+        fresh = ConversationManager.from_database(session, user_id, [])
+    assert fresh.get_current_phase() == 'introduction'
+
+    print(f"\n🎉 Resumed chat continued where it left off!")
+
+if __name__ == "__main__":
+    test_resume_from_database()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+"""
+Test script for the chat session stores
+Idle chats expire, the least recently used are evicted, and closed chats release their resources
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import tempfile
+import time
+
+from utils.session_store import InMemorySessionStore, SQLiteSessionStore, estimate_size
+
+def make_chat(n):
+    return {'user_id': n, 'conversation_history': [{'sender': 'User', 'message': f"Message {n}" * 20}]}
+
+def exercise_store(store, closed):
+    """LRU eviction, TTL expiry and deletion behave the same on every backend"""
+    for n in range(3):
+        store.put(f"chat_{n}", make_chat(n))
+
+    # chat_0 was used most recently, so chat_1 is evicted when chat_3 arrives
+    assert store.get("chat_0")['user_id'] == 0
+    store.put("chat_3", make_chat(3))
+    assert "chat_1" not in store
+    assert closed == ["chat_1"]
+
+    stats = store.stats()
+    assert stats['live_sessions'] == 3 and stats['evicted'] == 1
+    assert stats['bytes'] > 0
+
+    store.delete("chat_2")
+    assert "chat_2" not in store and closed[-1] == "chat_2"
+
+    # Idle chats expire; reap() removes them and closes their resources
+    time.sleep(store.ttl_seconds * 2)
+    assert store.reap() == 2
+    assert sorted(closed[-2:]) == ["chat_0", "chat_3"]
+    assert store.stats()['live_sessions'] == 0 and store.stats()['expired'] == 2
+
+def test_in_memory_store():
+    """The in-memory store bounds live chats and closes the ones it drops"""
+    print("🔄 Testing the in-memory session store")
+    print("="*70)
+
+    closed = []
+    store = InMemorySessionStore(ttl_seconds=0.2, max_sessions=3, on_close=lambda session_id, data: closed.append(session_id))
+    exercise_store(store, closed)
+
+    # Reading an expired chat treats it as gone
+    store.put("chat_4", make_chat(4))
+    time.sleep(0.4)
+    assert store.get("chat_4") is None and closed[-1] == "chat_4"
+
+    print(f"   Closed in order: {closed}")
+    print(f"\n🎉 In-memory store evicts and expires chats!")
+
+def test_sqlite_store():
+    """The SQLite store keeps chats across store instances and bounds them the same way"""
+    print("🔄 Testing the SQLite session store")
+    print("="*70)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'sessions.db')
+        closed = []
+        store = SQLiteSessionStore(path, ttl_seconds=0.2, max_sessions=3, on_close=lambda session_id, data: closed.append(session_id))
+
+        store.put("shared", make_chat(7))
+        other_worker = SQLiteSessionStore(path, ttl_seconds=0.2, max_sessions=3)
+        assert other_worker.get("shared") == make_chat(7)
+        store.delete("shared")
+        closed.clear()
+
+        exercise_store(store, closed)
+
+    print(f"   Closed in order: {closed}")
+    print(f"\n🎉 SQLite store shares, evicts and expires chats!")
+
+def test_reaper_and_size():
+    """The background reaper expires idle chats; shared objects are left out of the byte count"""
+    print("🔄 Testing the session reaper")
+    print("="*70)
+
+    shared_cache = {'variants': ["x" * 1000] * 100}
+    chat = {**make_chat(1), 'cache': shared_cache}
+    assert estimate_size(chat, exclude=(shared_cache,)) < estimate_size(chat)
+
+    closed = []
+    store = InMemorySessionStore(ttl_seconds=0.1, on_close=lambda session_id, data: closed.append(session_id))
+    store.put("idle", chat)
+    store.start_reaper(interval=0.05)
+    deadline = time.time() + 5
+    while not closed and time.time() < deadline:
+        time.sleep(0.05)
+    store.stop_reaper()
+
+    assert closed == ["idle"]
+    print(f"\n🎉 Reaper closed the idle chat!")
+
+if __name__ == "__main__":
+    test_in_memory_store()
+    test_sqlite_store()
+    test_reaper_and_size()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+"""
+Test script for the per-turn unit of work
+A turn's writes are committed once, and a failing turn leaves nothing behind
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from utils.cbt_database import Base, Situation, Emotion, Conversation, BackgroundInfo, get_or_create_user, save_conversation
+from utils.cbt_memory import CBTMemoryManager
+from utils.conversation_manager import ConversationManager
+
+def build_conversation():
+    """Fresh in-memory database with a chat that has answered up to the emotions phase"""
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    user = get_or_create_user(session, "turn_user")
+    conversation_manager = ConversationManager(CBTMemoryManager(session, user))
+
+    for answer in ["Work has been stressful", "My boss criticised my report", "I'm going to get fired"]:
+        with conversation_manager.turn():
+            conversation_manager.save_response_data(answer)
+            conversation_manager.advance_phase()
+    return engine, session, user, conversation_manager
+
+def run_turn(conversation_manager, session, user, answer):
+    """One message: save the answer, move on and log the exchange, as the web app does"""
+    conversation_manager.save_response_data(answer)
+    conversation_manager.advance_phase()
+    context = conversation_manager.memory.get_context_for_conversation()
+    save_conversation(session, user.id, answer, "Next question", context)
+
+def test_turn_commits_once():
+    """The emotion, the background update and the conversation row share one commit"""
+    print("🔄 Testing one commit per turn")
+    print("="*70)
+
+    engine, session, user, conversation_manager = build_conversation()
+    commits = []
+    event.listen(engine, 'commit', lambda conn: commits.append(conn))
+
+    with conversation_manager.turn():
+        run_turn(conversation_manager, session, user, "Anxious, my chest was tight")
+
+    print(f"   emotions turn -> {len(commits)} commit(s)")
+    assert len(commits) == 1
+    assert session.query(Emotion).count() == 1
+    assert session.query(Conversation).count() == 1
+    assert "chest was tight" in session.query(BackgroundInfo).one().major_symptoms_physiological
+    assert conversation_manager.get_current_phase() == 'behavior_1'
+
+    print(f"\n🎉 Turn committed once!")
+
+def test_failed_turn_rolls_back():
+    """An error mid-turn keeps no rows and returns the chat to the question just asked"""
+    print("🔄 Testing rollback of a failed turn")
+    print("="*70)
+
+    engine, session, user, conversation_manager = build_conversation()
+    phase = conversation_manager.get_current_phase()
+
+    try:
+        with conversation_manager.turn():
+            run_turn(conversation_manager, session, user, "Anxious, my chest was tight")
+            raise RuntimeError("LLM backend went away")
+    except RuntimeError:
+        pass
+
+    print(f"   phase after rollback -> {conversation_manager.get_current_phase()}")
+    assert conversation_manager.get_current_phase() == phase
+    assert session.query(Emotion).count() == 0
+    assert session.query(Conversation).count() == 0
+    assert session.query(BackgroundInfo).one().major_symptoms_physiological is None
+    assert 'recent_emotions' not in conversation_manager.memory._context_cache
+
+    # Answering again links to the situation saved in an earlier turn
+    with conversation_manager.turn():
+        run_turn(conversation_manager, session, user, "Anxious, my chest was tight")
+    emotion = session.query(Emotion).one()
+    assert emotion.situation_id == session.query(Situation).one().id
+
+    print(f"\n🎉 Failed turn left nothing behind!")
+
+if __name__ == "__main__":
+    test_turn_commits_once()
+    test_failed_turn_rolls_back()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+
+"""
+Test script for loading the offline question variant bank
+A bank is only served while it matches the current rephrase model and prompt version
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import tempfile
+
+from utils import variant_bank
+from utils.conversation_manager import INTRO_GREETING, REPHRASE_MODEL, REPHRASE_PROMPT_VERSION
+from utils.variant_bank import get_variant_bank, write_variant_bank
+
+VARIANTS = {(INTRO_GREETING, 'introduction'): ["Hello there, what should I call you today?"]}
+
+def load_fresh(path):
+    """get_variant_bank() as on a fresh start of the app"""
+    saved = variant_bank._bank, variant_bank._bank_loaded
+    variant_bank._bank, variant_bank._bank_loaded = None, False
+    try:
+        bank = get_variant_bank(path)
+        if bank is not None:
+            bank.close()
+        return bank
+    finally:
+        variant_bank._bank, variant_bank._bank_loaded = saved
+
+def test_bank_checked_against_model_and_prompt():
+    """Banks built by another model or prompt version are ignored"""
+    print("🔄 Testing variant bank staleness checks")
+    print("="*70)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'variant_bank.bin')
+
+        write_variant_bank(path, VARIANTS, REPHRASE_MODEL, REPHRASE_PROMPT_VERSION)
+        assert load_fresh(path) is not None
+
+        write_variant_bank(path, VARIANTS, f"not-{REPHRASE_MODEL}", REPHRASE_PROMPT_VERSION)
+        assert load_fresh(path) is None
+
+        write_variant_bank(path, VARIANTS, REPHRASE_MODEL, f"{REPHRASE_PROMPT_VERSION}-old")
+        assert load_fresh(path) is None
+
+    print(f"\n🎉 Stale banks were ignored!")
+
+if __name__ == "__main__":
+    test_bank_checked_against_model_and_prompt()
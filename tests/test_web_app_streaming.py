@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+
+"""
+Test script for the streaming chat routes of web_app.py
+A turn whose framing comes back empty or late still asks the next question and is logged,
+and a greeting that is slow to stream falls back to the base greeting
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import isolated_paths  # before the app's modules read their file paths
+os.environ.setdefault('LLM_BACKEND', 'fake')
+
+import json
+import time
+
+from utils import llm
+from utils.conversation_manager import INTRO_GREETING
+from utils.cbt_database import Conversation, init_cbt_db
+from utils.llm_backends import FakeBackend
+from utils.llm_latency import LatencyBudget
+
+BUDGET = 0.2
+
+class SlowStreamBackend(FakeBackend):
+    """Answers chat() at once but takes a second before streaming `streamed`"""
+
+    def __init__(self, streamed):
+        super().__init__()
+        self.streamed = streamed
+
+    def stream(self, model, messages, options=None, **kwargs):
+        time.sleep(1)
+        yield from FakeBackend(reply=self.streamed).stream(model, messages, options=options, **kwargs)
+
+def sse_events(response):
+    """(event, payload) pairs from a Server-Sent Events response body"""
+    events = []
+    for message in response.get_data(as_text=True).split('\n\n'):
+        lines = dict(line.split(': ', 1) for line in message.splitlines() if ': ' in line)
+        if 'event' in lines:
+            events.append((lines['event'], json.loads(lines['data'])))
+    return events
+
+def start_chat(client):
+    """Start a non-personalized chat; returns its session data"""
+    import web_app
+
+    response = client.post('/start_session', json={'personalization_type': 'without_personalization'})
+    assert response.status_code == 200
+    with client.session_transaction() as cookie:
+        return web_app.session_store.get(cookie['session_id'])
+
+def test_empty_framing_asks_question():
+    """A framing reply of only quote characters falls back to the question instead of ending the chat"""
+    print("🔄 Testing an empty streamed framing")
+    print("="*70)
+
+    import web_app
+
+    saved_backend = llm._backend
+    llm.set_backend(FakeBackend())
+    try:
+        client = web_app.app.test_client()
+        session_data = start_chat(client)
+
+        llm.set_backend(FakeBackend(reply='"'))
+        events = sse_events(client.post('/send_message/stream', json={'message': "Work has been stressful"}))
+    finally:
+        llm.set_backend(saved_backend)
+
+    event, done = events[-1]
+    print(f"   {event}: {done}")
+    assert event == 'done'
+    assert done['phase'] == 'situation_1'
+    assert not done['session_ended']
+    assert done['message'] and done['message'] != "Assessment complete!"
+
+    with init_cbt_db() as db_session:
+        log = db_session.query(Conversation).filter_by(user_id=session_data['user_id']).all()
+    assert [row.message for row in log] == ["", "Work has been stressful"]
+    assert log[-1].response == done['message']
+
+    print(f"\n🎉 Empty framing fell back to the question!")
+
+def test_slow_first_token_asks_question():
+    """A framing stream with no first token within the budget is dropped for the question"""
+    print("🔄 Testing a streamed framing that misses the latency budget")
+    print("="*70)
+
+    import web_app
+
+    saved_backend, saved_budget = llm._backend, llm.budget
+    llm.set_backend(FakeBackend())
+    llm.budget = LatencyBudget(llm.latency, default_budget=BUDGET, min_budget=BUDGET, max_budget=BUDGET)
+    try:
+        client = web_app.app.test_client()
+        start_chat(client)
+
+        llm.set_backend(SlowStreamBackend(streamed="A framed question that arrives too late"))
+        started = time.perf_counter()
+        events = sse_events(client.post('/send_message/stream', json={'message': "Work has been stressful"}))
+        elapsed = time.perf_counter() - started
+    finally:
+        llm.set_backend(saved_backend)
+        llm.budget = saved_budget
+
+    event, done = events[-1]
+    print(f"   {event} after {elapsed:.2f}s: {done['message'][:60]}...")
+    assert elapsed < 1
+    assert event == 'done'
+    assert not any(event == 'token' for event, _ in events)
+    assert done['phase'] == 'situation_1' and not done['session_ended']
+    assert "too late" not in done['message']
+
+    print(f"\n🎉 Late framing fell back to the question!")
+
+def test_slow_greeting_stream_falls_back():
+    """A greeting stream with no first chunk within the budget is replaced by the base greeting"""
+    print("🔄 Testing a streamed greeting that misses the latency budget")
+    print("="*70)
+
+    import web_app
+
+    saved_backend, saved_budget, saved_cache = llm._backend, llm.budget, web_app.rephrase_cache
+    llm.set_backend(SlowStreamBackend(streamed="A warm greeting that arrives too late"))
+    llm.budget = LatencyBudget(llm.latency, default_budget=BUDGET, min_budget=BUDGET, max_budget=BUDGET)
+    # A cached greeting would be served without asking the model
+    web_app.rephrase_cache = None
+    try:
+        client = web_app.app.test_client()
+        started = time.perf_counter()
+        events = sse_events(client.post('/start_session/stream', json={'personalization_type': 'without_personalization'}))
+        elapsed = time.perf_counter() - started
+    finally:
+        llm.set_backend(saved_backend)
+        llm.budget = saved_budget
+        web_app.rephrase_cache = saved_cache
+
+    event, done = events[-1]
+    print(f"   {event} after {elapsed:.2f}s: {done['message'][:60]}...")
+    assert elapsed < 1
+    assert event == 'done'
+    assert done['message'] == INTRO_GREETING
+    # The fallback is the first thing the page shows, not only the final message
+    assert events[0] == ('token', {'text': INTRO_GREETING})
+
+    print(f"\n🎉 Late greeting fell back to the base greeting!")
+
+if __name__ == "__main__":
+    test_empty_framing_asks_question()
+    test_slow_first_token_asks_question()
+    test_slow_greeting_stream_falls_back()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+
+"""
+Test script for the write-behind turn queue
+Turns written behind end up exactly like synchronous ones, and are group-committed
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import tempfile
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from utils.cbt_database import (Base, User, Situation, AutomaticThought, Emotion, Conversation, BackgroundInfo,
+                                get_or_create_user, save_conversation, defer_write)
+from utils.cbt_memory import CBTMemoryManager
+from utils.conversation_manager import ConversationManager
+from utils.write_behind import WriteBehindQueue
+
+ANSWERS = ["Work has been stressful", "My boss criticised my report", "I'm going to get fired", "Anxious and shaky"]
+
+def make_engine(directory):
+    engine = create_engine(f"sqlite:///{os.path.join(directory, 'write_behind.db')}", connect_args={'check_same_thread': False})
+    Base.metadata.create_all(engine)
+    return engine
+
+def start_chat(session_factory, identifier, write_behind=None):
+    with session_factory() as session:
+        memory = CBTMemoryManager(session, get_or_create_user(session, identifier))
+        memory.release()
+    return ConversationManager(memory, write_behind=write_behind)
+
+def answer(session_factory, conversation_manager, text):
+    """One turn as the web app runs it: save the answer, move on and log the exchange"""
+    user_id = conversation_manager.memory.user_id
+
+    def log(session):
+        memory = conversation_manager.memory if session is conversation_manager.memory.session else CBTMemoryManager(session, session.get(User, user_id))
+        save_conversation(session, user_id, text, "Next question", memory.get_context_for_conversation())
+
+    # A session for this request only, as the web app opens one per request
+    with session_factory() as session:
+        conversation_manager.memory.bind(session)
+        try:
+            with conversation_manager.turn():
+                conversation_manager.save_response_data(text)
+                conversation_manager.advance_phase()
+                defer_write(session, log)
+        finally:
+            conversation_manager.memory.release()
+
+def stored_rows(session_factory):
+    """Everything the chat stored, minus ids and timestamps"""
+    with session_factory() as session:
+        thought = session.query(AutomaticThought).one()
+        emotion = session.query(Emotion).one()
+        background = session.query(BackgroundInfo).one()
+        contexts = [conversation.context for conversation in session.query(Conversation).order_by(Conversation.id)]
+        for context in contexts:
+            for section in ('recent_situations', 'recent_automatic_thoughts', 'recent_emotions'):
+                for row in context[section]:
+                    row.pop('timestamp')
+        return {
+            'thought_situation': thought.situation.description,
+            'emotion_situation': emotion.situation.description,
+            'chief_complaint': background.chief_complaint,
+            'symptoms': background.major_symptoms_physiological,
+            'contexts': contexts
+        }
+
+def test_write_behind_matches_synchronous():
+    """Rows, links and logged contexts are the same whether turns are written behind or not"""
+    print("🔄 Testing write-behind against synchronous turns")
+    print("="*70)
+
+    with tempfile.TemporaryDirectory() as sync_dir, tempfile.TemporaryDirectory() as behind_dir:
+        sync_factory = sessionmaker(bind=make_engine(sync_dir))
+        conversation_manager = start_chat(sync_factory, "sync_user")
+        for text in ANSWERS:
+            answer(sync_factory, conversation_manager, text)
+
+        behind_factory = sessionmaker(bind=make_engine(behind_dir))
+        write_behind = WriteBehindQueue(behind_factory, interval=0.01)
+        write_behind.start()
+        conversation_manager = start_chat(behind_factory, "sync_user", write_behind)
+        for text in ANSWERS:
+            answer(behind_factory, conversation_manager, text)
+        assert write_behind.stop(timeout=10)
+
+        expected, written_behind = stored_rows(sync_factory), stored_rows(behind_factory)
+        print(f"   {len(written_behind['contexts'])} logged turns compared")
+        assert written_behind == expected
+        assert len(expected['contexts']) == len(ANSWERS)
+        assert expected['contexts'][-1]['recent_emotions'][0]['emotion'] == "Anxious and shaky"
+
+    print(f"\n🎉 Written-behind turns match synchronous turns!")
+
+def test_group_commit():
+    """Turns from many chats queued together share commits, and stop() writes them all"""
+    print("🔄 Testing group commits across chats")
+    print("="*70)
+
+    with tempfile.TemporaryDirectory() as directory:
+        engine = make_engine(directory)
+        session_factory = sessionmaker(bind=engine)
+        write_behind = WriteBehindQueue(session_factory, interval=0.5)
+        chats = [start_chat(session_factory, f"chat_{n}", write_behind) for n in range(20)]
+
+        # Transactions that wrote something; the chats' request sessions only read
+        writing, commits = set(), []
+        event.listen(engine, 'before_cursor_execute',
+                     lambda conn, cursor, statement, *args: statement.startswith(('INSERT', 'UPDATE')) and writing.add(conn))
+        event.listen(engine, 'commit', lambda conn: conn in writing and (writing.discard(conn) or commits.append(conn)))
+        for conversation_manager in chats:
+            answer(session_factory, conversation_manager, "Work has been stressful")
+        write_behind.start()
+        assert write_behind.stop(timeout=10)
+
+        stats = write_behind.stats()
+        print(f"   20 turns -> {len(commits)} commit(s), {stats['batches']} batch(es)")
+        assert stats['turns_written'] == 20 and stats['failures'] == 0
+        assert len(commits) < 20
+        with session_factory() as session:
+            assert session.query(BackgroundInfo).count() == 20
+            assert session.query(Conversation).count() == 20
+
+    print(f"\n🎉 Turns were group-committed and flushed at shutdown!")
+
+if __name__ == "__main__":
+    test_write_behind_matches_synchronous()
+    test_group_commit()
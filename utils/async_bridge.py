@@ -0,0 +1,25 @@
+import asyncio
+
+# The synchronous conversation code runs unchanged on the async server (async_web_app.py)
+# inside AsyncSession.run_sync(), which executes it in a greenlet on the event loop's
+# thread: database I/O is awaited on the loop by SQLAlchemy, and the helpers below let
+# LLM calls and other waits do the same instead of blocking the loop. Everywhere else -
+# the Flask app, worker threads, scripts - there is no running loop and they are unused.
+
+def in_event_loop():
+    """True when called from the event loop's thread, i.e. inside run_sync() on the async server"""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+def wait(awaitable):
+    """Wait for `awaitable` on the event loop from synchronous code running inside run_sync()"""
+    from sqlalchemy.util import await_only
+    return await_only(awaitable)
+
+def spawn(fn, *args):
+    """Run synchronous fn(*args) as an asyncio task; its own waits go through the loop too"""
+    from sqlalchemy.util import greenlet_spawn
+    return asyncio.ensure_future(greenlet_spawn(fn, *args))
@@ -1,77 +1,130 @@
 import json
 from datetime import datetime, timedelta
-from sqlalchemy import and_, or_
+from sqlalchemy import and_, or_, insert
+from sqlalchemy.orm import joinedload
+from utils.cbt_database import commit_or_defer, unit_of_work
+
+# Sections of the conversation context, in the order they appear
+CONTEXT_SECTIONS = [
+    'recent_situations',
+    'recent_automatic_thoughts',
+    'recent_emotions',
+    'recent_behaviors',
+    'beliefs',
+    'background',
+    'user_identifier'
+]
+
+# Tables written by add_extractions, in insert order (links point to earlier tables)
+EXTRACTION_TABLES = ['situations', 'automatic_thoughts', 'thought_meanings', 'emotions', 'behaviors']
+
+# Context sections built from each table; a write to the table invalidates them
+CONTEXT_SECTIONS_BY_TABLE = {
+    'situations': ['recent_situations'],
+    'automatic_thoughts': ['recent_automatic_thoughts'],
+    'emotions': ['recent_emotions'],
+    'behaviors': ['recent_behaviors'],
+    'cbt_beliefs': ['beliefs'],
+    'background_info': ['background']
+}
 
 class CBTMemoryManager:
-    def __init__(self, session, user):
+    def __init__(self, session, user=None, user_id=None):
+        """Memory for `user`, or for `user_id` without loading the row until it is needed"""
+        self.session = session
+        self.user_id = user.id if user is not None else user_id
+        self._user = user
+        
+        # Cached conversation context sections (see get_context_for_conversation)
+        self._context_cache = {}
+        
+    @property
+    def user(self):
+        """The user row, loaded through the current session when first needed"""
+        if self._user is None:
+            from utils.cbt_database import User
+            self._user = self.session.get(User, self.user_id)
+        return self._user
+        
+    def bind(self, session):
+        """Work through `session` for the current request"""
         self.session = session
-        self.user = user
+        self._user = None
+        
+    def release(self):
+        """Drop the request's session and ORM objects; only the user id is kept between requests"""
+        self.session = None
+        self._user = None
         
     def add_situation(self, description, context="", category="general"):
         """Add a situation to the database"""
         from utils.cbt_database import Situation
         situation = Situation(
-            user_id=self.user.id,
+            user_id=self.user_id,
             description=description,
             context=context,
             category=category
         )
         self.session.add(situation)
-        self.session.commit()
+        commit_or_defer(self.session)
+        self.invalidate_context('situations')
         return situation
         
     def add_automatic_thought(self, thought, situation=None):
         """Add an automatic thought linked to a situation"""
         from utils.cbt_database import AutomaticThought
         automatic_thought = AutomaticThought(
-            user_id=self.user.id,
-            situation_id=situation.id if situation else None,
+            user_id=self.user_id,
+            situation=situation,
             thought=thought
         )
         self.session.add(automatic_thought)
-        self.session.commit()
+        commit_or_defer(self.session)
+        self.invalidate_context('automatic_thoughts')
         return automatic_thought
         
     def add_thought_meaning(self, meaning, automatic_thought=None, user_inferred_core_belief=""):
         """Add meaning interpretation for an automatic thought"""
         from utils.cbt_database import ThoughtMeaning
         thought_meaning = ThoughtMeaning(
-            user_id=self.user.id,
-            automatic_thought_id=automatic_thought.id if automatic_thought else None,
+            user_id=self.user_id,
+            automatic_thought=automatic_thought,
             meaning=meaning,
             user_inferred_core_belief=user_inferred_core_belief
         )
         self.session.add(thought_meaning)
-        self.session.commit()
+        commit_or_defer(self.session)
         return thought_meaning
         
     def add_emotion(self, emotion, intensity, context="", situation=None, automatic_thought=None):
         """Add an emotion linked to situation and/or automatic thought"""
         from utils.cbt_database import Emotion
         emotion_obj = Emotion(
-            user_id=self.user.id,
-            situation_id=situation.id if situation else None,
-            automatic_thought_id=automatic_thought.id if automatic_thought else None,
+            user_id=self.user_id,
+            situation=situation,
+            automatic_thought=automatic_thought,
             emotion=emotion,
             intensity=intensity,
             context=context
         )
         self.session.add(emotion_obj)
-        self.session.commit()
+        commit_or_defer(self.session)
+        self.invalidate_context('emotions')
         return emotion_obj
         
     def add_behavior(self, action, behavior_type="general", situation=None, automatic_thought=None):
         """Add a behavior linked to situation and/or automatic thought"""
         from utils.cbt_database import Behavior
         behavior = Behavior(
-            user_id=self.user.id,
-            situation_id=situation.id if situation else None,
-            automatic_thought_id=automatic_thought.id if automatic_thought else None,
+            user_id=self.user_id,
+            situation=situation,
+            automatic_thought=automatic_thought,
             action=action,
             behavior_type=behavior_type
         )
         self.session.add(behavior)
-        self.session.commit()
+        commit_or_defer(self.session)
+        self.invalidate_context('behaviors')
         return behavior
         
     def update_beliefs(self, beliefs_data):
@@ -79,13 +132,14 @@ class CBTMemoryManager:
         from utils.cbt_database import CBTBeliefs
         
         # Check if user already has beliefs record
-        existing_beliefs = self.session.query(CBTBeliefs).filter_by(user_id=self.user.id).first()
+        existing_beliefs = self.session.query(CBTBeliefs).filter_by(user_id=self.user_id).first()
         
         if existing_beliefs:
-            # Merge new beliefs with existing ones
-            current_core = existing_beliefs.core_beliefs or []
-            current_intermediate = existing_beliefs.intermediate_beliefs or []
-            current_coping = existing_beliefs.coping_strategies or []
+            # Merge new beliefs with existing ones; copies, since JSON columns only
+            # register a change when a new value is assigned
+            current_core = list(existing_beliefs.core_beliefs or [])
+            current_intermediate = list(existing_beliefs.intermediate_beliefs or [])
+            current_coping = list(existing_beliefs.coping_strategies or [])
             
             # Add new beliefs if they don't already exist
             for belief in beliefs_data.get('core_beliefs', []):
@@ -108,20 +162,21 @@ class CBTMemoryManager:
         else:
             # Create new beliefs record
             beliefs = CBTBeliefs(
-                user_id=self.user.id,
+                user_id=self.user_id,
                 core_beliefs=beliefs_data.get('core_beliefs', []),
                 intermediate_beliefs=beliefs_data.get('intermediate_beliefs', []),
                 coping_strategies=beliefs_data.get('coping_strategies', [])
             )
             self.session.add(beliefs)
             
-        self.session.commit()
+        commit_or_defer(self.session)
+        self.invalidate_context('cbt_beliefs')
         
     def update_background_info(self, background_data):
         """Update or create background information for case formulation"""
         from utils.cbt_database import BackgroundInfo
         
-        existing_background = self.session.query(BackgroundInfo).filter_by(user_id=self.user.id).first()
+        existing_background = self.session.query(BackgroundInfo).filter_by(user_id=self.user_id).first()
         
         if existing_background:
             # Update existing background info
@@ -157,7 +212,7 @@ class CBTMemoryManager:
             history = background_data.get('history', {})
             
             background = BackgroundInfo(
-                user_id=self.user.id,
+                user_id=self.user_id,
                 **identifying_info,
                 **cbt_patterns,
                 **functioning,
@@ -165,40 +220,170 @@ class CBTMemoryManager:
             )
             self.session.add(background)
             
-        self.session.commit()
+        commit_or_defer(self.session)
+        self.invalidate_context('background_info')
+        
+    def add_extraction(self, extracted_info):
+        """Store one CBTNLPExtractor extraction; see add_extractions"""
+        return self.add_extractions([extracted_info])[0]
+        
+    def add_extractions(self, extractions):
+        """Store many extractions from CBTNLPExtractor in one transaction, e.g. for backfills.
+        
+        Each table is written with a single bulk INSERT (row by row on SQLite), and the
+        links from thoughts, meanings, emotions and behaviors to the situations and
+        thoughts of the same extraction are resolved in memory from the returned ids. Beliefs from all
+        extractions are merged into the user's record. Returns a dict of created ids,
+        keyed by table name, for each extraction.
+        """
+        from utils.cbt_database import Situation, AutomaticThought, ThoughtMeaning, Emotion, Behavior
+        
+        extractions = [extracted_info or {} for extracted_info in extractions]
+        created = [{table: [] for table in EXTRACTION_TABLES} for _ in extractions]
+        situation_ids = [{} for _ in extractions]   # per extraction: description -> id
+        thought_ids = [{} for _ in extractions]     # per extraction: thought -> id
+        
+        def bulk_insert(model, rows):
+            """Insert (extraction index, row) pairs and record the new ids per extraction"""
+            if not rows:
+                return []
+            # The new ids are returned in parameter order on every backend; SQLAlchemy runs the
+            # INSERT once per row where a multi-row INSERT cannot guarantee that (SQLite)
+            ids = self.session.scalars(
+                insert(model.__table__).returning(model.id, sort_by_parameter_order=True),
+                [row for _, row in rows]
+            ).all()
+            for (index, _), row_id in zip(rows, ids):
+                created[index][model.__tablename__].append(row_id)
+            return ids
+        
+        def linked(index, data, situation_key, thought_key):
+            return {
+                'situation_id': situation_ids[index].get(data.get(situation_key)),
+                'automatic_thought_id': thought_ids[index].get(data.get(thought_key))
+            }
+        
+        with unit_of_work(self.session):
+            situations = [
+                (index, {
+                    'user_id': self.user_id,
+                    'description': data['description'],
+                    'context': data.get('context', ''),
+                    'category': data.get('category', 'general')
+                })
+                for index, extracted_info in enumerate(extractions)
+                for data in extracted_info.get('situations', [])
+            ]
+            for (index, row), row_id in zip(situations, bulk_insert(Situation, situations)):
+                situation_ids[index][row['description']] = row_id
+            
+            thoughts = [
+                (index, {
+                    'user_id': self.user_id,
+                    'situation_id': situation_ids[index].get(data.get('situation_description')),
+                    'thought': data['thought']
+                })
+                for index, extracted_info in enumerate(extractions)
+                for data in extracted_info.get('automatic_thoughts', [])
+            ]
+            for (index, row), row_id in zip(thoughts, bulk_insert(AutomaticThought, thoughts)):
+                thought_ids[index][row['thought']] = row_id
+            
+            bulk_insert(ThoughtMeaning, [
+                (index, {
+                    'user_id': self.user_id,
+                    'automatic_thought_id': thought_ids[index].get(data.get('linked_thought')),
+                    'meaning': data['meaning'],
+                    'user_inferred_core_belief': data.get('user_inferred_core_belief', '')
+                })
+                for index, extracted_info in enumerate(extractions)
+                for data in extracted_info.get('thought_meanings', [])
+            ])
+            
+            bulk_insert(Emotion, [
+                (index, {
+                    'user_id': self.user_id,
+                    **linked(index, data, 'linked_situation', 'linked_thought'),
+                    'emotion': data['emotion'],
+                    'intensity': data['intensity'],
+                    'context': data.get('context', '')
+                })
+                for index, extracted_info in enumerate(extractions)
+                for data in extracted_info.get('emotions', [])
+            ])
+            
+            bulk_insert(Behavior, [
+                (index, {
+                    'user_id': self.user_id,
+                    **linked(index, data, 'linked_situation', 'linked_thought'),
+                    'action': data['action'],
+                    'behavior_type': data.get('behavior_type', 'general')
+                })
+                for index, extracted_info in enumerate(extractions)
+                for data in extracted_info.get('behaviors', [])
+            ])
+            
+            # One beliefs update for the whole batch, without repeats across extractions
+            beliefs_data = {
+                key: list(dict.fromkeys(belief for extracted_info in extractions for belief in extracted_info.get(key, [])))
+                for key in ('core_beliefs', 'intermediate_beliefs', 'coping_strategies')
+            }
+            if any(beliefs_data.values()):
+                self.update_beliefs(beliefs_data)
+        
+        self.invalidate_context(*EXTRACTION_TABLES)
+        return created
         
     def get_recent_situations(self, limit=10):
         """Get recent situations for the user"""
         from utils.cbt_database import Situation
         return self.session.query(Situation)\
-            .filter_by(user_id=self.user.id)\
+            .filter_by(user_id=self.user_id)\
             .order_by(Situation.timestamp.desc())\
             .limit(limit)\
             .all()
             
-    def get_recent_automatic_thoughts(self, limit=10):
-        """Get recent automatic thoughts for the user"""
+    def get_recent_automatic_thoughts(self, limit=10, with_links=False):
+        """Get recent automatic thoughts for the user.
+        
+        With with_links=True the linked situation is loaded in the same query.
+        """
         from utils.cbt_database import AutomaticThought
-        return self.session.query(AutomaticThought)\
-            .filter_by(user_id=self.user.id)\
+        query = self.session.query(AutomaticThought)
+        if with_links:
+            query = query.options(joinedload(AutomaticThought.situation))
+        return query\
+            .filter_by(user_id=self.user_id)\
             .order_by(AutomaticThought.timestamp.desc())\
             .limit(limit)\
             .all()
             
-    def get_recent_emotions(self, limit=10):
-        """Get recent emotions for the user"""
+    def get_recent_emotions(self, limit=10, with_links=False):
+        """Get recent emotions for the user.
+        
+        With with_links=True the linked situation and thought are loaded in the same query.
+        """
         from utils.cbt_database import Emotion
-        return self.session.query(Emotion)\
-            .filter_by(user_id=self.user.id)\
+        query = self.session.query(Emotion)
+        if with_links:
+            query = query.options(joinedload(Emotion.situation), joinedload(Emotion.automatic_thought))
+        return query\
+            .filter_by(user_id=self.user_id)\
             .order_by(Emotion.timestamp.desc())\
             .limit(limit)\
             .all()
             
-    def get_recent_behaviors(self, limit=10):
-        """Get recent behaviors for the user"""
+    def get_recent_behaviors(self, limit=10, with_links=False):
+        """Get recent behaviors for the user.
+        
+        With with_links=True the linked situation and thought are loaded in the same query.
+        """
         from utils.cbt_database import Behavior
-        return self.session.query(Behavior)\
-            .filter_by(user_id=self.user.id)\
+        query = self.session.query(Behavior)
+        if with_links:
+            query = query.options(joinedload(Behavior.situation), joinedload(Behavior.automatic_thought))
+        return query\
+            .filter_by(user_id=self.user_id)\
             .order_by(Behavior.timestamp.desc())\
             .limit(limit)\
             .all()
@@ -206,39 +391,47 @@ class CBTMemoryManager:
     def get_beliefs(self):
         """Get user's beliefs and coping strategies"""
         from utils.cbt_database import CBTBeliefs
-        return self.session.query(CBTBeliefs).filter_by(user_id=self.user.id).first()
+        return self.session.query(CBTBeliefs).filter_by(user_id=self.user_id).first()
         
     def get_background_info(self):
         """Get user's background information"""
         from utils.cbt_database import BackgroundInfo
-        return self.session.query(BackgroundInfo).filter_by(user_id=self.user.id).first()
+        return self.session.query(BackgroundInfo).filter_by(user_id=self.user_id).first()
         
-    def get_context_for_conversation(self):
-        """Build context for CBT-informed conversations"""
-        recent_situations = self.get_recent_situations(5)
-        recent_thoughts = self.get_recent_automatic_thoughts(5)
-        recent_emotions = self.get_recent_emotions(5)
-        recent_behaviors = self.get_recent_behaviors(5)
-        beliefs = self.get_beliefs()
-        background = self.get_background_info()
+    def invalidate_context(self, *tables):
+        """Drop the cached context sections built from the given tables after a write"""
+        for table in tables:
+            for section in CONTEXT_SECTIONS_BY_TABLE.get(table, ()):
+                self._context_cache.pop(section, None)
         
-        context = {
-            'recent_situations': [
+    def reset_context(self):
+        """Drop every cached context section, e.g. after the session was rolled back"""
+        self._context_cache.clear()
+        
+    def _build_context_section(self, section):
+        """Build one section of the conversation context from the database"""
+        if section == 'recent_situations':
+            return [
                 {
                     'description': situation.description,
                     'context': situation.context,
                     'category': situation.category,
                     'timestamp': situation.timestamp.isoformat()
-                } for situation in recent_situations
-            ],
-            'recent_automatic_thoughts': [
+                } for situation in self.get_recent_situations(5)
+            ]
+        
+        # Linked situations and thoughts are loaded with their rows to avoid a lazy load per row
+        if section == 'recent_automatic_thoughts':
+            return [
                 {
                     'thought': thought.thought,
                     'situation_description': thought.situation.description if thought.situation else None,
                     'timestamp': thought.timestamp.isoformat()
-                } for thought in recent_thoughts
-            ],
-            'recent_emotions': [
+                } for thought in self.get_recent_automatic_thoughts(5, with_links=True)
+            ]
+        
+        if section == 'recent_emotions':
+            return [
                 {
                     'emotion': emotion.emotion,
                     'intensity': emotion.intensity,
@@ -246,28 +439,35 @@ class CBTMemoryManager:
                     'linked_situation': emotion.situation.description if emotion.situation else None,
                     'linked_thought': emotion.automatic_thought.thought if emotion.automatic_thought else None,
                     'timestamp': emotion.timestamp.isoformat()
-                } for emotion in recent_emotions
-            ],
-            'recent_behaviors': [
+                } for emotion in self.get_recent_emotions(5, with_links=True)
+            ]
+        
+        if section == 'recent_behaviors':
+            return [
                 {
                     'action': behavior.action,
                     'behavior_type': behavior.behavior_type,
                     'linked_situation': behavior.situation.description if behavior.situation else None,
                     'linked_thought': behavior.automatic_thought.thought if behavior.automatic_thought else None,
                     'timestamp': behavior.timestamp.isoformat()
-                } for behavior in recent_behaviors
+                } for behavior in self.get_recent_behaviors(5, with_links=True)
             ]
-        }
         
-        if beliefs:
-            context['beliefs'] = {
+        if section == 'beliefs':
+            beliefs = self.get_beliefs()
+            if not beliefs:
+                return None
+            return {
                 'core_beliefs': beliefs.core_beliefs or [],
                 'intermediate_beliefs': beliefs.intermediate_beliefs or [],
                 'coping_strategies': beliefs.coping_strategies or []
             }
-            
-        if background:
-            context['background'] = {
+        
+        if section == 'background':
+            background = self.get_background_info()
+            if not background:
+                return None
+            return {
                 'age_range': background.age_range,
                 'employment_status': background.employment_status,
                 'stress_response_patterns': background.stress_response_patterns,
@@ -277,7 +477,30 @@ class CBTMemoryManager:
                 'strengths_and_resources': background.strengths_and_resources
             }
         
-        context['user_identifier'] = self.user.identifier
+        if section == 'user_identifier':
+            return self.user.identifier
+        
+        raise ValueError(f"Unknown context section: {section}")
+        
+    def get_context_for_conversation(self):
+        """Build context for CBT-informed conversations.
+        
+        Sections are cached and only rebuilt after a write to the tables they are
+        built from (see invalidate_context), so an unchanged context costs no queries.
+        """
+        # Inside a unit of work this turn's rows are still pending; flush so they are included
+        self.session.flush()
+        
+        context = {}
+        for section in CONTEXT_SECTIONS:
+            if section not in self._context_cache:
+                self._context_cache[section] = self._build_context_section(section)
+            value = self._context_cache[section]
+            
+            # Beliefs and background are only included when the user has them
+            if value is not None:
+                context[section] = value
+        
         return context
         
     def get_case_formulation_data(self):
@@ -302,7 +525,7 @@ class CBTMemoryManager:
         """Get recent conversations for compatibility with ConversationManager"""
         from utils.cbt_database import Conversation
         return self.session.query(Conversation)\
-            .filter_by(user_id=self.user.id)\
+            .filter_by(user_id=self.user_id)\
             .order_by(Conversation.timestamp.desc())\
             .limit(limit)\
             .all()
@@ -1,4 +1,6 @@
-import ollama
+from utils import llm
+from utils.llm_admission import PRIORITY_BACKGROUND
+from utils.llm_routing import TASK_EXTRACTION
 import json
 from datetime import datetime
 import re
@@ -93,14 +95,15 @@ User message: """
     def extract_cbt_information(self, message):
         """Extract CBT-relevant information from user message"""
         try:
-            response = ollama.chat(
-                model="llama3.2",
+            response = llm.chat(
                 messages=[
                     {
                         "role": "system",
                         "content": self.extraction_prompt + message
                     }
-                ]
+                ],
+                priority=PRIORITY_BACKGROUND,
+                task=TASK_EXTRACTION
             )
             
             # Extract the JSON part from the response
@@ -118,14 +121,15 @@ User message: """
     def extract_background_information(self, message):
         """Extract background information for case formulation"""
         try:
-            response = ollama.chat(
-                model="llama3.2",
+            response = llm.chat(
                 messages=[
                     {
                         "role": "system",
                         "content": self.background_extraction_prompt + message
                     }
-                ]
+                ],
+                priority=PRIORITY_BACKGROUND,
+                task=TASK_EXTRACTION
             )
             
             # Extract the JSON part from the response more robustly
@@ -166,91 +170,15 @@ User message: """
         }
 
     def update_cbt_memory(self, cbt_memory_manager, extracted_info):
-        """Update CBT memory with extracted information"""
+        """Update CBT memory with extracted information.
+        
+        The whole extraction is written in one transaction with bulk inserts; returns
+        the created ids by table (see CBTMemoryManager.add_extractions).
+        """
         if not extracted_info:
             return
-            
-        # Create situation mapping for linking
-        situation_map = {}
-        
-        # First pass: Create situations
-        for situation_data in extracted_info.get('situations', []):
-            situation = cbt_memory_manager.add_situation(
-                description=situation_data['description'],
-                context=situation_data.get('context', ''),
-                category=situation_data.get('category', 'general')
-            )
-            situation_map[situation_data['description']] = situation
-        
-        # Create automatic thoughts and link to situations
-        thought_map = {}
-        for thought_data in extracted_info.get('automatic_thoughts', []):
-            linked_situation = None
-            if thought_data.get('situation_description'):
-                linked_situation = situation_map.get(thought_data['situation_description'])
-            
-            thought = cbt_memory_manager.add_automatic_thought(
-                thought=thought_data['thought'],
-                situation=linked_situation
-            )
-            thought_map[thought_data['thought']] = thought
-        
-        # Create thought meanings and link to thoughts
-        for meaning_data in extracted_info.get('thought_meanings', []):
-            linked_thought = None
-            if meaning_data.get('linked_thought'):
-                linked_thought = thought_map.get(meaning_data['linked_thought'])
-            
-            cbt_memory_manager.add_thought_meaning(
-                meaning=meaning_data['meaning'],
-                automatic_thought=linked_thought,
-                user_inferred_core_belief=meaning_data.get('user_inferred_core_belief', '')
-            )
-        
-        # Create emotions and link them
-        for emotion_data in extracted_info.get('emotions', []):
-            linked_situation = None
-            linked_thought = None
-            
-            if emotion_data.get('linked_situation'):
-                linked_situation = situation_map.get(emotion_data['linked_situation'])
-            if emotion_data.get('linked_thought'):
-                linked_thought = thought_map.get(emotion_data['linked_thought'])
-            
-            cbt_memory_manager.add_emotion(
-                emotion=emotion_data['emotion'],
-                intensity=emotion_data['intensity'],
-                context=emotion_data.get('context', ''),
-                situation=linked_situation,
-                automatic_thought=linked_thought
-            )
-        
-        # Create behaviors and link them
-        for behavior_data in extracted_info.get('behaviors', []):
-            linked_situation = None
-            linked_thought = None
-            
-            if behavior_data.get('linked_situation'):
-                linked_situation = situation_map.get(behavior_data['linked_situation'])
-            if behavior_data.get('linked_thought'):
-                linked_thought = thought_map.get(behavior_data['linked_thought'])
-            
-            cbt_memory_manager.add_behavior(
-                action=behavior_data['action'],
-                behavior_type=behavior_data.get('behavior_type', 'general'),
-                situation=linked_situation,
-                automatic_thought=linked_thought
-            )
-        
-        # Update beliefs and coping strategies
-        beliefs_data = {
-            'core_beliefs': extracted_info.get('core_beliefs', []),
-            'intermediate_beliefs': extracted_info.get('intermediate_beliefs', []),
-            'coping_strategies': extracted_info.get('coping_strategies', [])
-        }
         
-        if any(beliefs_data.values()):
-            cbt_memory_manager.update_beliefs(beliefs_data)
+        return cbt_memory_manager.add_extraction(extracted_info)
 
     def update_background_info(self, cbt_memory_manager, extracted_info):
         """Update background information for case formulation"""
@@ -2,12 +2,50 @@ import random
 from datetime import datetime, timedelta
 import uuid
 import re
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from utils import llm
+from sqlalchemy import inspect
+from utils.cbt_database import unit_of_work, commit_or_defer
+from utils.llm_admission import PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
+from utils.llm_routing import get_route, TASK_REPHRASE, TASK_FORMULATION
+from utils.llm_latency import call_with_budget
+from utils.memory_snapshot import MemorySnapshot
+
+# Shared worker pool for speculatively building the next phase's question
+_prefetch_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='question-prefetch')
+
+# Model used for question rephrasing (from the routing table), and the version of
+# the rephrase prompt. Bump REPHRASE_PROMPT_VERSION whenever _build_rephrase_prompt
+# changes so cached variants produced by the old prompt are no longer served.
+REPHRASE_MODEL = get_route(TASK_REPHRASE).model
+REPHRASE_PROMPT_VERSION = 1
+
+# Longest a turn waits for the previous turn's written-behind rows, in seconds
+WRITE_BEHIND_WAIT = 30
+
+# Layout version of ConversationManager.to_state(); bump when it changes incompatibly
+CONVERSATION_STATE_VERSION = 1
+
+# Opening greeting used to start every session
+INTRO_GREETING = "Hi! I'm here to support you today through a structured conversation that will help us understand your thinking patterns. What's been on your mind lately?"
 
 class ConversationManager:
-    def __init__(self, memory_manager):
+    def __init__(self, memory_manager, rephrase_cache=None, variant_bank=None, write_behind=None):
         self.memory = memory_manager
         self.last_interaction = None
         
+        # Optional shared RephraseCache serving pre-validated question variants
+        self.rephrase_cache = rephrase_cache
+        
+        # Optional offline VariantBank consulted before the cache or the model
+        self.variant_bank = variant_bank
+        
+        # Optional shared WriteBehindQueue that commits each turn off the request thread
+        self.write_behind = write_behind
+        self._pending_write = None
+        
         # CBT Assessment Phases
         self.phases = [
             'introduction',     # Phase 1: Introduction & Rapport
@@ -30,9 +68,18 @@ class ConversationManager:
         self.current_phase_index = 0
         self.user_name = None
         
-        # Store current situation data temporarily
+        # Ids of the situations saved this session, for linking the answers that follow
         self.current_situation_data = {}
         
+        # Speculatively prefetched next question and tables written since it started
+        self._prefetch = None
+        self._tables_written = set()
+        self._current_memory_references = []
+        
+        # Recent memory used for personalization, loaded on first use
+        self._memory_snapshot = None
+        self._snapshot_lock = threading.Lock()
+        
         # Base question templates for rephrasing
         self.base_questions = {
             'introduction': "What's been on your mind lately? Is there anything specific you'd like to discuss?",
@@ -51,15 +98,8 @@ class ConversationManager:
             'patterns_beliefs': "Now I'd like to explore some patterns. Do you notice any common ways you tend to respond to stress or difficult situations? What usually helps you cope - even temporarily - when things get difficult? And do you have any beliefs about yourself that seem to come up again and again?"
         }
         
-    def _rephrase_question_with_ai(self, base_question, phase):
-        """Use AI to create natural variations of the structured questions"""
-        import ollama
-        
-        # Store original bold content for restoration if needed
-        import re
-        bold_pattern = r'\*\*(.*?)\*\*'
-        bold_matches = re.findall(bold_pattern, base_question)
-        
+    def _build_rephrase_prompt(self, base_question, phase):
+        """Build the system prompt used to rephrase a structured question"""
         # Define the purpose and constraints for each phase type
         phase_contexts = {
             'introduction': "building initial rapport and understanding presenting concerns",
@@ -87,7 +127,7 @@ class ConversationManager:
         context = phase_contexts.get(phase_type, "conducting CBT assessment")
         
         # Enhanced rephrase prompt with stronger emphasis on preserving bold formatting
-        rephrase_prompt = f"""You are a CBT therapist creating natural question variations for a structured assessment.
+        return f"""You are a CBT therapist creating natural question variations for a structured assessment.
 
 Base question: "{base_question}"
 
@@ -115,56 +155,195 @@ Bad rephrase: "I remember your nighttime eating habits. What thoughts occurred?"
 
 Provide ONLY the rephrased question, nothing else."""
 
+    def _finalize_rephrase(self, rephrased, base_question):
+        """Clean up a model rephrasing and fall back to the base question if it fails validation"""
+        # Store original bold content for restoration if needed
+        bold_pattern = r'\*\*(.*?)\*\*'
+        bold_matches = re.findall(bold_pattern, base_question)
+        
+        # Clean up any quotation marks or extra formatting
+        rephrased = rephrased.strip().strip('"').strip("'").strip()
+        
+        # Check if bold formatting was preserved
+        rephrased_bold_matches = re.findall(bold_pattern, rephrased)
+        
+        # If bold content was lost, restore it using post-processing
+        if bold_matches and len(rephrased_bold_matches) < len(bold_matches):
+            print(f"⚠️  Bold formatting partially lost during rephrasing. Attempting restoration...")
+            
+            # Try to restore bold formatting by finding the content in the rephrased text
+            restored_text = rephrased
+            for original_bold in bold_matches:
+                # Look for the content without bold markers in the rephrased text
+                if original_bold in restored_text and f"**{original_bold}**" not in restored_text:
+                    # Replace the plain text with bold version
+                    restored_text = restored_text.replace(original_bold, f"**{original_bold}**")
+                    print(f"   Restored bold formatting for: {original_bold}")
+            
+            rephrased = restored_text
+        
+        # Final verification
+        final_bold_matches = re.findall(bold_pattern, rephrased)
+        if bold_matches and len(final_bold_matches) == 0:
+            print(f"❌ Bold formatting completely lost. Using original question.")
+            return base_question
+        
+        # Fallback to original if rephrasing fails or is too short
+        if len(rephrased) < 20 or len(rephrased) > len(base_question) * 2.5:
+            return base_question
+            
+        # Success - log if bold formatting was preserved
+        if bold_matches and len(final_bold_matches) >= len(bold_matches):
+            print(f"✅ Bold formatting preserved in rephrased question")
+            
+        return rephrased
+
+    def _generate_rephrase(self, base_question, phase, priority=PRIORITY_INTERACTIVE):
+        """Ask the model for one rephrasing; returns None if it fails or does not validate"""
+        rephrase_prompt = self._build_rephrase_prompt(base_question, phase)
+
         try:
-            response = ollama.chat(
-                model="llama3.2",
+            response = llm.chat(
+                model=REPHRASE_MODEL,
                 messages=[
                     {"role": "system", "content": rephrase_prompt}
-                ]
+                ],
+                priority=priority,
+                task=TASK_REPHRASE
             )
             
-            rephrased = response['message']['content'].strip()
+            rephrased = self._finalize_rephrase(response['message']['content'], base_question)
+            return rephrased if rephrased != base_question else None
             
-            # Clean up any quotation marks or extra formatting
-            rephrased = rephrased.strip('"').strip("'").strip()
+        except Exception as e:
+            print(f"Question rephrasing failed: {e}")
+            return None
+
+    def _rephrase_cache_key(self, base_question, phase):
+        """Cache key for a question, or None if the question should not be cached"""
+        # Personalized questions carry memory references and are unique per user
+        if self.rephrase_cache is None or '**' in base_question:
+            return None
+        return self.rephrase_cache.make_key(base_question, phase, REPHRASE_MODEL, REPHRASE_PROMPT_VERSION)
+
+    def _refill_rephrase_pool(self, cache_key, base_question, phase):
+        """Top up the cached variant pool for a question in the background"""
+        if llm.is_overloaded(TASK_REPHRASE):
+            return
+        self.rephrase_cache.refill(cache_key, lambda: self._generate_rephrase(base_question, phase, PRIORITY_BACKGROUND))
+
+    def _pick_banked_variant(self, base_question, phase):
+        """Pick a pre-generated variant from the offline bank, if one is loaded"""
+        if self.variant_bank is None:
+            return None
+        return self.variant_bank.get(base_question, phase)
+
+    def _rephrase_question_with_ai(self, base_question, phase):
+        """Use AI to create natural variations of the structured questions"""
+        banked = self._pick_banked_variant(base_question, phase)
+        if banked:
+            return banked
+        
+        cache_key = self._rephrase_cache_key(base_question, phase)
+        
+        if cache_key:
+            cached = self.rephrase_cache.get(cache_key)
+            if cached:
+                self._refill_rephrase_pool(cache_key, base_question, phase)
+                return cached
+        
+        # Ask the canonical question rather than rephrase while the backend is overloaded
+        if llm.is_overloaded(TASK_REPHRASE):
+            return base_question
+        
+        def cache_rephrase(rephrased):
+            if cache_key and rephrased:
+                self.rephrase_cache.add(cache_key, rephrased)
+        
+        # Wait no longer than the turn budget; a late rephrasing is kept for a later turn
+        completed, rephrased = call_with_budget(
+            lambda: self._generate_rephrase(base_question, phase),
+            llm.budget.budget(TASK_REPHRASE),
+            on_late=cache_rephrase
+        )
+        if not completed:
+            print(f"Question rephrasing exceeded the latency budget for {phase}; using the base question")
+            return base_question
+        
+        if cache_key:
+            cache_rephrase(rephrased)
+            self._refill_rephrase_pool(cache_key, base_question, phase)
+        
+        return rephrased or base_question
+
+    def stream_rephrase_question_with_ai(self, base_question, phase):
+        """Stream a rephrased question as it is generated.
+        
+        Yields ('token', text) tuples while the model is generating, followed by a
+        single ('final', question) tuple holding the validated question. The final
+        question may differ from the streamed tokens if validation fell back to the
+        base question, so clients should replace the streamed text with it. If the
+        first chunk does not arrive within the turn budget the base question is used.
+        """
+        banked = self._pick_banked_variant(base_question, phase)
+        if banked:
+            yield 'final', banked
+            return
+        
+        cache_key = self._rephrase_cache_key(base_question, phase)
+        if cache_key:
+            cached = self.rephrase_cache.get(cache_key)
+            if cached:
+                self._refill_rephrase_pool(cache_key, base_question, phase)
+                yield 'final', cached
+                return
+        
+        if llm.is_overloaded(TASK_REPHRASE):
+            yield 'final', base_question
+            return
+        
+        rephrase_prompt = self._build_rephrase_prompt(base_question, phase)
+        
+        try:
+            stream = llm.chat(
+                model=REPHRASE_MODEL,
+                messages=[
+                    {"role": "system", "content": rephrase_prompt}
+                ],
+                stream=True,
+                task=TASK_REPHRASE
+            )
             
-            # Check if bold formatting was preserved
-            rephrased_bold_matches = re.findall(bold_pattern, rephrased)
+            # Wait no longer than the turn budget for the first chunk; a late stream is closed unread
+            completed, chunk = call_with_budget(
+                lambda: next(stream, None),
+                llm.budget.budget(TASK_REPHRASE),
+                on_late=lambda chunk: stream.close()
+            )
+            if not completed:
+                print(f"Question rephrasing exceeded the latency budget for {phase}; using the base question")
+                yield 'final', base_question
+                return
             
-            # If bold content was lost, restore it using post-processing
-            if bold_matches and len(rephrased_bold_matches) < len(bold_matches):
-                print(f"⚠️  Bold formatting partially lost during rephrasing. Attempting restoration...")
-                
-                # Try to restore bold formatting by finding the content in the rephrased text
-                restored_text = rephrased
-                for original_bold in bold_matches:
-                    # Look for the content without bold markers in the rephrased text
-                    if original_bold in restored_text and f"**{original_bold}**" not in restored_text:
-                        # Replace the plain text with bold version
-                        restored_text = restored_text.replace(original_bold, f"**{original_bold}**")
-                        print(f"   Restored bold formatting for: {original_bold}")
-                
-                rephrased = restored_text
+            chunks = []
+            while chunk is not None:
+                token = chunk['message']['content']
+                if token:
+                    chunks.append(token)
+                    yield 'token', token
+                chunk = next(stream, None)
             
-            # Final verification
-            final_bold_matches = re.findall(bold_pattern, rephrased)
-            if bold_matches and len(final_bold_matches) == 0:
-                print(f"❌ Bold formatting completely lost. Using original question.")
-                return base_question
+            rephrased = self._finalize_rephrase(''.join(chunks), base_question)
+            if cache_key:
+                if rephrased != base_question:
+                    self.rephrase_cache.add(cache_key, rephrased)
+                self._refill_rephrase_pool(cache_key, base_question, phase)
             
-            # Fallback to original if rephrasing fails or is too short
-            if len(rephrased) < 20 or len(rephrased) > len(base_question) * 2.5:
-                return base_question
-                
-            # Success - log if bold formatting was preserved
-            if bold_matches and len(final_bold_matches) >= len(bold_matches):
-                print(f"✅ Bold formatting preserved in rephrased question")
-                
-            return rephrased
+            yield 'final', rephrased
             
         except Exception as e:
             print(f"Question rephrasing failed: {e}")
-            return base_question
+            yield 'final', base_question
         
     def should_initiate_conversation(self):
         if not self.last_interaction:
@@ -172,6 +351,70 @@ Provide ONLY the rephrased question, nothing else."""
         time_since_last = datetime.utcnow() - self.last_interaction
         return time_since_last > timedelta(hours=24)
         
+    def to_state(self):
+        """The chat's progress as plain JSON-safe data, for a session store shared by workers.
+        
+        Only ids and small values are kept: the phase, the participant's name, the
+        ids of the situations collected so far and the current memory references.
+        A written-behind turn is waited for first so its situation ids are known.
+        """
+        self._wait_for_written_turn()
+        return {
+            'version': CONVERSATION_STATE_VERSION,
+            'user_id': self.memory.user_id,
+            'phase_index': self.current_phase_index,
+            'user_name': self.user_name,
+            'situations': dict(self.current_situation_data),
+            'memory_references': list(self._current_memory_references)
+        }
+    
+    @classmethod
+    def from_state(cls, state, rephrase_cache=None, variant_bank=None, write_behind=None):
+        """Rebuild a chat from to_state() output; bind() its memory to a session before use"""
+        from utils.cbt_memory import CBTMemoryManager
+        
+        if state.get('version') != CONVERSATION_STATE_VERSION:
+            raise ValueError(f"Unsupported conversation state version: {state.get('version')}")
+        
+        conversation_manager = cls(
+            CBTMemoryManager(None, user_id=state['user_id']),
+            rephrase_cache=rephrase_cache, variant_bank=variant_bank, write_behind=write_behind
+        )
+        conversation_manager.current_phase_index = state['phase_index']
+        conversation_manager.user_name = state['user_name']
+        conversation_manager.current_situation_data = dict(state['situations'])
+        conversation_manager._current_memory_references = list(state['memory_references'])
+        return conversation_manager
+        
+    @classmethod
+    def from_database(cls, session, user_id, answers, rephrase_cache=None, variant_bank=None, write_behind=None):
+        """Rebuild a chat whose state was lost (a restart) from what its turns committed.
+        
+        Every turn logs exactly one conversation row, so `answers` - the participant's
+        messages from that log, oldest first - gives the phase. The situation ids come
+        from one indexed read and the name is extracted again from the first answer;
+        nothing goes through the LLM. Bind the memory to a session before use.
+        """
+        from utils.cbt_database import Situation
+        from utils.cbt_memory import CBTMemoryManager
+        
+        conversation_manager = cls(
+            CBTMemoryManager(None, user_id=user_id),
+            rephrase_cache=rephrase_cache, variant_bank=variant_bank, write_behind=write_behind
+        )
+        conversation_manager.current_phase_index = len(answers)
+        if answers:
+            conversation_manager._extract_name_if_present(answers[0])
+        
+        situations = session.query(Situation.id, Situation.category).filter(
+            Situation.user_id == user_id,
+            Situation.category.like('assessment_situation_%')
+        ).order_by(Situation.timestamp, Situation.id).all()
+        for situation_id, category in situations:
+            # Oldest first, so a repeated number keeps the latest situation
+            conversation_manager.current_situation_data[f"situation_{category.rsplit('_', 1)[1]}"] = situation_id
+        return conversation_manager
+        
     def get_current_phase(self):
         """Get current phase name"""
         if self.current_phase_index < len(self.phases):
@@ -182,52 +425,108 @@ Provide ONLY the rephrased question, nothing else."""
         """Move to next phase"""
         self.current_phase_index += 1
         
+    @contextmanager
+    def turn(self):
+        """Unit of work for one conversational turn.
+        
+        Everything written while handling one message - the answer's rows, background
+        updates and the conversation log row - is committed once when the block exits.
+        If the block raises (an LLM failure mid-turn, a client leaving a stream) the
+        transaction is rolled back and the chat returns to the phase it was in, so the
+        participant can answer the same question again.
+        
+        With a write-behind queue the turn's rows are queued for the background
+        writer instead, and the next turn waits for them before it reads anything.
+        """
+        self._wait_for_written_turn()
+        saved_state = (self.current_phase_index, dict(self.current_situation_data), self.user_name, self._current_memory_references)
+        session = self.memory.session
+        try:
+            with unit_of_work(session, write_behind=self.write_behind is not None):
+                yield
+                if self.write_behind is not None:
+                    self._pending_write = self.write_behind.submit_changes(session, session.info.get('deferred_writes', ()))
+        except BaseException:
+            self.current_phase_index, self.current_situation_data, self.user_name, self._current_memory_references = saved_state
+            self.cancel_prefetch()
+            
+            # The snapshot and cached context may hold rows that were just rolled back
+            with self._snapshot_lock:
+                self._memory_snapshot = None
+            self.memory.reset_context()
+            raise
+        
+        # Keep only primary keys between requests; written-behind rows get theirs from the writer
+        for key, situation in list(self.current_situation_data.items()):
+            if not isinstance(situation, int) and not inspect(situation).transient:
+                self.current_situation_data[key] = inspect(situation).identity[0]
+        
+    def _wait_for_written_turn(self):
+        """Wait until the previous turn's written-behind rows are committed, so this turn reads them"""
+        pending, self._pending_write = self._pending_write, None
+        if pending is None:
+            return
+        
+        if not pending.wait(WRITE_BEHIND_WAIT):
+            print(f"⚠️  Previous turn still not written after {WRITE_BEHIND_WAIT}s")
+        elif pending.error:
+            print(f"⚠️  Previous turn could not be saved: {pending.error}")
+        
+        # Situations kept for linking were inserted by the writer; switch to their ids
+        for key, situation in list(self.current_situation_data.items()):
+            if isinstance(situation, int):
+                continue
+            if situation in pending.ids:
+                self.current_situation_data[key] = pending.ids[situation]
+            else:
+                del self.current_situation_data[key]
+        
     def _get_personalized_question(self, base_question, phase):
         """Create personalized questions that reference previous database information"""
-        # Get previous data from database - include current user AND previous user (user_id - 1)
-        from utils.cbt_database import Situation, AutomaticThought, Emotion, Behavior, BackgroundInfo
-        
-        current_user_id = self.memory.user.id
-        previous_user_id = current_user_id - 1
+        personalized_question, memory_references = self._personalize_question(
+            base_question, phase, self.memory.session, self.memory.user_id
+        )
         
-        # Determine which user IDs to query (handle case where current user is first user)
+        # Store the memory references for later bold formatting
+        self._current_memory_references = memory_references
+        return personalized_question
+    
+    def _personalization_user_ids(self, current_user_id):
+        """Users whose memory personalizes the questions: the current user and the previous one"""
+        # Handle case where current user is first user - only query current user data
         if current_user_id == 1:
-            # First user - only query current user data
-            user_ids_to_query = [current_user_id]
-        else:
-            # Later users - query current user AND previous user for personalization
-            user_ids_to_query = [current_user_id, previous_user_id]
-        
-        # Get data from relevant users
-        recent_situations = self.memory.session.query(Situation)\
-            .filter(Situation.user_id.in_(user_ids_to_query))\
-            .order_by(Situation.timestamp.desc())\
-            .limit(5)\
-            .all()
-            
-        recent_thoughts = self.memory.session.query(AutomaticThought)\
-            .filter(AutomaticThought.user_id.in_(user_ids_to_query))\
-            .order_by(AutomaticThought.timestamp.desc())\
-            .limit(7)\
-            .all()
-            
-        recent_emotions = self.memory.session.query(Emotion)\
-            .filter(Emotion.user_id.in_(user_ids_to_query))\
-            .order_by(Emotion.timestamp.desc())\
-            .limit(7)\
-            .all()
-            
-        recent_behaviors = self.memory.session.query(Behavior)\
-            .filter(Behavior.user_id.in_(user_ids_to_query))\
-            .order_by(Behavior.timestamp.desc())\
-            .limit(7)\
-            .all()
-            
-        # Get background info from relevant users if available
-        background = self.memory.session.query(BackgroundInfo)\
-            .filter(BackgroundInfo.user_id.in_(user_ids_to_query))\
-            .order_by(BackgroundInfo.updated_at.desc())\
-            .first()
+            return [current_user_id]
+        return [current_user_id, current_user_id - 1]
+
+    def _get_memory_snapshot(self, session, current_user_id):
+        """Return the chat's memory snapshot, loading it with `session` on first use"""
+        user_ids = self._personalization_user_ids(current_user_id)
+        with self._snapshot_lock:
+            if self._memory_snapshot is None or self._memory_snapshot.user_ids != user_ids:
+                self._memory_snapshot = MemorySnapshot.load(session, user_ids)
+            return self._memory_snapshot
+
+    def _remember(self, kind, text):
+        """Keep a loaded memory snapshot current with a row this chat just wrote"""
+        if self._memory_snapshot is not None:
+            self._memory_snapshot.record(kind, text)
+
+    def _remember_background(self, background):
+        if self._memory_snapshot is not None:
+            self._memory_snapshot.record_background(background.chief_complaint, background.stress_response_patterns)
+
+    def _personalize_question(self, base_question, phase, session, current_user_id):
+        """Build a personalized question from stored memory.
+        
+        Takes the session and user id explicitly so it can run on a prefetch worker
+        with its own session. Returns (question, memory_references).
+        """
+        snapshot = self._get_memory_snapshot(session, current_user_id)
+        recent_situations = snapshot.recent('situations')
+        recent_thoughts = snapshot.recent('automatic_thoughts')
+        recent_emotions = snapshot.recent('emotions')
+        recent_behaviors = snapshot.recent('behaviors')
+        background = snapshot.background
         
         # Build MUCH MORE OBVIOUS personalization context with explicit memory language
         personalization_context = ""
@@ -351,23 +650,13 @@ Provide ONLY the rephrased question, nothing else."""
             if len(personalized_question) > len(personalization_context):
                 personalized_question = personalization_context + base_question[0].upper() + base_question[1:]
             
-            # Store the memory references for later bold formatting
-            self._current_memory_references = memory_references
-            
-            return personalized_question
+            return personalized_question, memory_references
         
         # No personalization available
-        self._current_memory_references = []
-        return base_question
-        
-    def get_contextual_starter(self):
-        """Get the appropriate question for current phase with AI variation"""
-        phase = self.get_current_phase()
+        return base_question, []
         
-        if phase == 'complete':
-            return "Based on everything you've shared, let me reflect back what I've noticed about your patterns..."
-        
-        # Get base question
+    def get_base_question(self, phase):
+        """Get the structured question for a phase, with its contextual prefix for flow"""
         base_question = self.base_questions.get(phase)
         if not base_question:
             return None
@@ -380,18 +669,149 @@ Provide ONLY the rephrased question, nothing else."""
         elif phase == 'patterns_beliefs':
             base_question = f"Thank you for sharing those three situations with me. {base_question}"
         
+        return base_question
+
+    def _build_question(self, phase, personalized, session, user_id, rephrase=True):
+        """Build the question for a phase; returns (question, memory_references).
+        
+        With rephrase=False the question is asked as it stands, without the LLM.
+        """
+        base_question = self.get_base_question(phase)
+        if not base_question:
+            return None, []
+        
+        if not personalized:
+            # Use AI to create natural variation WITHOUT personalization
+            return (self._rephrase_question_with_ai(base_question, phase) if rephrase else base_question), []
+        
         # Apply personalization (references to previous database information)
-        personalized_question = self._get_personalized_question(base_question, phase)
+        personalized_question, memory_references = self._personalize_question(base_question, phase, session, user_id)
         
         # CRITICAL FIX: Only use AI rephrasing if there's no bold formatting to preserve
         # Check if personalized question contains bold markers
-        if '**' in personalized_question:
+        if '**' in personalized_question or not rephrase:
             # Personalized question with memory references - don't rephrase to preserve bold formatting
-            return personalized_question
+            return personalized_question, memory_references
         else:
             # No personalization or no bold formatting - safe to rephrase
             varied_question = self._rephrase_question_with_ai(personalized_question, phase)
-            return varied_question
+            return varied_question, memory_references
+
+    def _personalization_sources(self, phase):
+        """Tables whose contents determine the personalized question for a phase"""
+        if phase == 'introduction':
+            return {'background_info'}
+        elif 'situation' in phase:
+            return {'situations'}
+        elif 'thoughts' in phase:
+            return {'automatic_thoughts'}
+        elif 'emotions' in phase:
+            return {'emotions'}
+        elif 'behavior' in phase:
+            return {'behaviors'}
+        elif phase == 'patterns_beliefs':
+            return {'background_info', 'situations', 'automatic_thoughts'}
+        return set()
+
+    def _mark_written(self, *tables):
+        """Record tables written this turn so stale prefetched questions and cached context are discarded"""
+        self._tables_written.update(tables)
+        if self.memory is not None:
+            self.memory.invalidate_context(*tables)
+
+    def prefetch_next_question(self, personalized=True):
+        """Start building the next phase's question on a background worker.
+        
+        Call this once the current question has been delivered; the next question
+        only depends on the phase and stored memory, so it can be prepared while
+        the participant is typing. get_contextual_starter() and
+        get_contextual_starter_without_personalization() collect the result.
+        """
+        next_index = self.current_phase_index + 1
+        if next_index >= len(self.phases):
+            return
+        phase = self.phases[next_index]
+        if phase not in self.base_questions:
+            return
+        
+        self.cancel_prefetch()
+        self._tables_written = set()
+        
+        # Capture plain values here; ORM objects must not be touched from the worker
+        user_id = self.memory.user_id
+        engine = self.memory.session.get_bind()
+        
+        def build():
+            from sqlalchemy.orm import Session
+            with Session(bind=engine) as session:
+                return self._build_question(phase, personalized, session, user_id)
+        
+        self._prefetch = {
+            'phase_index': next_index,
+            'personalized': personalized,
+            'sources': self._personalization_sources(phase) if personalized else set(),
+            'future': _prefetch_executor.submit(build)
+        }
+
+    def cancel_prefetch(self):
+        """Discard any pending prefetched question"""
+        prefetch, self._prefetch = self._prefetch, None
+        if prefetch:
+            prefetch['future'].cancel()
+
+    def _collect_prefetched_question(self, personalized):
+        """Return the prefetched question for the current phase, or None if unavailable or stale"""
+        prefetch, self._prefetch = self._prefetch, None
+        if not prefetch:
+            return None
+        
+        if prefetch['phase_index'] != self.current_phase_index or prefetch['personalized'] != personalized:
+            prefetch['future'].cancel()
+            return None
+        
+        # The answer just saved may change what personalization would pull
+        stale_sources = prefetch['sources'] & self._tables_written
+        if stale_sources:
+            print(f"🔄 Prefetched question invalidated by new {', '.join(sorted(stale_sources))} data")
+            prefetch['future'].cancel()
+            return None
+        
+        try:
+            question, memory_references = prefetch['future'].result(timeout=llm.budget.budget(TASK_REPHRASE))
+        except FutureTimeoutError:
+            # Still queued or waiting on the model: stop waiting and ask the question as it stands
+            print("Prefetched question exceeded the latency budget; using the base question")
+            prefetch['future'].cancel()
+            question, memory_references = self._build_question(
+                self.get_current_phase(), personalized, self.memory.session, self.memory.user_id, rephrase=False
+            )
+        except Exception as e:
+            print(f"Question prefetch failed: {e}")
+            return None
+        
+        if question is None:
+            return None
+        
+        self._current_memory_references = memory_references
+        return question
+
+    def get_contextual_starter(self):
+        """Get the appropriate question for current phase with AI variation"""
+        phase = self.get_current_phase()
+        
+        if phase == 'complete':
+            return "Based on everything you've shared, let me reflect back what I've noticed about your patterns..."
+        
+        # Use the speculatively prepared question if it is still valid
+        prefetched = self._collect_prefetched_question(personalized=True)
+        if prefetched is not None:
+            return prefetched
+        
+        question, memory_references = self._build_question(phase, True, self.memory.session, self.memory.user_id)
+        
+        # Store the memory references for later bold formatting
+        self._current_memory_references = memory_references
+        return question
 
     def get_contextual_starter_without_personalization(self):
         """Get pure CBT questions without any personalization/database references"""
@@ -400,23 +820,13 @@ Provide ONLY the rephrased question, nothing else."""
         if phase == 'complete':
             return "Based on everything you've shared, let me reflect back what I've noticed about your patterns..."
         
-        # Get base question without any personalization
-        base_question = self.base_questions.get(phase)
-        if not base_question:
-            return None
-            
-        # Add contextual prefixes for flow
-        if phase == 'situation_2':
-            base_question = f"Thank you for sharing that. {base_question}"
-        elif phase == 'situation_3':
-            base_question = f"I appreciate you sharing these experiences. {base_question}"
-        elif phase == 'patterns_beliefs':
-            base_question = f"Thank you for sharing those three situations with me. {base_question}"
-        
-        # Use AI to create natural variation WITHOUT personalization
-        varied_question = self._rephrase_question_with_ai(base_question, phase)
+        # Use the speculatively prepared question if it is still valid
+        prefetched = self._collect_prefetched_question(personalized=False)
+        if prefetched is not None:
+            return prefetched
         
-        return varied_question
+        question, _ = self._build_question(phase, False, None, None)
+        return question
 
     def save_response_data(self, user_input):
         """Save user response to appropriate database table based on current phase"""
@@ -452,110 +862,124 @@ Provide ONLY the rephrased question, nothing else."""
         self._extract_name_if_present(user_input)
         
         # Save as chief complaint
-        background = self.memory.session.query(BackgroundInfo).filter_by(user_id=self.memory.user.id).first()
+        background = self.memory.session.query(BackgroundInfo).filter_by(user_id=self.memory.user_id).first()
         if not background:
-            background = BackgroundInfo(user_id=self.memory.user.id)
+            background = BackgroundInfo(user_id=self.memory.user_id)
             self.memory.session.add(background)
         
         background.chief_complaint = user_input[:500]
-        self.memory.session.commit()
+        commit_or_defer(self.memory.session)
+        self._mark_written('background_info')
+        self._remember_background(background)
     
     def _save_situation_data(self, user_input, situation_num):
         """Save situation description"""
         from utils.cbt_database import Situation
         
         situation = Situation(
-            user_id=self.memory.user.id,
+            user_id=self.memory.user_id,
             description=user_input,
             category=f'assessment_situation_{situation_num}',
             context=f'CBT Assessment - Situation {situation_num}'
         )
         self.memory.session.add(situation)
-        self.memory.session.commit()
+        commit_or_defer(self.memory.session)
+        self._mark_written('situations')
+        self._remember('situations', user_input)
         
-        # Store for linking to subsequent data
+        # Store for linking to subsequent data; turn() swaps in the id once it is known
         self.current_situation_data[f'situation_{situation_num}'] = situation
     
+    def _situation_link(self, situation_num):
+        """Column values linking an answer to its situation, falling back to the most recent one.
+        
+        Situations from earlier turns are kept as ids. One saved since the last turn()
+        boundary is still the row itself and is linked through the relationship.
+        Returns None if the user has no situation yet.
+        """
+        situation = self.current_situation_data.get(f'situation_{situation_num}')
+        if situation is None:
+            from utils.cbt_database import Situation
+            situation = self.memory.session.query(Situation.id).filter_by(
+                user_id=self.memory.user_id).order_by(Situation.timestamp.desc()).limit(1).scalar()
+        if situation is None:
+            return None
+        if isinstance(situation, int):
+            return {'situation_id': situation}
+        return {'situation': situation}
+    
     def _save_thoughts_data(self, user_input, situation_num):
         """Save automatic thoughts linked to current situation"""
         from utils.cbt_database import AutomaticThought
         
-        current_situation = self.current_situation_data.get(f'situation_{situation_num}')
-        if not current_situation:
-            # Fallback: get most recent situation
-            from utils.cbt_database import Situation
-            current_situation = self.memory.session.query(Situation).filter_by(
-                user_id=self.memory.user.id).order_by(Situation.timestamp.desc()).first()
-        
-        if current_situation:
+        situation_link = self._situation_link(situation_num)
+        if situation_link:
             thought = AutomaticThought(
-                user_id=self.memory.user.id,
-                situation_id=current_situation.id,
+                user_id=self.memory.user_id,
+                **situation_link,
                 thought=user_input
             )
             self.memory.session.add(thought)
-            self.memory.session.commit()
+            commit_or_defer(self.memory.session)
+            self._mark_written('automatic_thoughts')
+            self._remember('automatic_thoughts', user_input)
     
     def _save_emotions_data(self, user_input, situation_num):
         """Save emotional and physical responses"""
         from utils.cbt_database import Emotion
         
-        current_situation = self.current_situation_data.get(f'situation_{situation_num}')
-        if not current_situation:
-            from utils.cbt_database import Situation
-            current_situation = self.memory.session.query(Situation).filter_by(
-                user_id=self.memory.user.id).order_by(Situation.timestamp.desc()).first()
-        
-        if current_situation:
+        situation_link = self._situation_link(situation_num)
+        if situation_link:
             # Parse emotions and physical symptoms from response
             emotion = Emotion(
-                user_id=self.memory.user.id,
-                situation_id=current_situation.id,
+                user_id=self.memory.user_id,
+                **situation_link,
                 emotion=user_input,
                 intensity='medium',  # Default, could be enhanced with NLP
                 context='CBT Assessment - Emotional and Physical Response'
             )
             self.memory.session.add(emotion)
-            self.memory.session.commit()
+            commit_or_defer(self.memory.session)
+            self._mark_written('emotions')
+            self._remember('emotions', user_input)
             
             # Also save to background info for physical symptoms
             from utils.cbt_database import BackgroundInfo
-            background = self.memory.session.query(BackgroundInfo).filter_by(user_id=self.memory.user.id).first()
+            background = self.memory.session.query(BackgroundInfo).filter_by(user_id=self.memory.user_id).first()
             if background:
                 if not background.major_symptoms_physiological:
                     background.major_symptoms_physiological = user_input[:500]
                 else:
                     background.major_symptoms_physiological += f" | Situation {situation_num}: {user_input[:200]}"
-                self.memory.session.commit()
+                commit_or_defer(self.memory.session)
+                self._mark_written('background_info')
+                self._remember_background(background)
     
     def _save_behavior_data(self, user_input, situation_num):
         """Save behavioral responses"""
         from utils.cbt_database import Behavior
         
-        current_situation = self.current_situation_data.get(f'situation_{situation_num}')
-        if not current_situation:
-            from utils.cbt_database import Situation
-            current_situation = self.memory.session.query(Situation).filter_by(
-                user_id=self.memory.user.id).order_by(Situation.timestamp.desc()).first()
-        
-        if current_situation:
+        situation_link = self._situation_link(situation_num)
+        if situation_link:
             behavior = Behavior(
-                user_id=self.memory.user.id,
-                situation_id=current_situation.id,
+                user_id=self.memory.user_id,
+                **situation_link,
                 action=user_input,
                 behavior_type='assessment_response'
             )
             self.memory.session.add(behavior)
-            self.memory.session.commit()
+            commit_or_defer(self.memory.session)
+            self._mark_written('behaviors')
+            self._remember('behaviors', user_input)
     
     def _save_patterns_beliefs_data(self, user_input):
         """Save patterns, coping strategies, and beliefs"""
         from utils.cbt_database import BackgroundInfo, CBTBeliefs
         
         # Save to background info for patterns and coping
-        background = self.memory.session.query(BackgroundInfo).filter_by(user_id=self.memory.user.id).first()
+        background = self.memory.session.query(BackgroundInfo).filter_by(user_id=self.memory.user_id).first()
         if not background:
-            background = BackgroundInfo(user_id=self.memory.user.id)
+            background = BackgroundInfo(user_id=self.memory.user_id)
             self.memory.session.add(background)
         
         background.stress_response_patterns = user_input[:500]
@@ -563,13 +987,15 @@ Provide ONLY the rephrased question, nothing else."""
         
         # Also create initial beliefs record
         beliefs = CBTBeliefs(
-            user_id=self.memory.user.id,
+            user_id=self.memory.user_id,
             core_beliefs=[user_input],
             intermediate_beliefs=["Extracted from assessment"],
             coping_strategies=[user_input]
         )
         self.memory.session.add(beliefs)
-        self.memory.session.commit()
+        commit_or_defer(self.memory.session)
+        self._mark_written('background_info', 'cbt_beliefs')
+        self._remember_background(background)
     
     def _extract_name_if_present(self, user_input):
         """Try to extract name from introduction if mentioned"""
@@ -685,21 +1111,22 @@ CRITICAL RULES:
         from utils.cbt_database import CBTBeliefs
         
         # Update or create beliefs with formulation
-        existing_beliefs = self.memory.session.query(CBTBeliefs).filter_by(user_id=self.memory.user.id).first()
+        existing_beliefs = self.memory.session.query(CBTBeliefs).filter_by(user_id=self.memory.user_id).first()
         
         if existing_beliefs:
             existing_beliefs.core_beliefs = [analysis_text]
             existing_beliefs.updated_at = datetime.utcnow()
         else:
             beliefs = CBTBeliefs(
-                user_id=self.memory.user.id,
+                user_id=self.memory.user_id,
                 core_beliefs=[analysis_text],
                 intermediate_beliefs=["CBT Assessment Formulation"],
                 coping_strategies=["Identified through structured assessment"]
             )
             self.memory.session.add(beliefs)
         
-        self.memory.session.commit()
+        commit_or_defer(self.memory.session)
+        self._mark_written('cbt_beliefs')
 
     def user_wants_to_skip(self, user_input):
         """Check if user wants to skip the current question"""
@@ -713,13 +1140,16 @@ CRITICAL RULES:
         user_lower = user_input.lower()
         return any(phrase in user_lower for phrase in skip_phrases)
 
-    def generate_improved_cbt_formulation(self):
-        """Generate CBT formulation with improved prompt that uses actual database data"""
-        import ollama
+    def gather_formulation_inputs(self):
+        """Collect the stored assessment data used to prompt a CBT formulation.
+        
+        Returns a dict with the presenting concern, detected situation themes and
+        thought patterns, and the formatted assessment context for the model.
+        """
         from utils.cbt_database import Situation, AutomaticThought, Emotion, Behavior, BackgroundInfo
         
         # Get all stored data for this user
-        user_id = self.memory.user.id
+        user_id = self.memory.user_id
         situations = self.memory.session.query(Situation).filter_by(user_id=user_id).all()
         thoughts = self.memory.session.query(AutomaticThought).filter_by(user_id=user_id).all()
         emotions = self.memory.session.query(Emotion).filter_by(user_id=user_id).all()
@@ -844,6 +1274,21 @@ SITUATIONS EXPLORED:
         if background and background.stress_response_patterns:
             formulation_context += f"\nIDENTIFIED PATTERNS:\n{background.stress_response_patterns}\n"
         
+        return {
+            'presenting_concern': presenting_concern,
+            'themes_text': themes_text,
+            'thought_patterns_text': thought_patterns_text,
+            'formulation_context': formulation_context
+        }
+
+    def generate_improved_cbt_formulation(self):
+        """Generate CBT formulation with improved prompt that uses actual database data"""
+        inputs = self.gather_formulation_inputs()
+        presenting_concern = inputs['presenting_concern']
+        themes_text = inputs['themes_text']
+        thought_patterns_text = inputs['thought_patterns_text']
+        formulation_context = inputs['formulation_context']
+        
         # Create improved system prompt that forces AI to use actual data
         improved_system_prompt = f"""You are a CBT therapist creating a comprehensive formulation.
 
@@ -876,12 +1321,14 @@ The final section should provide 3 concrete therapeutic directions that directly
 Create a CBT formulation that directly addresses the user's actual experiences as documented in the assessment data."""
 
         try:
-            response = ollama.chat(
-                model="llama3.2",
+            # The whole formulation in one reply, so lift the per-section output cap
+            response = llm.chat(
                 messages=[
                     {"role": "system", "content": improved_system_prompt},
                     {"role": "user", "content": formulation_context}
-                ]
+                ],
+                task=TASK_FORMULATION,
+                options={'num_predict': -1}
             )
             
             formulation = response['message']['content'].strip()
@@ -0,0 +1,146 @@
+import asyncio
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from utils import async_bridge, llm
+from utils.llm_admission import PRIORITY_FORMULATION
+from utils.llm_routing import TASK_FORMULATION
+
+# Required formulation sections, in the order they are presented to the user
+FORMULATION_SECTIONS = [
+    ('Presenting Concerns', "What brought them here - summarize their presenting concern in their own terms"),
+    ('Situational Triggers', "The specific situations they described and what they have in common"),
+    ('Maladaptive Thoughts', "The actual automatic thought patterns they shared across situations"),
+    ('Emotional and Physical Responses', "Their specific emotional and physical reactions"),
+    ('Behavioral Patterns', "The actual behaviors they described and how these may maintain their difficulties"),
+    ('Potential Pathways for Exploration', "3 specific, actionable areas for therapeutic work based ONLY on their actual data, as a numbered list")
+]
+
+FORMULATION_OPENING = "Based on everything you've shared, here is a CBT formulation of what I've noticed about your patterns."
+
+SECTION_FALLBACK = "This section could not be generated at this time."
+
+class CBTFormulationEngine:
+    """Generates a CBT formulation as independent, concurrently scheduled section jobs.
+
+    Each required section is requested from the model as its own job so sections
+    can be streamed to the client as soon as they are ready, instead of waiting for
+    one monolithic reply. Sections are assembled in their canonical order before
+    the formulation is saved.
+    """
+
+    def __init__(self, conversation_manager, max_workers=None):
+        self.conversation_manager = conversation_manager
+        if max_workers is None:
+            max_workers = int(os.environ.get('FORMULATION_MAX_WORKERS', len(FORMULATION_SECTIONS)))
+        self.max_workers = max(1, max_workers)
+
+    def _build_section_prompt(self, inputs, title, instruction):
+        """Build the system prompt for a single formulation section"""
+        name_str = f"The user's name is {self.conversation_manager.user_name}." if self.conversation_manager.user_name else ""
+
+        return f"""You are a CBT therapist writing ONE section of a comprehensive formulation.
+
+{name_str}
+
+SECTION: {title}
+PURPOSE: {instruction}
+
+CRITICAL INSTRUCTIONS:
+- Write ONLY the body of the "{title}" section - no title, no other sections
+- Use ONLY the data provided in the user message - do NOT add generic examples
+- The user's specific presenting concern is: {inputs['presenting_concern']}
+- Reference the exact situations involving: {inputs['themes_text']}
+- Address the specific thought patterns: {inputs['thought_patterns_text']}
+- DO NOT mention anything not specifically discussed in the provided data
+- Use "I notice..." language and keep a warm, therapeutic tone
+- Use bullet points (*) for lists and keep the section to 60-120 words"""
+
+    def _clean_section(self, title, text):
+        """Strip quotes and any header the model repeated from the section body"""
+        text = text.strip().strip('"').strip("'").strip()
+        header_pattern = r'^(?:#+\s*)?(?:\d+\.\s*)?\**\s*' + re.escape(title) + r'\s*:?\s*\**\s*:?\s*\n*'
+        return re.sub(header_pattern, '', text, flags=re.IGNORECASE).strip()
+
+    def _generate_section(self, inputs, title, instruction):
+        """Generate a single section (runs on a worker thread or as an event loop task)"""
+        response = llm.chat(
+            messages=[
+                {"role": "system", "content": self._build_section_prompt(inputs, title, instruction)},
+                {"role": "user", "content": inputs['formulation_context']}
+            ],
+            priority=PRIORITY_FORMULATION,
+            task=TASK_FORMULATION
+        )
+
+        return self._clean_section(title, response['message']['content'])
+
+    def assemble(self, sections):
+        """Join section bodies (keyed by section index) into the final formulation"""
+        parts = [FORMULATION_OPENING]
+        for index, (title, _) in enumerate(FORMULATION_SECTIONS):
+            parts.append(f"**{title}**\n\n{sections.get(index, SECTION_FALLBACK)}")
+        return '\n\n'.join(parts)
+
+    def _run_section_jobs(self, inputs):
+        """Start every section job and yield (index, finished future) in completion order.
+
+        Jobs run on a thread pool, or as tasks on the event loop when called inside
+        run_sync() on the async server.
+        """
+        jobs = [(self._generate_section, inputs, title, instruction) for title, instruction in FORMULATION_SECTIONS]
+
+        if async_bridge.in_event_loop():
+            tasks = {async_bridge.spawn(*job): index for index, job in enumerate(jobs)}
+            pending = set(tasks)
+            while pending:
+                done, pending = async_bridge.wait(asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED))
+                for task in done:
+                    yield tasks[task], task
+            return
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = {pool.submit(*job): index for index, job in enumerate(jobs)}
+            for future in as_completed(futures):
+                yield futures[future], future
+
+    def stream_sections(self):
+        """Generate all sections concurrently, yielding them as they complete.
+
+        Yields ('section', index, title, text) tuples in completion order, followed
+        by a single ('final', None, None, formulation) tuple once the formulation has
+        been assembled and saved.
+        """
+        # Database reads happen here, on the caller's thread; workers only call the model
+        inputs = self.conversation_manager.gather_formulation_inputs()
+        sections = {}
+
+        for index, future in self._run_section_jobs(inputs):
+            title = FORMULATION_SECTIONS[index][0]
+            try:
+                text = future.result() or SECTION_FALLBACK
+                sections[index] = text
+            except Exception as e:
+                print(f"Formulation section '{title}' failed: {e}")
+                text = SECTION_FALLBACK
+
+            yield 'section', index, title, text
+
+        if not sections:
+            yield 'final', None, None, "CBT formulation could not be generated at this time."
+            return
+
+        formulation = self.assemble(sections)
+
+        # Save the formulation
+        self.conversation_manager.save_cbt_beliefs(formulation)
+
+        yield 'final', None, None, formulation
+
+    def generate(self):
+        """Generate the full formulation, blocking until every section is ready"""
+        formulation = None
+        for kind, _, _, text in self.stream_sections():
+            if kind == 'final':
+                formulation = text
+        return formulation
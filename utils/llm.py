@@ -0,0 +1,213 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from utils import async_bridge
+from utils.llm_admission import AdmissionController, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
+from utils.llm_backends import create_backend
+from utils.llm_routing import get_route
+from utils.llm_latency import LatencyTracker, LatencyBudget
+from utils.llm_health import CircuitBreaker, HealthMonitor, LLMUnavailableError
+
+# Process-wide admission controller in front of every model call
+admission = AdmissionController.from_env()
+
+# Async callers queued for a slot wait here rather than on the event loop (see achat)
+_admission_waiters = ThreadPoolExecutor(max_workers=max(1, admission.max_queue), thread_name_prefix='llm-admission')
+
+# Rolling latency per task (including time spent queued) and the turn budget derived from it
+latency = LatencyTracker()
+budget = LatencyBudget.from_env(latency)
+
+# Trips after consecutive backend failures so call sites fall back without waiting on timeouts
+breaker = CircuitBreaker.from_env()
+
+# Model backend, selected with LLM_BACKEND (see utils/llm_backends.py)
+_backend = None
+_monitor = None
+
+def get_backend():
+    """Return the process-wide backend, creating it on first use"""
+    global _backend
+    if _backend is None:
+        _backend = create_backend()
+    return _backend
+
+def set_backend(backend):
+    """Replace the process-wide backend (used by tests and benchmarks)"""
+    global _backend
+    _backend = backend
+
+def chat(model=None, messages=None, priority=PRIORITY_INTERACTIVE, timeout=None, stream=False, options=None, task=None, **kwargs):
+    """Call the chat model once a slot is available.
+
+    With `task` set, the model, inference options and keep_alive come from the
+    routing table (see utils/llm_routing.py); an explicit `model` or `options`
+    entries take precedence. `timeout` bounds how long the call may wait in the
+    admission queue. With stream=True a generator of chunks is returned; the slot
+    is held until the stream has been fully consumed or closed.
+    """
+    model, options = _apply_route(task, model, options, kwargs)
+
+    if stream:
+        if async_bridge.in_event_loop():
+            # Running inside run_sync() on the async server: wait for each chunk on the event loop
+            return _stream_chat_on_loop(model, messages, priority, timeout, options, task, **kwargs)
+        return _stream_chat(model, messages, priority, timeout, options, task, **kwargs)
+
+    if async_bridge.in_event_loop():
+        # Running inside run_sync() on the async server: wait for the reply on the event loop
+        return async_bridge.wait(_achat(model, messages, priority, timeout, options, task, **kwargs))
+
+    _check_circuit()
+    started = time.monotonic()
+    with admission.slot(priority, timeout):
+        response = _call_backend(lambda: get_backend().chat(model, messages, options=options, **kwargs))
+    if task:
+        latency.record(task, time.monotonic() - started)
+    return response
+
+async def achat(model=None, messages=None, priority=PRIORITY_INTERACTIVE, timeout=None, options=None, task=None, **kwargs):
+    """chat() for asyncio code: waits for a slot and for the reply without blocking the event loop"""
+    model, options = _apply_route(task, model, options, kwargs)
+    return await _achat(model, messages, priority, timeout, options, task, **kwargs)
+
+def _apply_route(task, model, options, kwargs):
+    """Fill in the model, options and keep_alive for `task` from the routing table"""
+    if task:
+        route = get_route(task)
+        model = model or route.model
+        options = {**route.options(), **(options or {})}
+        if route.keep_alive:
+            # Only Ollama understands keep_alive; other backends ignore it
+            kwargs.setdefault('keep_alive', route.keep_alive)
+    return model, options
+
+async def _achat(model, messages, priority, timeout, options, task, **kwargs):
+    _check_circuit()
+    started = time.monotonic()
+    await _admit(priority, timeout)
+    try:
+        if not breaker.allow():
+            raise LLMUnavailableError("LLM backend circuit is open")
+        try:
+            response = await get_backend().achat(model, messages, options=options, **kwargs)
+        except Exception:
+            breaker.record_failure()
+            raise
+        breaker.record_success()
+    finally:
+        admission.release(time.monotonic() - started)
+    if task:
+        latency.record(task, time.monotonic() - started)
+    return response
+
+async def _admit(priority, timeout):
+    """Take an admission slot without blocking the event loop"""
+    if admission.try_acquire():
+        return
+    # Queued callers wait on threads of their own; the queue bound caps how many there are
+    waiter = asyncio.get_running_loop().run_in_executor(_admission_waiters, admission.acquire, priority, timeout)
+    try:
+        await asyncio.shield(waiter)
+    except asyncio.CancelledError:
+        # The caller went away while queued; hand back the slot if it is granted anyway
+        waiter.add_done_callback(lambda granted: granted.exception() is None and admission.release())
+        raise
+
+def _stream_chat(model, messages, priority, timeout, options, task, **kwargs):
+    _check_circuit()
+    started = time.monotonic()
+    with admission.slot(priority, timeout):
+        if not breaker.allow():
+            raise LLMUnavailableError("LLM backend circuit is open")
+        first_chunk = True
+        try:
+            for chunk in get_backend().stream(model, messages, options=options, **kwargs):
+                if first_chunk:
+                    # The backend is answering; a stream abandoned by the client is not a failure
+                    breaker.record_success()
+                    first_chunk = False
+                yield chunk
+        except Exception:
+            breaker.record_failure()
+            raise
+        if first_chunk:
+            breaker.record_success()
+    if task:
+        latency.record(task, time.monotonic() - started)
+
+def _stream_chat_on_loop(model, messages, priority, timeout, options, task, **kwargs):
+    """_stream_chat() for code inside run_sync(): chunks come from the backend's asyncio client"""
+    _check_circuit()
+    started = time.monotonic()
+    async_bridge.wait(_admit(priority, timeout))
+    try:
+        if not breaker.allow():
+            raise LLMUnavailableError("LLM backend circuit is open")
+        chunks = get_backend().astream(model, messages, options=options, **kwargs)
+        first_chunk = True
+        try:
+            while (chunk := async_bridge.wait(anext(chunks, None))) is not None:
+                if first_chunk:
+                    # The backend is answering; a stream abandoned by the client is not a failure
+                    breaker.record_success()
+                    first_chunk = False
+                yield chunk
+        except Exception:
+            breaker.record_failure()
+            raise
+        finally:
+            # May run outside run_sync() when the stream is closed early, so it is not awaited here
+            asyncio.ensure_future(chunks.aclose())
+        if first_chunk:
+            breaker.record_success()
+    finally:
+        admission.release(time.monotonic() - started)
+    if task:
+        latency.record(task, time.monotonic() - started)
+
+def _check_circuit():
+    """Fail fast, before queueing for a slot, while the circuit is open"""
+    if breaker.is_open():
+        raise LLMUnavailableError("LLM backend circuit is open")
+
+def _call_backend(call):
+    """Make one backend call through the circuit breaker"""
+    if not breaker.allow():
+        raise LLMUnavailableError("LLM backend circuit is open")
+    try:
+        result = call()
+    except Exception:
+        breaker.record_failure()
+        raise
+    breaker.record_success()
+    return result
+
+def is_overloaded(task):
+    """True when calls for `task` should be skipped in favour of their fallback"""
+    return breaker.is_open() or admission.is_saturated() or budget.is_overloaded(task)
+
+def embed(model, text, priority=PRIORITY_BACKGROUND, timeout=None):
+    """Return an embedding for `text` once a slot is available"""
+    _check_circuit()
+    with admission.slot(priority, timeout):
+        return _call_backend(lambda: get_backend().embed(model, text))
+
+def start_health_monitor(interval=None):
+    """Start probing the backend in the background (once per process)"""
+    global _monitor
+    if _monitor is None:
+        interval = interval or float(os.environ.get('LLM_HEALTH_INTERVAL', 10))
+        _monitor = HealthMonitor(lambda: get_backend().health(), breaker, interval=interval)
+        _monitor.start()
+    return _monitor
+
+def health():
+    """Report whether the backend is reachable and which models it serves.
+
+    Returns the monitor's cached result once it has probed; otherwise probes now.
+    """
+    if _monitor is not None and _monitor.status()['ok'] is not None:
+        return _monitor.status()
+    return {**get_backend().health(), 'circuit': breaker.state}
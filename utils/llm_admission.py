@@ -0,0 +1,132 @@
+import heapq
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Request priorities - lower values are admitted first
+PRIORITY_INTERACTIVE = 0   # Questions and framing the participant is waiting on
+PRIORITY_FORMULATION = 1   # Final formulation sections
+PRIORITY_BACKGROUND = 2    # Cache refills, extraction and other speculative work
+
+class LLMQueueFullError(Exception):
+    """Raised when the wait queue is full and a request cannot be admitted"""
+
+    def __init__(self, queue_depth, retry_after):
+        super().__init__(f"LLM queue is full ({queue_depth} waiting), retry in {retry_after}s")
+        self.queue_depth = queue_depth
+        self.retry_after = retry_after
+
+class LLMDeadlineExceededError(Exception):
+    """Raised when a request could not be admitted before its deadline"""
+
+class AdmissionController:
+    """Bounds the number of concurrent LLM calls and queues the rest by priority.
+
+    Up to `max_concurrent` calls run at once. Further callers wait in a priority
+    queue (FIFO within a priority) of at most `max_queue` entries; beyond that they
+    are rejected immediately with LLMQueueFullError so the web layer can answer
+    with a 503 and a Retry-After hint instead of piling more work onto the backend.
+    """
+
+    def __init__(self, max_concurrent=4, max_queue=32, default_timeout=30.0):
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue = max(0, max_queue)
+        self.default_timeout = default_timeout
+
+        self._cond = threading.Condition()
+        self._active = 0
+        self._waiting = []  # heap of [priority, sequence, granted]
+        self._sequence = itertools.count()
+
+        # Exponentially weighted average service time, used for Retry-After estimates
+        self._avg_service_time = 5.0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_concurrent=int(os.environ.get('LLM_MAX_CONCURRENT', 4)),
+            max_queue=int(os.environ.get('LLM_MAX_QUEUE', 32)),
+            default_timeout=float(os.environ.get('LLM_QUEUE_TIMEOUT', 30))
+        )
+
+    def _grant_locked(self):
+        """Admit waiting requests while there is free capacity"""
+        granted = False
+        while self._waiting and self._active < self.max_concurrent:
+            ticket = heapq.heappop(self._waiting)
+            ticket[2] = True
+            self._active += 1
+            granted = True
+        if granted:
+            self._cond.notify_all()
+
+    def acquire(self, priority=PRIORITY_INTERACTIVE, timeout=None):
+        """Wait for a slot; raises LLMQueueFullError or LLMDeadlineExceededError"""
+        timeout = self.default_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+
+        with self._cond:
+            if self._active < self.max_concurrent and not self._waiting:
+                self._active += 1
+                return
+
+            if len(self._waiting) >= self.max_queue:
+                raise LLMQueueFullError(len(self._waiting), self.retry_after())
+
+            ticket = [priority, next(self._sequence), False]
+            heapq.heappush(self._waiting, ticket)
+
+            while not ticket[2]:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._waiting.remove(ticket)
+                    heapq.heapify(self._waiting)
+                    raise LLMDeadlineExceededError(f"LLM request not admitted within {timeout:.1f}s")
+                self._cond.wait(remaining)
+
+    def try_acquire(self):
+        """Take a free slot without waiting; returns False if the caller would have to queue"""
+        with self._cond:
+            if self._active < self.max_concurrent and not self._waiting:
+                self._active += 1
+                return True
+            return False
+
+    def release(self, service_time=None):
+        with self._cond:
+            self._active -= 1
+            if service_time is not None:
+                self._avg_service_time = 0.8 * self._avg_service_time + 0.2 * service_time
+            self._grant_locked()
+
+    @contextmanager
+    def slot(self, priority=PRIORITY_INTERACTIVE, timeout=None):
+        """Hold an admission slot for the duration of the block"""
+        self.acquire(priority, timeout)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - started)
+
+    def is_saturated(self):
+        """True when new requests would be rejected outright"""
+        with self._cond:
+            return self._active >= self.max_concurrent and len(self._waiting) >= self.max_queue
+
+    def retry_after(self):
+        """Rough number of seconds until the current queue drains"""
+        queued = len(self._waiting)
+        return max(1, int(self._avg_service_time * (queued + 1) / self.max_concurrent))
+
+    def stats(self):
+        with self._cond:
+            return {
+                'active': self._active,
+                'queued': len(self._waiting),
+                'max_concurrent': self.max_concurrent,
+                'max_queue': self.max_queue,
+                'avg_service_time': round(self._avg_service_time, 2)
+            }
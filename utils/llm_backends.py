@@ -0,0 +1,306 @@
+import asyncio
+import hashlib
+import json
+import os
+import urllib.error
+import urllib.request
+
+# Every backend returns chat replies and stream chunks in the Ollama shape:
+#   {'message': {'role': 'assistant', 'content': '...'}}
+# so call sites can index response['message']['content'] regardless of backend.
+
+class LLMBackendError(Exception):
+    """Raised when a backend request fails"""
+
+class LLMBackend:
+    """Interface shared by all model backends"""
+
+    name = 'base'
+
+    def chat(self, model, messages, options=None, **kwargs):
+        """Return the full reply to `messages`"""
+        raise NotImplementedError
+
+    def stream(self, model, messages, options=None, **kwargs):
+        """Yield reply chunks as they are generated"""
+        raise NotImplementedError
+
+    async def achat(self, model, messages, options=None, **kwargs):
+        """Return the full reply to `messages` without blocking the event loop.
+
+        Backends with an asyncio client override this; the default runs chat() on a thread.
+        """
+        return await asyncio.to_thread(self.chat, model, messages, options=options, **kwargs)
+
+    async def astream(self, model, messages, options=None, **kwargs):
+        """Async iterator over reply chunks, for the event loop.
+
+        Backends with an asyncio client override this; the default reads stream() on a thread.
+        """
+        chunks = self.stream(model, messages, options=options, **kwargs)
+        finished = object()
+        while (chunk := await asyncio.to_thread(next, chunks, finished)) is not finished:
+            yield chunk
+
+    def embed(self, model, text):
+        """Return an embedding vector for `text`"""
+        raise NotImplementedError
+
+    def health(self):
+        """Return {'ok': bool, 'models': [names], 'error': message or None}.
+
+        A server that answers with a response the probe cannot read is still up:
+        the result is ok with 'degraded': True, so the circuit breaker is not tripped.
+        """
+        raise NotImplementedError
+
+def _reply(content):
+    return {'message': {'role': 'assistant', 'content': content}}
+
+def _degraded(error):
+    """Health result for a server that answered with a model list the probe could not read"""
+    return {'ok': True, 'degraded': True, 'models': [], 'error': f"Unreadable model list: {error}"}
+
+class OllamaBackend(LLMBackend):
+    """Backend for a local or remote Ollama server"""
+
+    name = 'ollama'
+
+    def __init__(self, host=None):
+        import ollama
+
+        self.host = host or os.environ.get('OLLAMA_HOST')
+        self._client = ollama.Client(host=self.host) if self.host else ollama
+        self._async_client = None
+
+    def chat(self, model, messages, options=None, **kwargs):
+        if options:
+            kwargs['options'] = options
+        return self._client.chat(model=model, messages=messages, **kwargs)
+
+    def stream(self, model, messages, options=None, **kwargs):
+        if options:
+            kwargs['options'] = options
+        yield from self._client.chat(model=model, messages=messages, stream=True, **kwargs)
+
+    async def achat(self, model, messages, options=None, **kwargs):
+        import ollama
+
+        if self._async_client is None:
+            self._async_client = ollama.AsyncClient(host=self.host)
+        if options:
+            kwargs['options'] = options
+        return await self._async_client.chat(model=model, messages=messages, **kwargs)
+
+    async def astream(self, model, messages, options=None, **kwargs):
+        import ollama
+
+        if self._async_client is None:
+            self._async_client = ollama.AsyncClient(host=self.host)
+        if options:
+            kwargs['options'] = options
+        async for chunk in await self._async_client.chat(model=model, messages=messages, stream=True, **kwargs):
+            yield chunk
+
+    def embed(self, model, text):
+        return self._client.embeddings(model=model, prompt=text)['embedding']
+
+    def health(self):
+        try:
+            models = self._client.list()
+        except Exception as e:
+            return {'ok': False, 'models': [], 'error': str(e)}
+        try:
+            # Newer clients name each entry 'model'; older ones returned plain dicts with 'name'
+            names = [model.get('model') or model.get('name') for model in models.get('models', [])]
+        except Exception as e:
+            return _degraded(e)
+        return {'ok': True, 'models': names, 'error': None}
+
+# Ollama option names that have a direct OpenAI-compatible equivalent
+_OPENAI_OPTIONS = {
+    'num_predict': 'max_tokens',
+    'temperature': 'temperature',
+    'top_p': 'top_p',
+    'stop': 'stop',
+    'seed': 'seed'
+}
+
+class OpenAICompatibleBackend(LLMBackend):
+    """Backend for any server exposing the OpenAI chat completions API (vLLM, llama.cpp server, ...)"""
+
+    name = 'openai'
+
+    def __init__(self, base_url=None, api_key=None, timeout=None):
+        self.base_url = (base_url or os.environ.get('LLM_BASE_URL', 'http://localhost:8080/v1')).rstrip('/')
+        self.api_key = api_key or os.environ.get('LLM_API_KEY')
+        self.timeout = timeout or float(os.environ.get('LLM_REQUEST_TIMEOUT', 120))
+        self._async_client = None
+
+    def _headers(self):
+        headers = {'Content-Type': 'application/json'}
+        if self.api_key:
+            headers['Authorization'] = f"Bearer {self.api_key}"
+        return headers
+
+    def _request(self, path, payload=None):
+        headers = self._headers()
+        data = json.dumps(payload).encode('utf-8') if payload is not None else None
+        request = urllib.request.Request(f"{self.base_url}{path}", data=data, headers=headers)
+        try:
+            return urllib.request.urlopen(request, timeout=self.timeout)
+        except urllib.error.HTTPError as e:
+            raise LLMBackendError(f"{self.name} backend returned HTTP {e.code} for {path}: {e.read()[:200]!r}") from e
+        except urllib.error.URLError as e:
+            raise LLMBackendError(f"{self.name} backend unreachable at {self.base_url}: {e.reason}") from e
+
+    def _payload(self, model, messages, options, stream):
+        payload = {'model': model, 'messages': messages, 'stream': stream}
+        for key, value in (options or {}).items():
+            if key == 'num_predict' and value < 0:
+                continue  # Unlimited output is the server default
+            if key in _OPENAI_OPTIONS:
+                payload[_OPENAI_OPTIONS[key]] = value
+        return payload
+
+    def chat(self, model, messages, options=None, **kwargs):
+        with self._request('/chat/completions', self._payload(model, messages, options, False)) as response:
+            body = json.loads(response.read().decode('utf-8'))
+        return _reply(body['choices'][0]['message'].get('content') or '')
+
+    def _get_async_client(self):
+        import httpx
+
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(base_url=self.base_url, headers=self._headers(), timeout=self.timeout)
+        return self._async_client
+
+    async def achat(self, model, messages, options=None, **kwargs):
+        import httpx
+
+        try:
+            response = await self._get_async_client().post('/chat/completions', json=self._payload(model, messages, options, False))
+            response.raise_for_status()
+        except httpx.HTTPStatusError as e:
+            raise LLMBackendError(f"{self.name} backend returned HTTP {e.response.status_code} for /chat/completions: {e.response.content[:200]!r}") from e
+        except httpx.TransportError as e:
+            raise LLMBackendError(f"{self.name} backend unreachable at {self.base_url}: {e}") from e
+        return _reply(response.json()['choices'][0]['message'].get('content') or '')
+
+    @staticmethod
+    def _stream_event(line):
+        """The content of one server-sent line: text, '' for lines without any, or None at [DONE]"""
+        line = line.strip()
+        if not line.startswith('data:'):
+            return ''
+        data = line[len('data:'):].strip()
+        if data == '[DONE]':
+            return None
+        return json.loads(data)['choices'][0].get('delta', {}).get('content') or ''
+
+    def stream(self, model, messages, options=None, **kwargs):
+        with self._request('/chat/completions', self._payload(model, messages, options, True)) as response:
+            for line in response:
+                content = self._stream_event(line.decode('utf-8'))
+                if content is None:
+                    break
+                if content:
+                    yield _reply(content)
+
+    async def astream(self, model, messages, options=None, **kwargs):
+        import httpx
+
+        try:
+            async with self._get_async_client().stream('POST', '/chat/completions', json=self._payload(model, messages, options, True)) as response:
+                if response.is_error:
+                    body = await response.aread()
+                    raise LLMBackendError(f"{self.name} backend returned HTTP {response.status_code} for /chat/completions: {body[:200]!r}")
+                async for line in response.aiter_lines():
+                    content = self._stream_event(line)
+                    if content is None:
+                        break
+                    if content:
+                        yield _reply(content)
+        except httpx.TransportError as e:
+            raise LLMBackendError(f"{self.name} backend unreachable at {self.base_url}: {e}") from e
+
+    def embed(self, model, text):
+        with self._request('/embeddings', {'model': model, 'input': text}) as response:
+            body = json.loads(response.read().decode('utf-8'))
+        return body['data'][0]['embedding']
+
+    def health(self):
+        try:
+            with self._request('/models') as response:
+                raw = response.read()
+        except Exception as e:
+            return {'ok': False, 'models': [], 'error': str(e)}
+        try:
+            names = [model['id'] for model in json.loads(raw.decode('utf-8')).get('data', [])]
+        except Exception as e:
+            return _degraded(e)
+        return {'ok': True, 'models': names, 'error': None}
+
+class FakeBackend(LLMBackend):
+    """In-process backend with canned replies, for tests and benchmarking the app without a model.
+
+    `responder` is called with (model, messages) and returns the reply text; by
+    default every call returns `reply`.
+    """
+
+    name = 'fake'
+
+    def __init__(self, reply="Thank you for sharing that with me.", responder=None, models=None):
+        self.reply = reply
+        self.responder = responder
+        self.models = models or ['llama3.2']
+        self.calls = []
+
+    def _respond(self, model, messages):
+        self.calls.append((model, messages))
+        return self.responder(model, messages) if self.responder else self.reply
+
+    def chat(self, model, messages, options=None, **kwargs):
+        return _reply(self._respond(model, messages))
+
+    async def achat(self, model, messages, options=None, **kwargs):
+        return _reply(self._respond(model, messages))
+
+    def stream(self, model, messages, options=None, **kwargs):
+        for word in self._respond(model, messages).split(' '):
+            yield _reply(word + ' ')
+
+    async def astream(self, model, messages, options=None, **kwargs):
+        for chunk in self.stream(model, messages, options=options, **kwargs):
+            yield chunk
+
+    def embed(self, model, text):
+        digest = hashlib.sha256(text.encode('utf-8')).digest()
+        return [byte / 255.0 for byte in digest]
+
+    def health(self):
+        return {'ok': True, 'models': list(self.models), 'error': None}
+
+# Default server URLs for the OpenAI-compatible aliases
+_OPENAI_DEFAULT_URLS = {
+    'openai': 'http://localhost:8080/v1',
+    'llamacpp': 'http://localhost:8080/v1',
+    'vllm': 'http://localhost:8000/v1'
+}
+
+def create_backend(name=None):
+    """Create the backend selected by `name` or the LLM_BACKEND environment variable.
+
+    Supported names: ollama (default), openai, llamacpp, vllm and fake.
+    """
+    name = (name or os.environ.get('LLM_BACKEND', 'ollama')).lower()
+
+    if name == 'ollama':
+        return OllamaBackend()
+    if name in _OPENAI_DEFAULT_URLS:
+        backend = OpenAICompatibleBackend(base_url=os.environ.get('LLM_BASE_URL', _OPENAI_DEFAULT_URLS[name]))
+        backend.name = name
+        return backend
+    if name == 'fake':
+        return FakeBackend()
+    raise ValueError(f"Unknown LLM backend '{name}' (expected ollama, openai, llamacpp, vllm or fake)")
@@ -0,0 +1,133 @@
+import os
+import threading
+import time
+
+CIRCUIT_CLOSED = 'closed'
+CIRCUIT_OPEN = 'open'
+CIRCUIT_HALF_OPEN = 'half_open'
+
+class LLMUnavailableError(Exception):
+    """Raised without calling the backend while the circuit is open"""
+
+class CircuitBreaker:
+    """Stops calls to a failing backend so callers fall back immediately.
+
+    After `failure_threshold` consecutive failures the circuit opens and every
+    call is refused. Once `reset_timeout` seconds have passed it half-opens and
+    lets a single trial call through: success closes the circuit, failure opens
+    it again for another `reset_timeout`.
+    """
+
+    def __init__(self, failure_threshold=3, reset_timeout=15.0):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+
+        self._lock = threading.Lock()
+        self._state = CIRCUIT_CLOSED
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            failure_threshold=int(os.environ.get('LLM_BREAKER_FAILURES', 3)),
+            reset_timeout=float(os.environ.get('LLM_BREAKER_RESET', 15))
+        )
+
+    def _cooled_down(self):
+        return time.monotonic() - self._opened_at >= self.reset_timeout
+
+    def allow(self):
+        """True if a call may go ahead; claims the trial call when half-open"""
+        with self._lock:
+            if self._state == CIRCUIT_CLOSED:
+                return True
+            if self._state == CIRCUIT_OPEN and self._cooled_down():
+                self._state = CIRCUIT_HALF_OPEN
+            if self._state == CIRCUIT_HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def is_open(self):
+        """True while calls are being refused (does not claim the trial call)"""
+        with self._lock:
+            if self._state == CIRCUIT_OPEN:
+                return not self._cooled_down()
+            return self._state == CIRCUIT_HALF_OPEN and self._trial_in_flight
+
+    def record_success(self):
+        with self._lock:
+            if self._state != CIRCUIT_CLOSED:
+                print("✅ LLM backend recovered - circuit closed")
+            self._state = CIRCUIT_CLOSED
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._state == CIRCUIT_HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state == CIRCUIT_CLOSED:
+                    print(f"⚠️  LLM backend failed {self._failures} times in a row - circuit opened")
+                self._state = CIRCUIT_OPEN
+                self._opened_at = time.monotonic()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == CIRCUIT_OPEN and self._cooled_down():
+                return CIRCUIT_HALF_OPEN
+            return self._state
+
+class HealthMonitor:
+    """Probes the backend in the background and feeds the results to the circuit breaker.
+
+    The latest probe result is cached so health checks never wait on the backend.
+    """
+
+    def __init__(self, probe, breaker, interval=10.0):
+        self.probe = probe
+        self.breaker = breaker
+        self.interval = interval
+
+        self._status = {'ok': None, 'models': [], 'error': None, 'checked_at': None}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def check(self):
+        """Run one probe now and record the result"""
+        try:
+            status = self.probe()
+        except Exception as e:
+            status = {'ok': False, 'models': [], 'error': str(e)}
+
+        if status['ok']:
+            self.breaker.record_success()
+        else:
+            self.breaker.record_failure()
+
+        with self._lock:
+            self._status = {**status, 'checked_at': time.time()}
+        return status
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.check()
+            self._stop.wait(self.interval)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='llm-health', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def status(self):
+        """Latest cached probe result plus the circuit state"""
+        with self._lock:
+            return {**self._status, 'circuit': self.breaker.state}
@@ -0,0 +1,109 @@
+import asyncio
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from utils import async_bridge
+
+# Budgeted calls run here so the caller can stop waiting without cancelling the call
+_budget_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='llm-budget')
+
+class LatencyTracker:
+    """Rolling per-task record of recent LLM latencies.
+
+    Samples older than `window_seconds` are dropped, so the percentiles follow
+    the backend's current behaviour and recover on their own once it speeds up.
+    """
+
+    def __init__(self, window_seconds=120, max_samples=200):
+        self.window_seconds = window_seconds
+        self.max_samples = max_samples
+        self._lock = threading.Lock()
+        self._samples = defaultdict(lambda: deque(maxlen=self.max_samples))  # task -> (recorded_at, seconds)
+
+    def record(self, task, seconds):
+        with self._lock:
+            self._samples[task].append((time.monotonic(), seconds))
+
+    def percentile(self, task, pct=95):
+        """Latency percentile for a task over the window, or None without recent samples"""
+        cutoff = time.monotonic() - self.window_seconds
+        with self._lock:
+            samples = self._samples[task]
+            while samples and samples[0][0] < cutoff:
+                samples.popleft()
+            values = sorted(seconds for _, seconds in samples)
+        if not values:
+            return None
+        index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+        return values[index]
+
+class LatencyBudget:
+    """Per-turn time budget for LLM calls, adapted to the rolling p95 latency.
+
+    The budget is p95 plus `headroom`, clamped to [min_budget, max_budget]; with
+    no recent samples it is `default_budget`. A task whose p95 exceeds
+    `max_budget` would miss its budget on most turns, so it counts as overloaded
+    and callers skip the LLM call altogether.
+    """
+
+    def __init__(self, tracker, default_budget=6.0, min_budget=2.0, max_budget=10.0, headroom=1.25):
+        self.tracker = tracker
+        self.default_budget = default_budget
+        self.min_budget = min_budget
+        self.max_budget = max_budget
+        self.headroom = headroom
+
+    @classmethod
+    def from_env(cls, tracker):
+        return cls(
+            tracker,
+            default_budget=float(os.environ.get('LLM_TURN_BUDGET', 6)),
+            min_budget=float(os.environ.get('LLM_TURN_BUDGET_MIN', 2)),
+            max_budget=float(os.environ.get('LLM_TURN_BUDGET_MAX', 10))
+        )
+
+    def budget(self, task):
+        p95 = self.tracker.percentile(task)
+        if p95 is None:
+            return self.default_budget
+        return min(self.max_budget, max(self.min_budget, p95 * self.headroom))
+
+    def is_overloaded(self, task):
+        p95 = self.tracker.percentile(task)
+        return p95 is not None and p95 > self.max_budget
+
+def call_with_budget(fn, budget, on_late=None):
+    """Run fn() for at most `budget` seconds.
+
+    Returns (True, result) if it finished in time. Otherwise returns (False, None)
+    straight away; the call keeps running and, if `on_late` is given, its result
+    is passed to on_late once available so the work is not wasted.
+    """
+    if async_bridge.in_event_loop():
+        return async_bridge.wait(_call_with_budget_async(fn, budget, on_late))
+
+    future = _budget_executor.submit(fn)
+    try:
+        return True, future.result(timeout=budget)
+    except FutureTimeoutError:
+        if on_late is not None:
+            def deliver(done):
+                if done.exception() is None:
+                    on_late(done.result())
+            future.add_done_callback(deliver)
+        return False, None
+
+async def _call_with_budget_async(fn, budget, on_late):
+    """call_with_budget() inside run_sync() on the async server: fn runs as a task on the event loop"""
+    task = async_bridge.spawn(fn)
+    done, _ = await asyncio.wait([task], timeout=budget)
+    if done:
+        return True, task.result()
+    if on_late is not None:
+        def deliver(done):
+            if not done.cancelled() and done.exception() is None:
+                on_late(done.result())
+        task.add_done_callback(deliver)
+    return False, None
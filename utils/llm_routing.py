@@ -0,0 +1,89 @@
+import json
+import os
+from dataclasses import dataclass, field
+
+# Tasks the app sends to the model
+TASK_REPHRASE = 'rephrase'        # One-sentence question rephrasing
+TASK_FRAMING = 'framing'          # Acknowledge the answer and ask the next question
+TASK_EXTRACTION = 'extraction'    # Structured JSON extraction from a reply
+TASK_FORMULATION = 'formulation'  # CBT formulation sections
+
+@dataclass
+class TaskRoute:
+    """Model and inference options used for one task"""
+
+    model: str = "llama3.2"
+    num_predict: int = None    # Maximum output tokens (None = model default)
+    num_ctx: int = None        # Context window in tokens
+    temperature: float = None
+    stop: list = field(default_factory=list)
+    keep_alive: str = None     # How long Ollama keeps the model loaded, e.g. "30m"
+
+    def options(self):
+        """Inference options in Ollama form; backends translate what they support"""
+        options = {}
+        if self.num_predict is not None:
+            options['num_predict'] = self.num_predict
+        if self.num_ctx is not None:
+            options['num_ctx'] = self.num_ctx
+        if self.temperature is not None:
+            options['temperature'] = self.temperature
+        if self.stop:
+            options['stop'] = list(self.stop)
+        return options
+
+# Defaults sized to what each task actually produces. All tasks use llama3.2 so a
+# fresh install works; point rephrasing at a smaller model with LLM_REPHRASE_MODEL.
+DEFAULT_ROUTES = {
+    TASK_REPHRASE: TaskRoute(num_predict=120, num_ctx=2048, temperature=0.8, keep_alive="30m"),
+    TASK_FRAMING: TaskRoute(num_predict=200, num_ctx=4096, temperature=0.7, keep_alive="30m"),
+    TASK_EXTRACTION: TaskRoute(num_predict=512, num_ctx=4096, temperature=0.1, keep_alive="30m"),
+    TASK_FORMULATION: TaskRoute(num_predict=320, num_ctx=8192, temperature=0.4, keep_alive="10m")
+}
+
+_FIELD_TYPES = {
+    'num_predict': int,
+    'num_ctx': int,
+    'temperature': float,
+    'keep_alive': str,
+    'model': str
+}
+
+def load_routes(path=None):
+    """Build the routing table from the defaults plus any configured overrides.
+
+    Overrides come from a JSON file (LLM_ROUTES_PATH) mapping task names to route
+    fields, then from per-field environment variables such as LLM_REPHRASE_MODEL,
+    LLM_FRAMING_NUM_PREDICT or LLM_FORMULATION_KEEP_ALIVE.
+    """
+    routes = {task: TaskRoute(**vars(route)) for task, route in DEFAULT_ROUTES.items()}
+
+    path = path or os.environ.get('LLM_ROUTES_PATH')
+    if path:
+        with open(path) as file:
+            overrides = json.load(file)
+        for task, values in overrides.items():
+            if task not in routes:
+                raise ValueError(f"Unknown LLM task '{task}' in {path}")
+            for key, value in values.items():
+                if not hasattr(routes[task], key):
+                    raise ValueError(f"Unknown route setting '{key}' for task '{task}' in {path}")
+                setattr(routes[task], key, value)
+
+    for task, route in routes.items():
+        for key, cast in _FIELD_TYPES.items():
+            value = os.environ.get(f"LLM_{task.upper()}_{key.upper()}")
+            if value is not None:
+                setattr(route, key, cast(value))
+        # Stop sequences are '|'-separated and may use escapes such as \n
+        stop = os.environ.get(f"LLM_{task.upper()}_STOP")
+        if stop is not None:
+            route.stop = [sequence.encode('utf-8').decode('unicode_escape') for sequence in stop.split('|') if sequence]
+
+    return routes
+
+ROUTES = load_routes()
+
+def get_route(task):
+    """Return the route for a task; raises KeyError for unknown tasks"""
+    return ROUTES[task]
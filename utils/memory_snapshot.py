@@ -0,0 +1,104 @@
+import threading
+from collections import namedtuple
+from datetime import datetime
+from sqlalchemy import select, union_all, literal, null, cast, Text
+
+# Lightweight stand-ins for the ORM rows personalization reads; attribute names
+# match the model columns so callers can use either.
+SituationMemory = namedtuple('SituationMemory', 'description')
+ThoughtMemory = namedtuple('ThoughtMemory', 'thought')
+EmotionMemory = namedtuple('EmotionMemory', 'emotion')
+BehaviorMemory = namedtuple('BehaviorMemory', 'action')
+BackgroundMemory = namedtuple('BackgroundMemory', 'chief_complaint stress_response_patterns')
+
+# How many of the most recent rows personalization looks at, per table
+SNAPSHOT_LIMITS = {
+    'situations': 5,
+    'automatic_thoughts': 7,
+    'emotions': 7,
+    'behaviors': 7
+}
+
+_MEMORY_TYPES = {
+    'situations': SituationMemory,
+    'automatic_thoughts': ThoughtMemory,
+    'emotions': EmotionMemory,
+    'behaviors': BehaviorMemory
+}
+
+class MemorySnapshot:
+    """The recent memory a chat personalizes its questions from, held in memory.
+
+    Loaded once per chat with a single UNION ALL query and kept current by
+    record() as the chat writes new rows, so later phases need no queries. Rows
+    written by other chats after loading are not picked up.
+    """
+
+    def __init__(self, user_ids, rows, background):
+        self.user_ids = list(user_ids)
+        self._rows = rows              # table name -> memories, newest first
+        self._background = background
+        self._lock = threading.Lock()  # Prefetch workers read while the request thread records
+
+    @classmethod
+    def load(cls, session, user_ids):
+        """Load the most recent rows of every memory table in one round trip"""
+        from utils.cbt_database import Situation, AutomaticThought, Emotion, Behavior, BackgroundInfo
+
+        # Include rows a unit of work has written but not flushed yet
+        session.flush()
+
+        def recent(kind, model, text_column, extra_column, timestamp_column, limit):
+            return select(
+                # Typed explicitly: PostgreSQL cannot infer a bare parameter's type in a UNION
+                cast(literal(kind), Text).label('kind'),
+                cast(text_column, Text).label('text'),
+                cast(extra_column, Text).label('extra'),
+                timestamp_column.label('ts')
+            ).where(model.user_id.in_(user_ids))\
+             .order_by(timestamp_column.desc())\
+             .limit(limit)\
+             .subquery()
+
+        parts = [
+            recent('situations', Situation, Situation.description, null(), Situation.timestamp, SNAPSHOT_LIMITS['situations']),
+            recent('automatic_thoughts', AutomaticThought, AutomaticThought.thought, null(), AutomaticThought.timestamp, SNAPSHOT_LIMITS['automatic_thoughts']),
+            recent('emotions', Emotion, Emotion.emotion, null(), Emotion.timestamp, SNAPSHOT_LIMITS['emotions']),
+            recent('behaviors', Behavior, Behavior.action, null(), Behavior.timestamp, SNAPSHOT_LIMITS['behaviors']),
+            recent('background_info', BackgroundInfo, BackgroundInfo.chief_complaint, BackgroundInfo.stress_response_patterns, BackgroundInfo.updated_at, 1)
+        ]
+        result = session.execute(union_all(*[select(part) for part in parts])).all()
+
+        # UNION ALL does not guarantee the subqueries' order survives, so sort here
+        result.sort(key=lambda row: row.ts or datetime.min, reverse=True)
+
+        rows = {kind: [] for kind in SNAPSHOT_LIMITS}
+        background = None
+        for row in result:
+            if row.kind == 'background_info':
+                background = BackgroundMemory(row.text, row.extra)
+            else:
+                rows[row.kind].append(_MEMORY_TYPES[row.kind](row.text))
+        return cls(user_ids, rows, background)
+
+    def recent(self, kind):
+        """Most recent memories from a table, newest first"""
+        with self._lock:
+            return list(self._rows[kind])
+
+    @property
+    def background(self):
+        with self._lock:
+            return self._background
+
+    def record(self, kind, text):
+        """Add a row this chat has just written to the front of its table"""
+        with self._lock:
+            rows = self._rows[kind]
+            rows.insert(0, _MEMORY_TYPES[kind](text))
+            del rows[SNAPSHOT_LIMITS[kind]:]
+
+    def record_background(self, chief_complaint, stress_response_patterns):
+        """The chat's own background row is now the most recently updated one"""
+        with self._lock:
+            self._background = BackgroundMemory(chief_complaint, stress_response_patterns)
@@ -0,0 +1,64 @@
+"""
+Schema migrations for existing CBT databases.
+
+`Base.metadata.create_all` creates missing tables but never changes tables that
+already exist, so databases created by older versions are upgraded here. Each
+migration runs once; the applied version is recorded in the schema_version table.
+A migration must never change once released: schema changes go in a new one.
+
+Run directly to upgrade a database without starting the app:
+    python -m utils.migrations
+"""
+
+from sqlalchemy import inspect, text
+
+# Indexes added by migration 1, as (name, table, columns). Fixed here rather than read
+# from the models, so the migration does the same thing whenever it runs; indexes
+# added to the models later need a migration of their own.
+USER_TIMESTAMP_INDEXES = [
+    ('ix_background_info_user_updated', 'background_info', ('user_id', 'updated_at')),
+    ('ix_situations_user_timestamp', 'situations', ('user_id', 'timestamp')),
+    ('ix_automatic_thoughts_user_timestamp', 'automatic_thoughts', ('user_id', 'timestamp')),
+    ('ix_emotions_user_timestamp', 'emotions', ('user_id', 'timestamp')),
+    ('ix_behaviors_user_timestamp', 'behaviors', ('user_id', 'timestamp')),
+    ('ix_cbt_beliefs_user', 'cbt_beliefs', ('user_id',)),
+    ('ix_conversations_user_timestamp', 'conversations', ('user_id', 'timestamp'))
+]
+
+def _add_user_timestamp_indexes(connection):
+    """Composite (user_id, timestamp) indexes for the memory lookups"""
+    existing_tables = set(inspect(connection).get_table_names())
+    for name, table, columns in USER_TIMESTAMP_INDEXES:
+        if table not in existing_tables:
+            continue
+        connection.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)})"))
+
+# (version, description, function) in the order they must be applied
+MIGRATIONS = [
+    (1, "Add composite user/timestamp indexes", _add_user_timestamp_indexes)
+]
+
+def get_schema_version(connection):
+    connection.execute(text("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)"))
+    version = connection.execute(text("SELECT MAX(version) FROM schema_version")).scalar()
+    return version or 0
+
+def run_migrations(engine):
+    """Apply any pending migrations; returns the list of versions applied"""
+    applied = []
+    with engine.begin() as connection:
+        current = get_schema_version(connection)
+        for version, description, migrate in MIGRATIONS:
+            if version <= current:
+                continue
+            print(f"🔧 Applying database migration {version}: {description}")
+            migrate(connection)
+            connection.execute(text("INSERT INTO schema_version (version) VALUES (:version)"), {'version': version})
+            applied.append(version)
+    return applied
+
+if __name__ == "__main__":
+    from utils.cbt_database import get_engine
+    engine = get_engine()
+    with engine.connect() as connection:
+        print(f"✅ Database schema is at version {get_schema_version(connection)}")
@@ -1,8 +1,15 @@
 import os
+from functools import lru_cache
 
+# Therapy styles and context types that have prompt templates under prompts/
+PROMPT_STYLES = ['cbt']
+PROMPT_CONTEXT_TYPES = ['with_context', 'without_context']
+
+@lru_cache(maxsize=None)
 def load_prompt_template(style: str, context_type: str) -> str:
     """
     Load a prompt template based on therapy style and context type.
+    Templates are read from disk once per process and then served from memory.
     
     Args:
         style: The therapy style ('cbt' for CBT-informed approach)
@@ -14,14 +21,11 @@ def load_prompt_template(style: str, context_type: str) -> str:
     Raises:
         ValueError: If the style or context_type is invalid or file not found
     """
-    valid_styles = ['cbt']
-    valid_context_types = ['with_context', 'without_context']
-    
-    if style not in valid_styles:
-        raise ValueError(f"Invalid style. Must be one of: {', '.join(valid_styles)}")
+    if style not in PROMPT_STYLES:
+        raise ValueError(f"Invalid style. Must be one of: {', '.join(PROMPT_STYLES)}")
     
-    if context_type not in valid_context_types:
-        raise ValueError(f"Invalid context type. Must be one of: {', '.join(valid_context_types)}")
+    if context_type not in PROMPT_CONTEXT_TYPES:
+        raise ValueError(f"Invalid context type. Must be one of: {', '.join(PROMPT_CONTEXT_TYPES)}")
     
     prompt_path = os.path.join('prompts', style, f'{context_type}.txt')
     
@@ -29,4 +33,10 @@ def load_prompt_template(style: str, context_type: str) -> str:
         with open(prompt_path, 'r', encoding='utf-8') as file:
             return file.read().strip()
     except FileNotFoundError:
-        raise ValueError(f"Prompt file not found: {prompt_path}")
\ No newline at end of file
+        raise ValueError(f"Prompt file not found: {prompt_path}")
+
+def preload_prompt_templates():
+    """Read every prompt template into memory, e.g. before a server forks its workers"""
+    for style in PROMPT_STYLES:
+        for context_type in PROMPT_CONTEXT_TYPES:
+            load_prompt_template(style, context_type)
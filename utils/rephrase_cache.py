@@ -0,0 +1,174 @@
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+class RephraseCache:
+    """Persistent pools of validated question rephrasings.
+
+    Keys are (base question, phase, model, prompt version). Each key holds a pool
+    of up to `pool_size` validated variants; a random one is served on lookup and
+    the pool is topped up in the background. Keys are evicted least-recently-used
+    once `max_keys` is exceeded, and individual variants expire after `ttl_seconds`.
+    """
+
+    def __init__(self, db_path=None, pool_size=None, ttl_seconds=None, max_keys=500, refill_workers=1):
+        self.db_path = db_path or os.environ.get('REPHRASE_CACHE_PATH', 'rephrase_cache.db')
+        self.pool_size = pool_size or int(os.environ.get('REPHRASE_POOL_SIZE', 5))
+        if ttl_seconds is None:
+            ttl_seconds = float(os.environ.get('REPHRASE_CACHE_TTL_HOURS', 24 * 7)) * 3600
+        self.ttl_seconds = ttl_seconds
+        self.max_keys = max_keys
+
+        self._lock = threading.Lock()
+        self._pools = OrderedDict()  # key -> list of (variant, created_at), least recently used first
+        self._refilling = set()
+        self._executor = ThreadPoolExecutor(max_workers=refill_workers, thread_name_prefix='rephrase-refill')
+
+        self.reopen()
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS rephrase_variants (
+                base_question TEXT NOT NULL,
+                phase TEXT NOT NULL,
+                model TEXT NOT NULL,
+                prompt_version TEXT NOT NULL,
+                variant TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (base_question, phase, model, prompt_version, variant)
+            )
+        """)
+        self._conn.commit()
+        self._load()
+
+    def reopen(self):
+        """Open a fresh connection; a process forked after the cache was created must
+        not keep using its parent's SQLite connection"""
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+
+    @staticmethod
+    def make_key(base_question, phase, model, prompt_version):
+        return (base_question, phase, model, str(prompt_version))
+
+    def _load(self):
+        """Load unexpired variants from disk, oldest-used keys first"""
+        cutoff = time.time() - self.ttl_seconds
+        with self._lock:
+            self._conn.execute("DELETE FROM rephrase_variants WHERE created_at < ?", (cutoff,))
+            self._conn.commit()
+            rows = self._conn.execute("""
+                SELECT base_question, phase, model, prompt_version, variant, created_at
+                FROM rephrase_variants
+                ORDER BY last_used
+            """).fetchall()
+            for base_question, phase, model, prompt_version, variant, created_at in rows:
+                key = (base_question, phase, model, prompt_version)
+                self._pools.setdefault(key, []).append((variant, created_at))
+                self._pools.move_to_end(key)
+            self._evict_locked()
+
+    def _expire_locked(self, key):
+        """Drop expired variants for a key and return what is left"""
+        cutoff = time.time() - self.ttl_seconds
+        pool = self._pools.get(key, [])
+        fresh = [entry for entry in pool if entry[1] >= cutoff]
+        if len(fresh) != len(pool):
+            self._conn.execute(
+                "DELETE FROM rephrase_variants WHERE base_question = ? AND phase = ? AND model = ? AND prompt_version = ? AND created_at < ?",
+                key + (cutoff,)
+            )
+            self._conn.commit()
+            if fresh:
+                self._pools[key] = fresh
+            else:
+                self._pools.pop(key, None)
+        return fresh
+
+    def _evict_locked(self):
+        """Evict least recently used keys beyond max_keys"""
+        while len(self._pools) > self.max_keys:
+            key, _ = self._pools.popitem(last=False)
+            self._conn.execute(
+                "DELETE FROM rephrase_variants WHERE base_question = ? AND phase = ? AND model = ? AND prompt_version = ?",
+                key
+            )
+        self._conn.commit()
+
+    def get(self, key):
+        """Return a random cached variant for key, or None on a miss"""
+        with self._lock:
+            pool = self._expire_locked(key)
+            if not pool:
+                return None
+            self._pools.move_to_end(key)
+            variant = random.choice(pool)[0]
+            self._conn.execute(
+                "UPDATE rephrase_variants SET last_used = ? WHERE base_question = ? AND phase = ? AND model = ? AND prompt_version = ?",
+                (time.time(),) + key
+            )
+            self._conn.commit()
+            return variant
+
+    def add(self, key, variant):
+        """Add a validated variant to the pool for key"""
+        now = time.time()
+        with self._lock:
+            pool = self._pools.setdefault(key, [])
+            self._pools.move_to_end(key)
+            if any(existing == variant for existing, _ in pool):
+                return
+            if len(pool) >= self.pool_size:
+                # Replace the oldest variant to keep the pool fresh
+                oldest = min(pool, key=lambda entry: entry[1])
+                pool.remove(oldest)
+                self._conn.execute(
+                    "DELETE FROM rephrase_variants WHERE base_question = ? AND phase = ? AND model = ? AND prompt_version = ? AND variant = ?",
+                    key + (oldest[0],)
+                )
+            pool.append((variant, now))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO rephrase_variants VALUES (?, ?, ?, ?, ?, ?, ?)",
+                key + (variant, now, now)
+            )
+            self._evict_locked()
+
+    def pool_count(self, key):
+        with self._lock:
+            return len(self._expire_locked(key))
+
+    def refill(self, key, generate):
+        """Top up the pool for key in the background.
+
+        `generate` is called on a worker thread and should return a validated
+        variant, or None if the model call failed or produced an invalid result.
+        """
+        with self._lock:
+            missing = self.pool_size - len(self._expire_locked(key))
+            if missing <= 0 or key in self._refilling:
+                return
+            self._refilling.add(key)
+
+        def run():
+            try:
+                # Allow a few extra attempts for rejected or duplicate variants
+                for _ in range(missing * 2):
+                    if self.pool_count(key) >= self.pool_size:
+                        break
+                    variant = generate()
+                    if variant:
+                        self.add(key, variant)
+            except Exception as e:
+                print(f"Rephrase cache refill failed: {e}")
+            finally:
+                with self._lock:
+                    self._refilling.discard(key)
+
+        self._executor.submit(run)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        with self._lock:
+            self._conn.close()
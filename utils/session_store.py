@@ -0,0 +1,314 @@
+import os
+import pickle
+import sqlite3
+import sys
+import threading
+import time
+import types
+from collections import OrderedDict, deque
+
+def estimate_size(value, exclude=()):
+    """Approximate bytes held by `value` and everything it references.
+
+    Follows containers and instance attributes; objects in `exclude` (shared
+    caches, queues) and modules, classes and functions are not counted.
+    """
+    seen = {id(obj) for obj in exclude}
+    total = 0
+    stack = [value]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, (types.ModuleType, type, types.FunctionType, types.MethodType)):
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+            stack.extend(obj)
+        elif hasattr(obj, '__dict__'):
+            stack.append(obj.__dict__)
+    return total
+
+class SessionStore:
+    """Interface shared by the chat session stores.
+
+    `live` stores hand back the same objects that were put; other stores hand
+    back a fresh copy on every get(), so anything not serialized is lost
+    between requests.
+
+    Entries idle for longer than `ttl_seconds` expire: get() treats them as
+    missing and reap(), run every `interval` seconds by start_reaper(), removes
+    them. Entries beyond `max_sessions` are evicted least-recently-used first.
+    `on_close(session_id, data)` is called for every entry that leaves the
+    store - deleted, expired or evicted - so its resources can be released.
+    """
+
+    name = 'base'
+    live = True
+
+    def __init__(self, ttl_seconds, max_sessions, on_close=None):
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self.on_close = on_close
+
+        self._expired = 0
+        self._evicted = 0
+        self._reaper_stop = threading.Event()
+        self._reaper = None
+
+    def get(self, session_id):
+        """The session's data, or None if it is unknown or has expired"""
+        raise NotImplementedError
+
+    def put(self, session_id, data):
+        """Store the session's data and mark it as just used"""
+        raise NotImplementedError
+
+    def delete(self, session_id):
+        """Remove the session, closing its resources"""
+        raise NotImplementedError
+
+    def reap(self):
+        """Remove every expired session; returns how many were removed"""
+        raise NotImplementedError
+
+    def stats(self):
+        """{'backend', 'live_sessions', 'bytes', 'expired', 'evicted', 'max_sessions', 'ttl_seconds'}"""
+        raise NotImplementedError
+
+    def reopen(self):
+        """Reconnect to the backing storage in a process forked after the store was created"""
+
+    def __contains__(self, session_id):
+        return self.get(session_id) is not None
+
+    def _close(self, closed):
+        """Run on_close for removed (session_id, data) pairs, outside any lock.
+
+        `closed` may be a generator, so stored entries are only decoded when needed.
+        """
+        if not self.on_close:
+            return
+        for session_id, data in closed:
+            try:
+                self.on_close(session_id, data)
+            except Exception as e:
+                print(f"⚠️  Closing session {session_id} failed: {e}")
+
+    def _run_reaper(self, interval):
+        while not self._reaper_stop.wait(interval):
+            try:
+                self.reap()
+            except Exception as e:
+                print(f"⚠️  Session reaper failed: {e}")
+
+    def start_reaper(self, interval=60.0):
+        if self._reaper is None:
+            self._reaper = threading.Thread(target=self._run_reaper, args=(interval,), name='session-reaper', daemon=True)
+            self._reaper.start()
+
+    def stop_reaper(self):
+        self._reaper_stop.set()
+
+class InMemorySessionStore(SessionStore):
+    """Sessions held as live objects in this process, LRU-bounded with a TTL.
+
+    `sizeof(data)` reports the bytes an entry holds for stats(); it defaults
+    to estimate_size.
+    """
+
+    name = 'memory'
+
+    def __init__(self, ttl_seconds=7200, max_sessions=1000, on_close=None, sizeof=None):
+        super().__init__(ttl_seconds, max_sessions, on_close)
+        self.sizeof = sizeof or estimate_size
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # session_id -> (data, last_used), least recently used first
+
+    @classmethod
+    def from_env(cls, **kwargs):
+        return cls(
+            ttl_seconds=float(os.environ.get('CBT_SESSION_TTL', 7200)),
+            max_sessions=int(os.environ.get('CBT_SESSION_MAX', 1000)),
+            **kwargs
+        )
+
+    def get(self, session_id):
+        closed = []
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                return None
+            data, last_used = entry
+            now = time.time()
+            if now - last_used > self.ttl_seconds:
+                del self._entries[session_id]
+                self._expired += 1
+                closed.append((session_id, data))
+                data = None
+            else:
+                self._entries[session_id] = (data, now)
+                self._entries.move_to_end(session_id)
+        self._close(closed)
+        return data
+
+    def put(self, session_id, data):
+        closed = []
+        with self._lock:
+            previous = self._entries.get(session_id)
+            if previous is not None and previous[0] is not data:
+                closed.append((session_id, previous[0]))
+            self._entries[session_id] = (data, time.time())
+            self._entries.move_to_end(session_id)
+            while len(self._entries) > self.max_sessions:
+                evicted_id, (evicted, _) = self._entries.popitem(last=False)
+                closed.append((evicted_id, evicted))
+                self._evicted += 1
+        self._close(closed)
+
+    def delete(self, session_id):
+        with self._lock:
+            entry = self._entries.pop(session_id, None)
+        if entry is not None:
+            self._close([(session_id, entry[0])])
+
+    def reap(self):
+        cutoff = time.time() - self.ttl_seconds
+        closed = []
+        with self._lock:
+            # Least recently used first, so stop at the first entry still in use
+            while self._entries:
+                session_id, (data, last_used) = next(iter(self._entries.items()))
+                if last_used >= cutoff:
+                    break
+                del self._entries[session_id]
+                closed.append((session_id, data))
+            self._expired += len(closed)
+        self._close(closed)
+        return len(closed)
+
+    def stats(self):
+        with self._lock:
+            entries = [data for data, _ in self._entries.values()]
+            expired, evicted = self._expired, self._evicted
+        return {
+            'backend': self.name,
+            'live_sessions': len(entries),
+            'bytes': sum(self.sizeof(data) for data in entries),
+            'expired': expired,
+            'evicted': evicted,
+            'max_sessions': self.max_sessions,
+            'ttl_seconds': self.ttl_seconds
+        }
+
+class SQLiteSessionStore(SessionStore):
+    """Sessions serialized into a SQLite file that several worker processes can share.
+
+    Entries are stored as `dumps(data)` and read back with `loads`, so session
+    data must round-trip through them (pickle by default); live objects such as
+    threads, locks and database sessions cannot be stored. on_close receives
+    the decoded data.
+    """
+
+    name = 'sqlite'
+    live = False
+
+    def __init__(self, db_path=None, ttl_seconds=7200, max_sessions=1000, on_close=None, dumps=None, loads=None):
+        super().__init__(ttl_seconds, max_sessions, on_close)
+        self.db_path = db_path or os.environ.get('CBT_SESSION_STORE_PATH', 'chat_sessions.db')
+        self.dumps = dumps or pickle.dumps
+        self.loads = loads or pickle.loads
+
+        self._lock = threading.Lock()
+        self.reopen()
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS chat_sessions (
+                session_id TEXT PRIMARY KEY,
+                data BLOB NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_chat_sessions_last_used ON chat_sessions (last_used)")
+        self._conn.commit()
+
+    @classmethod
+    def from_env(cls, **kwargs):
+        return cls(
+            ttl_seconds=float(os.environ.get('CBT_SESSION_TTL', 7200)),
+            max_sessions=int(os.environ.get('CBT_SESSION_MAX', 1000)),
+            **kwargs
+        )
+
+    def reopen(self):
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=5)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+
+    def get(self, session_id):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT data, last_used FROM chat_sessions WHERE session_id = ?", (session_id,)).fetchone()
+            if row is None:
+                return None
+            blob, last_used = row
+            if now - last_used > self.ttl_seconds:
+                self._conn.execute("DELETE FROM chat_sessions WHERE session_id = ?", (session_id,))
+                self._conn.commit()
+                self._expired += 1
+            else:
+                self._conn.execute("UPDATE chat_sessions SET last_used = ? WHERE session_id = ?", (now, session_id))
+                self._conn.commit()
+                return self.loads(blob)
+        if self.on_close:
+            self._close([(session_id, self.loads(blob))])
+        return None
+
+    def put(self, session_id, data):
+        blob = self.dumps(data)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO chat_sessions (session_id, data, last_used) VALUES (?, ?, ?)",
+                (session_id, blob, time.time())
+            )
+            evicted = self._conn.execute("""
+                SELECT session_id, data FROM chat_sessions
+                ORDER BY last_used DESC
+                LIMIT -1 OFFSET ?
+            """, (self.max_sessions,)).fetchall()
+            self._conn.executemany("DELETE FROM chat_sessions WHERE session_id = ?", [(row[0],) for row in evicted])
+            self._conn.commit()
+            self._evicted += len(evicted)
+        self._close((evicted_id, self.loads(blob)) for evicted_id, blob in evicted)
+
+    def delete(self, session_id):
+        with self._lock:
+            rows = self._conn.execute("SELECT data FROM chat_sessions WHERE session_id = ?", (session_id,)).fetchall()
+            self._conn.execute("DELETE FROM chat_sessions WHERE session_id = ?", (session_id,))
+            self._conn.commit()
+        self._close((session_id, self.loads(blob)) for blob, in rows)
+
+    def reap(self):
+        cutoff = time.time() - self.ttl_seconds
+        with self._lock:
+            expired = self._conn.execute("SELECT session_id, data FROM chat_sessions WHERE last_used < ?", (cutoff,)).fetchall()
+            self._conn.executemany("DELETE FROM chat_sessions WHERE session_id = ?", [(row[0],) for row in expired])
+            self._conn.commit()
+            self._expired += len(expired)
+        self._close((session_id, self.loads(blob)) for session_id, blob in expired)
+        return len(expired)
+
+    def stats(self):
+        with self._lock:
+            live, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(data)), 0) FROM chat_sessions").fetchone()
+            expired, evicted = self._expired, self._evicted
+        return {
+            'backend': self.name,
+            'live_sessions': live,
+            'bytes': size,
+            'expired': expired,
+            'evicted': evicted,
+            'max_sessions': self.max_sessions,
+            'ttl_seconds': self.ttl_seconds
+        }
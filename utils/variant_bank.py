@@ -0,0 +1,175 @@
+import json
+import mmap
+import os
+import random
+import struct
+import threading
+from datetime import datetime
+
+# On-disk layout (little endian):
+#   4 bytes   magic b'EAVB'
+#   2 bytes   format version
+#   4 bytes   length of the JSON index in bytes
+#   N bytes   JSON index: {"model", "prompt_version", "created_at",
+#                          "entries": [{"phase", "base_question", "variants": [[offset, length], ...]}]}
+#   ...       UTF-8 variant strings, addressed by offset from the start of this region
+BANK_MAGIC = b'EAVB'
+BANK_FORMAT_VERSION = 1
+_HEADER = struct.Struct('<4sHI')
+
+class VariantBank:
+    """Read-only bank of pre-generated question variants backed by a memory-mapped file"""
+
+    def __init__(self, path, mapped, index, data_offset):
+        self.path = path
+        self._mapped = mapped
+        self._data_offset = data_offset
+        self.model = index.get('model')
+        self.prompt_version = str(index.get('prompt_version'))
+        self.created_at = index.get('created_at')
+        self._entries = {
+            (entry['base_question'], entry['phase']): entry['variants']
+            for entry in index.get('entries', [])
+        }
+
+    @classmethod
+    def load(cls, path):
+        """Memory-map a bank file and parse its index; variant text is decoded on demand"""
+        with open(path, 'rb') as file:
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, index_length = _HEADER.unpack_from(mapped, 0)
+        if magic != BANK_MAGIC:
+            mapped.close()
+            raise ValueError(f"Not a variant bank file: {path}")
+        if version != BANK_FORMAT_VERSION:
+            mapped.close()
+            raise ValueError(f"Unsupported variant bank format version {version} in {path}")
+
+        index_start = _HEADER.size
+        index = json.loads(mapped[index_start:index_start + index_length].decode('utf-8'))
+        return cls(path, mapped, index, index_start + index_length)
+
+    def _read(self, offset, length):
+        start = self._data_offset + offset
+        return self._mapped[start:start + length].decode('utf-8')
+
+    def variants(self, base_question, phase):
+        return [self._read(offset, length) for offset, length in self._entries.get((base_question, phase), [])]
+
+    def get(self, base_question, phase):
+        """Return a random variant for the question, or None if the bank has none"""
+        spans = self._entries.get((base_question, phase))
+        if not spans:
+            return None
+        return self._read(*random.choice(spans))
+
+    def __len__(self):
+        return sum(len(spans) for spans in self._entries.values())
+
+    def close(self):
+        self._mapped.close()
+
+def write_variant_bank(path, variants_by_question, model, prompt_version):
+    """Write a bank file atomically.
+
+    `variants_by_question` maps (base_question, phase) to a list of variant strings.
+    """
+    data = bytearray()
+    entries = []
+    for (base_question, phase), variants in variants_by_question.items():
+        spans = []
+        for variant in variants:
+            encoded = variant.encode('utf-8')
+            spans.append([len(data), len(encoded)])
+            data.extend(encoded)
+        entries.append({'phase': phase, 'base_question': base_question, 'variants': spans})
+
+    index = json.dumps({
+        'model': model,
+        'prompt_version': str(prompt_version),
+        'created_at': datetime.utcnow().isoformat(),
+        'entries': entries
+    }, separators=(',', ':')).encode('utf-8')
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as file:
+        file.write(_HEADER.pack(BANK_MAGIC, BANK_FORMAT_VERSION, len(index)))
+        file.write(index)
+        file.write(data)
+    os.replace(tmp_path, path)
+
+def bank_questions(conversation_manager):
+    """List the (base_question, phase) pairs the app asks the model to rephrase"""
+    from utils.conversation_manager import INTRO_GREETING
+
+    questions = [(INTRO_GREETING, 'introduction')]
+    for phase in conversation_manager.base_questions:
+        questions.append((conversation_manager.get_base_question(phase), phase))
+    return questions
+
+def build_variant_bank(conversation_manager, path, per_question=10, max_attempts_factor=3):
+    """Generate validated rephrasings for every base question and write them to a bank.
+
+    Variants go through the same length and bold-marker validation as live
+    rephrasing. Returns the number of variants written per question.
+    """
+    from utils.conversation_manager import REPHRASE_MODEL, REPHRASE_PROMPT_VERSION
+
+    variants_by_question = {}
+    counts = {}
+    for base_question, phase in bank_questions(conversation_manager):
+        variants = []
+        attempts = 0
+        while len(variants) < per_question and attempts < per_question * max_attempts_factor:
+            attempts += 1
+            variant = conversation_manager._generate_rephrase(base_question, phase)
+            if variant and variant not in variants:
+                variants.append(variant)
+        variants_by_question[(base_question, phase)] = variants
+        counts[(base_question, phase)] = len(variants)
+        print(f"   {phase}: {len(variants)}/{per_question} variants ({attempts} attempts)")
+
+    write_variant_bank(path, variants_by_question, REPHRASE_MODEL, REPHRASE_PROMPT_VERSION)
+    return counts
+
+_bank = None
+_bank_loaded = False
+_bank_lock = threading.Lock()
+
+def get_variant_bank(path=None):
+    """Load the process-wide variant bank once; returns None if no usable bank exists.
+
+    A bank built for another rephrase prompt version or model is ignored.
+    """
+    global _bank, _bank_loaded
+    from utils.conversation_manager import REPHRASE_MODEL, REPHRASE_PROMPT_VERSION
+
+    with _bank_lock:
+        if _bank_loaded:
+            return _bank
+        _bank_loaded = True
+
+        path = path or os.environ.get('VARIANT_BANK_PATH', 'variant_bank.bin')
+        if not os.path.exists(path):
+            return None
+
+        try:
+            bank = VariantBank.load(path)
+        except (OSError, ValueError) as e:
+            print(f"⚠️  Could not load variant bank {path}: {e}")
+            return None
+
+        if bank.prompt_version != str(REPHRASE_PROMPT_VERSION):
+            print(f"⚠️  Ignoring variant bank {path}: built for prompt version {bank.prompt_version}, current is {REPHRASE_PROMPT_VERSION}")
+            bank.close()
+            return None
+
+        if bank.model != REPHRASE_MODEL:
+            print(f"⚠️  Ignoring variant bank {path}: built with model {bank.model}, rephrasing now uses {REPHRASE_MODEL}")
+            bank.close()
+            return None
+
+        print(f"✅ Loaded variant bank with {len(bank)} variants from {path}")
+        _bank = bank
+        return _bank
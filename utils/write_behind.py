@@ -0,0 +1,252 @@
+import atexit
+import os
+import threading
+import time
+from collections import deque
+from sqlalchemy import inspect, insert, update
+from sqlalchemy.orm import MANYTOONE
+from utils.cbt_database import Base, unit_of_work
+
+class PendingWrite:
+    """A turn's queued writes; wait() returns once the writer has committed them"""
+
+    def __init__(self, inserts, updates, deferred):
+        self.inserts = inserts
+        self.updates = updates
+        self.deferred = deferred
+        self.ids = {}      # inserted object -> primary key, filled in by the writer
+        self.error = None
+        self._done = threading.Event()
+
+    def apply(self, session):
+        ids = {}
+        for obj, table, values, links in self.inserts:
+            values = {**values, **{column: ids[target] for column, target in links.items()}}
+            ids[obj] = session.execute(insert(table).values(values).returning(*table.primary_key.columns)).scalar_one()
+        for table, identity, changes in self.updates:
+            key = [column == value for column, value in zip(table.primary_key.columns, identity)]
+            session.execute(update(table).where(*key).values(changes))
+        for write in self.deferred:
+            write(session)
+        return ids
+
+    def finish(self, ids=None, error=None):
+        self.ids = ids or {}
+        self.error = error
+        self._done.set()
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+def capture_changes(session):
+    """Take the session's pending inserts and updates out of it as plain row data.
+
+    New objects are expunged and changed ones expired, leaving the session with
+    nothing to flush. Many-to-one links become foreign key values, or references
+    to other new objects when both are being inserted. Inserts are ordered so
+    referenced tables come first.
+    """
+    table_order = {table: index for index, table in enumerate(Base.metadata.sorted_tables)}
+
+    new = session.new
+    inserts = []
+    for obj in sorted(new, key=lambda obj: table_order[inspect(obj).mapper.local_table]):
+        state = inspect(obj)
+        values, links = {}, {}
+        for attr in state.mapper.column_attrs:
+            if attr.key in state.dict:
+                values[attr.columns[0].key] = state.dict[attr.key]
+        for relationship in state.mapper.relationships:
+            target = state.dict.get(relationship.key)
+            if relationship.direction is not MANYTOONE or target is None:
+                continue
+            for local, remote in relationship.local_remote_pairs:
+                if target in new:
+                    links[local.key] = target
+                else:
+                    values[local.key] = getattr(target, remote.key)
+        inserts.append((obj, state.mapper.local_table, values, links))
+
+    updates = []
+    for obj in session.dirty:
+        state = inspect(obj)
+        changes = {}
+        for attr in state.mapper.column_attrs:
+            added = state.attrs[attr.key].history.added
+            if added:
+                changes[attr.columns[0].key] = added[0]
+        if changes:
+            updates.append((state.mapper.local_table, state.identity, changes))
+
+    for obj in list(new):
+        session.expunge(obj)
+    for obj in list(session.dirty):
+        session.expire(obj)
+    return inserts, updates
+
+class WriteBehindQueue:
+    """Commits chat turns on a background writer instead of the request thread.
+
+    A turn's pending rows are taken out of the chat's session (capture_changes)
+    and queued; the writer collects whatever has queued up within `interval`
+    seconds, up to `max_batch` turns, and commits the lot in one transaction.
+    If a group commit fails the turns are retried one at a time, so one bad turn
+    cannot take the others with it.
+
+    Queued turns live in memory: stop() (run at exit) writes everything out, but
+    turns still queued when the process is killed are lost, although the
+    participant has already seen the reply. This is why the queue is opt-in.
+    """
+
+    def __init__(self, session_factory, max_batch=100, interval=0.05):
+        self.session_factory = session_factory
+        self.max_batch = max(1, max_batch)
+        self.interval = interval
+
+        self._queue = deque()
+        self._in_flight = 0
+        self._cond = threading.Condition()
+        self._stopping = False
+        self._thread = None
+
+        self._batches = 0
+        self._turns_written = 0
+        self._failures = 0
+        self._last_batch_size = 0
+
+    @classmethod
+    def from_env(cls, session_factory):
+        return cls(
+            session_factory,
+            max_batch=int(os.environ.get('CBT_WRITE_BEHIND_BATCH', 100)),
+            interval=float(os.environ.get('CBT_WRITE_BEHIND_INTERVAL', 0.05))
+        )
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def submit_changes(self, session, deferred=()):
+        """Queue the session's pending changes, then any deferred write(session) callables"""
+        inserts, updates = capture_changes(session)
+        pending = PendingWrite(inserts, updates, list(deferred))
+        if not (inserts or updates or pending.deferred):
+            pending.finish()
+            return pending
+
+        with self._cond:
+            if self._stopping:
+                raise RuntimeError("write-behind queue is stopped")
+            self._queue.append(pending)
+            self._cond.notify_all()
+        return pending
+
+    def _take_batch(self):
+        with self._cond:
+            while not self._queue and not self._stopping:
+                self._cond.wait()
+            if not self._queue:
+                return None
+
+            # Give other chats' turns a moment to join this commit
+            deadline = time.monotonic() + self.interval
+            while len(self._queue) < self.max_batch and not self._stopping:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            batch = [self._queue.popleft() for _ in range(min(self.max_batch, len(self._queue)))]
+            self._in_flight = len(batch)
+            return batch
+
+    def _write(self, batch):
+        with self.session_factory() as session:
+            try:
+                # Deferred writes commit_or_defer() too; the batch still commits once
+                with unit_of_work(session):
+                    results = [pending.apply(session) for pending in batch]
+            except Exception as e:
+                if len(batch) == 1:
+                    batch[0].finish(error=e)
+                    return 1
+                print(f"⚠️  Group commit of {len(batch)} turns failed, retrying one at a time: {e}")
+                return sum(self._write([pending]) for pending in batch)
+
+        for pending, ids in zip(batch, results):
+            pending.finish(ids)
+        return 0
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if batch is None:
+                return
+
+            failures = self._write(batch)
+            if failures:
+                print(f"⚠️  Write-behind lost {failures} turn(s); see the chats' next turns for details")
+
+            with self._cond:
+                self._in_flight = 0
+                self._batches += 1
+                self._turns_written += len(batch) - failures
+                self._failures += failures
+                self._last_batch_size = len(batch)
+                self._cond.notify_all()
+
+    def flush(self, timeout=None):
+        """Block until everything queued so far has been written; False on timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._queue or self._in_flight:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def stop(self, timeout=None):
+        """Write out every queued turn and stop the writer"""
+        if self._thread is None:
+            return True
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'queued': len(self._queue),
+                'in_flight': self._in_flight,
+                'batches': self._batches,
+                'turns_written': self._turns_written,
+                'failures': self._failures,
+                'last_batch_size': self._last_batch_size
+            }
+
+_write_behind = None
+_write_behind_loaded = False
+_write_behind_lock = threading.Lock()
+
+def get_write_behind(start=True):
+    """The process-wide write-behind queue, or None unless CBT_WRITE_BEHIND is set.
+
+    With start=False the writer thread is left for the caller to start(), e.g. in
+    each worker after a preloading server has forked.
+    """
+    global _write_behind, _write_behind_loaded
+    with _write_behind_lock:
+        if not _write_behind_loaded:
+            _write_behind_loaded = True
+            if os.environ.get('CBT_WRITE_BEHIND', '').lower() in ('1', 'true', 'yes', 'on'):
+                from utils.cbt_database import get_session_factory
+                _write_behind = WriteBehindQueue.from_env(get_session_factory())
+                print("⚠️  Write-behind enabled: turns still queued if the process is killed are lost")
+                if start:
+                    _write_behind.start()
+        return _write_behind
@@ -1,60 +1,364 @@
-from flask import Flask, render_template, request, jsonify, session, make_response
-import ollama
-from utils.prompt_loader import load_prompt_template
-from utils.cbt_database import init_cbt_db, get_or_create_user, save_conversation
+from flask import Flask, render_template, request, jsonify, session, make_response, Response, stream_with_context
+from utils.prompt_loader import load_prompt_template, preload_prompt_templates
+from utils.cbt_database import get_engine, init_cbt_db, get_or_create_user, get_conversation_log, save_conversation, defer_write, User
 from utils.cbt_memory import CBTMemoryManager
-from utils.conversation_manager import ConversationManager
+from utils.conversation_manager import ConversationManager, INTRO_GREETING
+from utils.formulation_engine import CBTFormulationEngine
+from utils.rephrase_cache import RephraseCache
+from utils.variant_bank import get_variant_bank
+from utils.write_behind import get_write_behind
+from utils.session_store import InMemorySessionStore, SQLiteSessionStore, estimate_size
+from utils import llm
+from utils.llm_admission import LLMQueueFullError, LLMDeadlineExceededError
+from utils.llm_routing import TASK_FRAMING
+from utils.llm_latency import call_with_budget
+from utils.llm_health import LLMUnavailableError
 import uuid
 import os
-from datetime import datetime
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
 import json
+import zlib
+from sqlalchemy import text
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-change-this-in-production'
 
-# Global storage for user sessions
-user_sessions = {}
+# Process-wide pool of validated question rephrasings shared by all sessions
+rephrase_cache = RephraseCache()
+
+# Pre-generated question variants, if a bank has been built (see build_variant_bank.py)
+variant_bank = get_variant_bank()
+
+# Background writer for turns when CBT_WRITE_BEHIND is set, otherwise None
+write_behind = get_write_behind(start=False)
+
+# Read the prompts and create the engine and schema up front - once in the master when a
+# server preloads the app, so workers neither repeat the work nor race to migrate
+preload_prompt_templates()
+get_engine()
+
+def close_chat_session(session_id, session_data):
+    """Release a chat's resources once it leaves the session store"""
+    session_data['conversation_manager'].cancel_prefetch()
+
+def encode_chat_session(session_data):
+    """Serialize a chat to a compact blob: ids, progress and the transcript, no live objects"""
+    state = {
+        'session_id': session_data['session_id'],
+        'user_identifier': session_data['user_identifier'],
+        'personalization_type': session_data['personalization_type'],
+        'session_start_time': session_data['session_start_time'].timestamp(),
+        'conversation_history': [
+            {**entry, 'timestamp': entry['timestamp'].timestamp()} for entry in session_data['conversation_history']
+        ],
+        'conversation': session_data['conversation_manager'].to_state()
+    }
+    return zlib.compress(json.dumps(state, separators=(',', ':')).encode('utf-8'))
+
+def decode_chat_session(blob):
+    """Rebuild a chat's session data from encode_chat_session() output"""
+    state = json.loads(zlib.decompress(blob))
+    conversation_manager = ConversationManager.from_state(
+        state['conversation'], rephrase_cache=rephrase_cache, variant_bank=variant_bank, write_behind=write_behind
+    )
+    return {
+        'session_id': state['session_id'],
+        'user_id': conversation_manager.memory.user_id,
+        'cbt_memory': conversation_manager.memory,
+        'conversation_manager': conversation_manager,
+        'personalization_type': state['personalization_type'],
+        'conversation_history': [
+            {**entry, 'timestamp': datetime.fromtimestamp(entry['timestamp'])} for entry in state['conversation_history']
+        ],
+        'session_start_time': datetime.fromtimestamp(state['session_start_time']),
+        'user_identifier': state['user_identifier']
+    }
+
+def create_session_store():
+    """The chat store selected by CBT_SESSION_STORE.
+    
+    'memory' (default) keeps chats in this process. 'sqlite' keeps them serialized in
+    CBT_SESSION_STORE_PATH, so any worker can serve any chat without sticky sessions.
+    Either way idle chats expire after CBT_SESSION_TTL seconds and the least recently
+    used are evicted beyond CBT_SESSION_MAX.
+    """
+    backend = os.environ.get('CBT_SESSION_STORE', 'memory').lower()
+    if backend == 'memory':
+        return InMemorySessionStore.from_env(
+            on_close=close_chat_session,
+            # The shared caches and queue are not held by any one chat
+            sizeof=lambda session_data: estimate_size(session_data, exclude=(rephrase_cache, variant_bank, write_behind))
+        )
+    if backend == 'sqlite':
+        # Serialized chats hold nothing that needs closing
+        return SQLiteSessionStore.from_env(dumps=encode_chat_session, loads=decode_chat_session)
+    raise ValueError(f"Unknown session store '{backend}' (expected memory or sqlite)")
+
+session_store = create_session_store()
+
+def save_chat_session(session_data):
+    """Write the chat back to the session store once a request has changed it"""
+    session_store.put(session_data['session_id'], session_data)
+
+def resume_chat_session(db_session, session_id, user_identifier):
+    """Rebuild a chat missing from the session store from the database, or return None.
+    
+    After a restart the store no longer has the chat, but everything its turns
+    committed is still in the database. Three indexed reads - the user, their
+    conversation log and their situations - give back the phase, the situation
+    ids and the transcript. Chats idle for longer than the store's TTL stay ended.
+    """
+    user = db_session.query(User).filter_by(identifier=user_identifier).first()
+    if user is None:
+        return None
+    
+    # The first row is the greeting; each later row is one answered question
+    log = get_conversation_log(db_session, user.id)
+    if not log or datetime.utcnow() - log[-1].timestamp > timedelta(seconds=session_store.ttl_seconds):
+        return None
+    
+    answers = [row.message for row in log[1:]]
+    conversation_manager = ConversationManager.from_database(
+        db_session, user.id, answers, rephrase_cache=rephrase_cache, variant_bank=variant_bank, write_behind=write_behind
+    )
+    phases = conversation_manager.phases
+    
+    def phase(index):
+        return phases[index] if index < len(phases) else 'complete'
+    
+    def local_time(timestamp):
+        # Rows are stamped in UTC; the transcript uses local time like a live chat
+        return timestamp.replace(tzinfo=timezone.utc).astimezone().replace(tzinfo=None)
+    
+    conversation_history = []
+    for index, row in enumerate(log):
+        if index > 0:
+            conversation_history.append({'timestamp': local_time(row.timestamp), 'sender': 'User', 'message': row.message, 'phase': phase(index - 1)})
+        conversation_history.append({'timestamp': local_time(row.timestamp), 'sender': 'AI', 'message': row.response, 'phase': phase(index)})
+    
+    print(f"\n♻️  Resumed session {session_id} for User {user.id} at phase {conversation_manager.get_current_phase()}")
+    return {
+        'session_id': session_id,
+        'user_id': user.id,
+        'cbt_memory': conversation_manager.memory,
+        'conversation_manager': conversation_manager,
+        'personalization_type': log[0].session_type,
+        'conversation_history': conversation_history,
+        'session_start_time': local_time(log[0].timestamp),
+        'user_identifier': user_identifier
+    }
+    
+def load_chat_session(session_id, user_identifier=None):
+    """The chat for this request, resumed from the database if the store has lost it"""
+    if not session_id:
+        return None
+    session_data = session_store.get(session_id)
+    if session_data is None and user_identifier:
+        with init_cbt_db() as db_session:
+            session_data = resume_chat_session(db_session, session_id, user_identifier)
+        if session_data is not None:
+            save_chat_session(session_data)
+    return session_data
+
+# Longest a stopping worker waits for queued turns to be written, in seconds
+SHUTDOWN_FLUSH_TIMEOUT = 30
+
+def start_background_services():
+    """Start this process's background threads.
+    
+    Probes the LLM backend so outages trip the circuit breaker early, reaps idle
+    chats and runs the write-behind writer. Threads do not survive fork(), so when
+    a server preloads the app (CBT_PRELOAD_APP, see gunicorn.conf.py) each worker
+    starts its own through init_worker().
+    """
+    llm.start_health_monitor()
+    session_store.start_reaper(float(os.environ.get('CBT_SESSION_REAP_INTERVAL', 60)))
+    if write_behind:
+        write_behind.start()
+
+def init_worker():
+    """Set up a worker forked from a preloading master: fresh connections, then threads"""
+    # Pooled connections and SQLite handles must not be shared with the parent
+    get_engine().dispose(close=False)
+    rephrase_cache.reopen()
+    session_store.reopen()
+    start_background_services()
+
+def shutdown():
+    """Write out queued turns and stop the background threads before the process exits"""
+    session_store.stop_reaper()
+    if write_behind and not write_behind.stop(SHUTDOWN_FLUSH_TIMEOUT):
+        print(f"⚠️  Write-behind queue not drained after {SHUTDOWN_FLUSH_TIMEOUT}s; queued turns may be lost")
+
+if os.environ.get('CBT_PRELOAD_APP') != '1':
+    start_background_services()
+
+def sse_event(event, payload):
+    """Format a Server-Sent Events message with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+def sse_response(generator):
+    """Wrap a generator of SSE messages in a streaming response"""
+    return Response(
+        stream_with_context(generator),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+def overloaded_response():
+    """503 response telling the client to retry once the LLM queue has drained"""
+    retry_after = llm.admission.retry_after()
+    response = jsonify({
+        'error': 'The assistant is busy right now. Please try again in a moment.',
+        'retry_after': retry_after,
+        'queue_depth': llm.admission.stats()['queued']
+    })
+    response.status_code = 503
+    response.headers['Retry-After'] = str(retry_after)
+    return response
 
 @app.route('/')
 def index():
     """Serve the main chat interface"""
     return render_template('chat.html')
 
+@app.route('/health', methods=['GET'])
+def health():
+    """Report the cached LLM backend health and load"""
+    status = llm.health()
+    return jsonify({
+        'llm': status,
+        'admission': llm.admission.stats(),
+        'write_behind': write_behind.stats() if write_behind else None,
+        'sessions': session_store.stats()
+    }), 200 if status['ok'] else 503
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """Readiness probe: this worker has loaded the app and can reach the database"""
+    try:
+        with get_engine().connect() as connection:
+            connection.execute(text("SELECT 1"))
+    except Exception as e:
+        return jsonify({'ready': False, 'error': str(e), 'pid': os.getpid()}), 503
+    return jsonify({'ready': True, 'pid': os.getpid()})
+
+def create_chat_session(personalization_type):
+    """Create the per-chat components and register them in the session store"""
+    # Generate unique session ID
+    session_id = str(uuid.uuid4())
+    session['session_id'] = session_id
+    
+    # Initialize components; between requests the chat keeps only the user id
+    user_identifier = str(uuid.uuid4())
+    # Kept in the signed cookie so the chat can be resumed from the database after a restart
+    session['user_identifier'] = user_identifier
+    with init_cbt_db() as db_session:
+        user_id = get_or_create_user(db_session, user_identifier).id
+    
+    session_data = new_chat_session(session_id, user_id, user_identifier, personalization_type, write_behind)
+    save_chat_session(session_data)
+    return session_id, session_data
+
+def new_chat_session(session_id, user_id, user_identifier, personalization_type, write_behind):
+    """Build the session data for a chat whose user row has just been created"""
+    cbt_memory = CBTMemoryManager(None, user_id=user_id)
+    conversation_manager = ConversationManager(cbt_memory, rephrase_cache=rephrase_cache, variant_bank=variant_bank, write_behind=write_behind)
+    
+    session_data = {
+        'session_id': session_id,
+        'user_id': user_id,
+        'cbt_memory': cbt_memory,
+        'conversation_manager': conversation_manager,
+        'personalization_type': personalization_type,
+        'conversation_history': [],
+        'session_start_time': datetime.now(),
+        'user_identifier': user_identifier
+    }
+    
+    # Terminal logging for researcher (hidden from user interface)
+    print(f"\n🔬 USER STUDY LOG - User {cbt_memory.user_id} selected: {'WITH PERSONALIZATION' if personalization_type == 'with_personalization' else 'WITHOUT PERSONALIZATION (Pure CBT)'}")
+    print(f"   Session ID: {session_id}")
+    print(f"   Timestamp: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print("   =" * 60)
+    
+    return session_data
+
+@contextmanager
+def request_db_session(session_data):
+    """Open a database session for one request and bind the chat's memory to it.
+    
+    The session is closed when the request ends, so idle and abandoned chats hold
+    no connection or ORM objects and the pool only needs to cover concurrent requests.
+    """
+    cbt_memory = session_data['cbt_memory']
+    with init_cbt_db() as db_session:
+        cbt_memory.bind(db_session)
+        try:
+            yield db_session
+        finally:
+            cbt_memory.release()
+
+def prefetch_next_question(session_data):
+    """Start preparing the next question while the participant reads and types"""
+    if not session_store.live:
+        # The next request rebuilds the chat, possibly on another worker, and could not collect it
+        return
+    
+    session_data['conversation_manager'].prefetch_next_question(
+        personalized=session_data['personalization_type'] == 'with_personalization'
+    )
+
+def log_turn(session_data, message, response):
+    """Save the conversation log row with the memory context as of this turn.
+    
+    When the turn is written behind, the row and its context are produced by the
+    background writer after the turn's other rows.
+    """
+    db_session = session_data['cbt_memory'].session
+    user_id = session_data['user_id']
+    personalization_type = session_data['personalization_type']
+    
+    def write(session):
+        if session is db_session:
+            cbt_memory = session_data['cbt_memory']
+        else:
+            cbt_memory = CBTMemoryManager(session, session.get(User, user_id))
+        save_conversation(session, user_id, message, response, cbt_memory.get_context_for_conversation(), personalization_type)
+    
+    defer_write(db_session, write)
+
+def record_greeting(session_data, starter):
+    """Persist the opening message and add it to the conversation history"""
+    with request_db_session(session_data):
+        log_turn(session_data, "", starter)
+        prefetch_next_question(session_data)
+    
+    # Add initial AI message to conversation history
+    session_data['conversation_history'].append({
+        'timestamp': datetime.now(),
+        'sender': 'AI', 
+        'message': starter,
+        'phase': 'introduction'
+    })
+    save_chat_session(session_data)
+
 @app.route('/start_session', methods=['POST'])
 def start_session():
     """Initialize a new chat session"""
+    if llm.admission.is_saturated():
+        return overloaded_response()
+    
     try:
         data = request.get_json()
         personalization_type = data.get('personalization_type', 'with_personalization')
         
-        # Generate unique session ID
-        session_id = str(uuid.uuid4())
-        session['session_id'] = session_id
-        
-        # Initialize components
-        db_session = init_cbt_db()
-        user_identifier = str(uuid.uuid4())
-        user = get_or_create_user(db_session, user_identifier)
-        cbt_memory = CBTMemoryManager(db_session, user)
-        conversation_manager = ConversationManager(cbt_memory)
-        
-        # Store session data
-        user_sessions[session_id] = {
-            'db_session': db_session,
-            'user': user,
-            'cbt_memory': cbt_memory,
-            'conversation_manager': conversation_manager,
-            'personalization_type': personalization_type,
-            'conversation_history': [],
-            'session_start_time': datetime.now(),
-            'user_identifier': user_identifier
-        }
-        
-        # Terminal logging for researcher (hidden from user interface)
-        print(f"\n🔬 USER STUDY LOG - User {user.id} selected: {'WITH PERSONALIZATION' if personalization_type == 'with_personalization' else 'WITHOUT PERSONALIZATION (Pure CBT)'}")
-        print(f"   Session ID: {session_id}")
-        print(f"   Timestamp: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-        print("   =" * 60)
+        session_id, session_data = create_chat_session(personalization_type)
+        conversation_manager = session_data['conversation_manager']
         
         # Load base prompt
         try:
@@ -63,23 +367,13 @@ def start_session():
             return jsonify({'error': str(e)}), 500
         
         # Create initial greeting
-        intro_base = "Hi! I'm here to support you today through a structured conversation that will help us understand your thinking patterns. What's been on your mind lately?"
-        starter = conversation_manager._rephrase_question_with_ai(intro_base, 'introduction')
+        starter = conversation_manager._rephrase_question_with_ai(INTRO_GREETING, 'introduction')
         
         # Clean up any quotation marks for consistency
         starter = starter.strip('"').strip("'").strip()
         
         # Save initial conversation
-        context = cbt_memory.get_context_for_conversation()
-        save_conversation(db_session, user.id, "", starter, context, personalization_type)
-        
-        # Add initial AI message to conversation history
-        user_sessions[session_id]['conversation_history'].append({
-            'timestamp': datetime.now(),
-            'sender': 'AI', 
-            'message': starter,
-            'phase': 'introduction'
-        })
+        record_greeting(session_data, starter)
         
         return jsonify({
             'success': True,
@@ -91,79 +385,118 @@ def start_session():
     except Exception as e:
         return jsonify({'error': f'Failed to start session: {str(e)}'}), 500
 
-@app.route('/send_message', methods=['POST'])
-def send_message():
-    """Handle user message and return AI response"""
+@app.route('/start_session/stream', methods=['POST'])
+def start_session_stream():
+    """Initialize a new chat session and stream the greeting as it is generated"""
+    if llm.admission.is_saturated():
+        return overloaded_response()
+    
     try:
         data = request.get_json()
-        user_input = data.get('message', '').strip()
-        session_id = session.get('session_id')
-        
-        if not session_id or session_id not in user_sessions:
-            return jsonify({'error': 'Session not found. Please start a new session.'}), 400
-        
-        if not user_input:
-            return jsonify({'error': 'Message cannot be empty'}), 400
+        personalization_type = data.get('personalization_type', 'with_personalization')
         
-        # Get session data
-        session_data = user_sessions[session_id]
+        session_id, session_data = create_chat_session(personalization_type)
         conversation_manager = session_data['conversation_manager']
-        cbt_memory = session_data['cbt_memory']
-        db_session = session_data['db_session']
-        user = session_data['user']
-        personalization_type = session_data['personalization_type']
-        
-        # Add user message to conversation history
-        session_data['conversation_history'].append({
-            'timestamp': datetime.now(),
-            'sender': 'User',
-            'message': user_input,
-            'phase': conversation_manager.get_current_phase()
-        })
         
-        # Check for exit commands
-        if user_input.lower() in ["exit", "quit", "end session"]:
-            # Terminal logging for researcher
-            print(f"\n📊 USER STUDY LOG - User {user.id} ({personalization_type.upper()}) ENDED SESSION EARLY")
-            print(f"   Timestamp: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+        # Validate the prompt template before committing to a stream
+        load_prompt_template("cbt", "with_context")
+    except Exception as e:
+        return jsonify({'error': f'Failed to start session: {str(e)}'}), 500
+    
+    def generate():
+        starter = INTRO_GREETING
+        streamed = False
+        try:
+            for kind, text in conversation_manager.stream_rephrase_question_with_ai(INTRO_GREETING, 'introduction'):
+                if kind == 'token':
+                    streamed = True
+                    yield sse_event('token', {'text': text})
+                else:
+                    starter = text
             
-            # Clean up session
-            db_session.close()
-            del user_sessions[session_id]
-            return jsonify({
-                'success': True,
-                'message': "Thank you for sharing. Take care! 🌱",
-                'session_ended': True
-            })
-        
-        # Process based on personalization type
-        if personalization_type == "with_personalization":
-            # Enhanced logging for personalization research
-            print(f"\n🧠 MEMORY-ENHANCED AI PROCESSING for User {user.id}")
-            print(f"   Using PERSONALIZED mode with database memory retrieval")
-            print(f"   Timestamp: {datetime.now().strftime('%H:%M:%S')}")
+            if not streamed:
+                # Banked, cached or the model missed the budget - show the greeting before it is saved
+                yield sse_event('token', {'text': starter})
             
-            ai_response, session_ended = process_with_personalization(
-                user_input, conversation_manager, cbt_memory, db_session, user, personalization_type, session_data
-            )
-        else:
-            # Terminal logging for researcher  
-            user_id = conversation_manager.memory.user.id
-            print(f"\n🔍 USER STUDY LOG - User {user_id} (WITHOUT personalization) processing message")
-            print(f"   Input: {user_input[:100]}...")
-            print(f"   Timestamp: {datetime.now().strftime('%H:%M:%S')}")
+            # Persist once the stream has finished
+            record_greeting(session_data, starter)
             
-            ai_response, session_ended = process_without_personalization(
-                user_input, conversation_manager, cbt_memory, db_session, user, personalization_type, session_data
-            )
+            yield sse_event('done', {
+                'success': True,
+                'message': starter,
+                'session_id': session_id,
+                'personalization_type': personalization_type
+            })
+        except Exception as e:
+            yield sse_event('error', {'error': f'Failed to start session: {str(e)}'})
+    
+    return sse_response(generate())
+
+def begin_turn():
+    """Validate an incoming chat message and record it in the conversation history.
+    
+    Returns (session_data, user_input, response) where response is a ready-made
+    JSON response when the turn should not be processed any further.
+    """
+    data = request.get_json()
+    user_input = data.get('message', '').strip()
+    session_id = session.get('session_id')
+    session_data = load_chat_session(session_id, session.get('user_identifier'))
+    
+    if session_data is None:
+        return None, user_input, (jsonify({'error': 'Session not found. Please start a new session.'}), 400)
+    
+    if not user_input:
+        return None, user_input, (jsonify({'error': 'Message cannot be empty'}), 400)
+    
+    # Turn away new work while the LLM queue is full, before any state changes
+    if llm.admission.is_saturated():
+        return None, user_input, overloaded_response()
+    
+    conversation_manager = session_data['conversation_manager']
+    personalization_type = session_data['personalization_type']
+    
+    # Add user message to conversation history
+    session_data['conversation_history'].append({
+        'timestamp': datetime.now(),
+        'sender': 'User',
+        'message': user_input,
+        'phase': conversation_manager.get_current_phase()
+    })
+    
+    # Check for exit commands
+    if user_input.lower() in ["exit", "quit", "end session"]:
+        # Terminal logging for researcher
+        print(f"\n📊 USER STUDY LOG - User {session_data['user_id']} ({personalization_type.upper()}) ENDED SESSION EARLY")
+        print(f"   Timestamp: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
         
-        # Add AI message to conversation history
-        session_data['conversation_history'].append({
-            'timestamp': datetime.now(),
-            'sender': 'AI',
-            'message': ai_response,
-            'phase': conversation_manager.get_current_phase()
+        # Clean up session; an ended chat is not resumed
+        session_store.delete(session_id)
+        session.pop('user_identifier', None)
+        return None, user_input, jsonify({
+            'success': True,
+            'message': "Thank you for sharing. Take care! 🌱",
+            'session_ended': True
         })
+    
+    return session_data, user_input, None
+
+@app.route('/send_message', methods=['POST'])
+def send_message():
+    """Handle user message and return AI response"""
+    try:
+        session_data, user_input, early_response = begin_turn()
+        if early_response is not None:
+            return early_response
+        
+        conversation_manager = session_data['conversation_manager']
+        
+        with request_db_session(session_data):
+            ai_response, session_ended = run_turn(user_input, session_data)
+            
+            if not session_ended:
+                prefetch_next_question(session_data)
+            save_chat_session(session_data)
         
         return jsonify({
             'success': True,
@@ -172,10 +505,193 @@ def send_message():
             'session_ended': session_ended
         })
         
+    except LLMQueueFullError:
+        return overloaded_response()
+    except Exception as e:
+        return jsonify({'error': f'Failed to process message: {str(e)}'}), 500
+
+def run_turn(user_input, session_data):
+    """Process one message with the chat's memory bound to a session.
+    
+    Returns (ai_response, session_ended) and records the reply in the conversation
+    history. Everything the turn writes is committed once; if any step fails it is
+    rolled back and the reply asks the participant to try again. Raises
+    LLMQueueFullError so the caller can answer with a 503.
+    """
+    conversation_manager = session_data['conversation_manager']
+    cbt_memory = session_data['cbt_memory']
+    user_id = session_data['user_id']
+    personalization_type = session_data['personalization_type']
+    
+    # Process based on personalization type
+    if personalization_type == "with_personalization":
+        # Enhanced logging for personalization research
+        print(f"\n🧠 MEMORY-ENHANCED AI PROCESSING for User {user_id}")
+        print(f"   Using PERSONALIZED mode with database memory retrieval")
+        print(f"   Timestamp: {datetime.now().strftime('%H:%M:%S')}")
+        process_turn = process_with_personalization
+    else:
+        # Terminal logging for researcher  
+        print(f"\n🔍 USER STUDY LOG - User {user_id} (WITHOUT personalization) processing message")
+        print(f"   Input: {user_input[:100]}...")
+        print(f"   Timestamp: {datetime.now().strftime('%H:%M:%S')}")
+        process_turn = process_without_personalization
+    
+    # Everything the turn writes is committed once, or rolled back if any step fails
+    try:
+        with conversation_manager.turn():
+            ai_response, session_ended = process_turn(
+                user_input, conversation_manager, cbt_memory, personalization_type, session_data
+            )
+    except LLMQueueFullError:
+        raise
+    except Exception as e:
+        # Nothing from this turn was kept, so the participant can answer the same question again
+        print(f"Turn rolled back: {e}")
+        ai_response = f"I'm sorry, I encountered an error. Could you please try again? Error: {str(e)}"
+        session_ended = False
+    
+    # Add AI message to conversation history
+    session_data['conversation_history'].append({
+        'timestamp': datetime.now(),
+        'sender': 'AI',
+        'message': ai_response,
+        'phase': conversation_manager.get_current_phase()
+    })
+    
+    return ai_response, session_ended
+
+@app.route('/send_message/stream', methods=['POST'])
+def send_message_stream():
+    """Handle user message and stream the AI response as it is generated"""
+    try:
+        session_data, user_input, early_response = begin_turn()
+        if early_response is not None:
+            return early_response
     except Exception as e:
         return jsonify({'error': f'Failed to process message: {str(e)}'}), 500
+    
+    return sse_response(stream_turn(user_input, session_data))
+
+def stream_turn(user_input, session_data):
+    """Process a chat turn, yielding SSE messages while the response is generated.
+    
+    Emits 'token' events with partial text, then a single 'done' event with the
+    final message once it has been saved, or an 'error' event on failure.
+    """
+    try:
+        with request_db_session(session_data):
+            done = yield from stream_turn_events(user_input, session_data)
+            if not done['session_ended']:
+                prefetch_next_question(session_data)
+            save_chat_session(session_data)
+        
+        # The database session is released before the final event is sent
+        yield sse_event('done', done)
+        
+    except Exception as e:
+        yield sse_event('error', {'error': f'Failed to process message: {str(e)}'})
+
+def stream_turn_events(user_input, session_data):
+    """Run a chat turn with the chat's memory bound to a session, yielding SSE messages.
+    
+    Yields the 'status', 'section' and 'token' events as the response is generated
+    and returns the payload of the final 'done' event; the caller sends it once the
+    database session is released. Exceptions propagate after the turn is rolled back.
+    """
+    conversation_manager = session_data['conversation_manager']
+    user_id = session_data['user_id']
+    personalization_type = session_data['personalization_type']
+    
+    # Everything the turn writes is committed once the full response is known; an
+    # error or the client disconnecting rolls it back to the question just asked
+    with conversation_manager.turn():
+        # Save user response and advance phase
+        conversation_manager.save_response_data(user_input)
+        conversation_manager.advance_phase()
+        phase = conversation_manager.get_current_phase()
+        session_ended = False
+        next_question = None
+    
+        if phase == 'complete':
+            # Generate CBT formulation
+            print("📋 Generating CBT Formulation...")
+            yield sse_event('status', {'message': 'Generating your CBT formulation...'})
+    
+            # Sections are generated concurrently and streamed as each one is ready
+            ai_response = None
+            for kind, index, title, text in CBTFormulationEngine(conversation_manager).stream_sections():
+                if kind == 'section':
+                    yield sse_event('section', {'index': index, 'title': title, 'text': text})
+                else:
+                    ai_response = text
+            session_ended = True
+    
+        elif personalization_type == "with_personalization":
+            # Enhanced logging for personalization research
+            print(f"\n🧠 MEMORY-ENHANCED AI PROCESSING for User {user_id} (streaming)")
+            print(f"   Timestamp: {datetime.now().strftime('%H:%M:%S')}")
+    
+            # Personalized questions are delivered as-is to preserve bold memory references
+            ai_response = next_question = conversation_manager.get_contextual_starter()
+    
+        else:
+            # Terminal logging for researcher
+            print(f"\n🔍 USER STUDY LOG - User {user_id} (WITHOUT personalization) processing message (streaming)")
+            print(f"   Input: {user_input[:100]}...")
+            print(f"   Timestamp: {datetime.now().strftime('%H:%M:%S')}")
+    
+            ai_response = None
+            next_question = conversation_manager.get_contextual_starter_without_personalization()
+            if next_question and llm.is_overloaded(TASK_FRAMING):
+                # Skip framing while the backend is overloaded and ask the question as-is
+                ai_response = next_question
+            elif next_question:
+                framing_prompt = build_framing_prompt(user_input, next_question, conversation_manager.get_current_collection_phase())
+                try:
+                    for kind, text in stream_framed_response(conversation_manager, framing_prompt):
+                        if kind == 'token':
+                            yield sse_event('token', {'text': text})
+                        else:
+                            ai_response = text
+                except (LLMQueueFullError, LLMDeadlineExceededError, LLMUnavailableError) as e:
+                    # Too busy to frame the question - ask it as-is rather than failing the turn
+                    print(f"Framing skipped under load: {e}")
+                    ai_response = next_question
+                
+                if not ai_response:
+                    # The model framed nothing usable - ask the question as-is
+                    ai_response = next_question
+    
+        if ai_response:
+            # Add AI message to conversation history
+            session_data['conversation_history'].append({
+                'timestamp': datetime.now(),
+                'sender': 'AI',
+                'message': ai_response,
+                'phase': phase
+            })
+        
+            # Persist once the full response is known
+            log_turn(session_data, user_input, ai_response)
+    
+    if not ai_response and not next_question:
+        # No formulation and nothing left to ask
+        return {
+            'success': True,
+            'message': "Assessment complete!",
+            'phase': phase,
+            'session_ended': True
+        }
+    
+    return {
+        'success': True,
+        'message': ai_response,
+        'phase': phase,
+        'session_ended': session_ended
+    }
 
-def process_with_personalization(user_input, conversation_manager, cbt_memory, db_session, user, personalization_type, session_data):
+def process_with_personalization(user_input, conversation_manager, cbt_memory, personalization_type, session_data):
     """Process message with personalization"""
     # Save user response
     conversation_manager.save_response_data(user_input)
@@ -189,7 +705,7 @@ def process_with_personalization(user_input, conversation_manager, cbt_memory, d
     if phase == 'complete':
         # Generate CBT formulation
         print("📋 Generating CBT Formulation...")
-        ai_response = conversation_manager.generate_improved_cbt_formulation()
+        ai_response = CBTFormulationEngine(conversation_manager).generate()
         
         session_data['conversation_history'].append({
             'timestamp': datetime.now(),
@@ -198,8 +714,7 @@ def process_with_personalization(user_input, conversation_manager, cbt_memory, d
             'phase': phase
         })
         
-        context = cbt_memory.get_context_for_conversation()
-        save_conversation(db_session, user.id, user_input, ai_response, context, personalization_type)
+        log_turn(session_data, user_input, ai_response)
         
         return ai_response, True
     
@@ -219,41 +734,16 @@ def process_with_personalization(user_input, conversation_manager, cbt_memory, d
                 'phase': phase
             })
             
-            context = cbt_memory.get_context_for_conversation()
-            save_conversation(db_session, user.id, user_input, ai_response, context, personalization_type)
+            log_turn(session_data, user_input, ai_response)
             
             return ai_response, False
         else:
             return "Assessment complete!", True
 
-def process_without_personalization(user_input, conversation_manager, cbt_memory, db_session, user, personalization_type, session_data):
-    """Process message without personalization"""
-    # Save user response
-    conversation_manager.save_response_data(user_input)
-    
-    # Advance phase
-    conversation_manager.advance_phase()
-    phase = conversation_manager.get_current_phase()
-    
-    if phase == 'complete':
-        # Generate CBT formulation
-        print("📋 Generating CBT Formulation...")
-        ai_response = conversation_manager.generate_improved_cbt_formulation()
-        
-        context = cbt_memory.get_context_for_conversation()
-        save_conversation(db_session, user.id, user_input, ai_response, context, personalization_type)
-        
-        return ai_response, True
-    else:
-        # Get next structured question WITHOUT personalization
-        next_question = conversation_manager.get_contextual_starter_without_personalization()
-        
-        if next_question:
-            # For non-personalized questions, we can still use AI framing since there's no bold formatting to preserve
-            collection_phase = conversation_manager.get_current_collection_phase()
-            
-            if collection_phase == 'introduction':
-                framing_prompt = f"""The user shared their presenting concern: "{user_input}"
+def build_framing_prompt(user_input, next_question, collection_phase):
+    """Build the prompt that blends an acknowledgment of the user's answer with the next question"""
+    if collection_phase == 'introduction':
+        return f"""The user shared their presenting concern: "{user_input}"
 
 You need to naturally deliver this question: "{next_question}"
 
@@ -262,9 +752,9 @@ CRITICAL RULES:
 - Don't separate acknowledgment and question - blend them together smoothly
 - Keep it warm, empathetic, and professional
 - Total response should be 30-50 words as ONE complete statement"""
-            
-            elif collection_phase == 'cbt_assessment':
-                framing_prompt = f"""The user responded: "{user_input}"
+    
+    elif collection_phase == 'cbt_assessment':
+        return f"""The user responded: "{user_input}"
 
 You need to naturally ask this question: "{next_question}"
 
@@ -273,9 +763,9 @@ CRITICAL RULES:
 - Don't separate acknowledgment and question - make it one smooth statement
 - Keep it therapeutic and supportive
 - Total response should be 25-45 words as ONE complete statement"""
-            
-            elif collection_phase == 'patterns_beliefs':
-                framing_prompt = f"""The user shared: "{user_input}"
+    
+    elif collection_phase == 'patterns_beliefs':
+        return f"""The user shared: "{user_input}"
 
 You need to ask: "{next_question}"
 
@@ -284,36 +774,109 @@ CRITICAL RULES:
 - Don't separate acknowledgment and question - blend them together
 - Keep it thoughtful and encouraging
 - Total response should be 40-60 words as ONE complete statement"""
-            
-            else:
-                framing_prompt = f"""The user responded: "{user_input}"
+    
+    else:
+        return f"""The user responded: "{user_input}"
 
 You need to ask: "{next_question}"
 
 Create ONE natural, flowing response that incorporates the question smoothly."""
 
+def stream_framed_response(conversation_manager, framing_prompt):
+    """Stream a framed response from the model.
+    
+    Yields ('token', text) tuples while generating, then ('final', response) with
+    the cleaned-up response text. Raises LLMDeadlineExceededError, before any token,
+    if the first chunk does not arrive within the turn budget.
+    """
+    base_prompt = load_prompt_template("cbt", "with_context")
+    system_prompt = conversation_manager.format_system_prompt(base_prompt)
+    
+    stream = llm.chat(
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": framing_prompt}
+        ],
+        stream=True,
+        task=TASK_FRAMING
+    )
+    
+    # Wait no longer than the turn budget for the first chunk; a late stream is closed unread
+    completed, chunk = call_with_budget(
+        lambda: next(stream, None),
+        llm.budget.budget(TASK_FRAMING),
+        on_late=lambda chunk: stream.close()
+    )
+    if not completed:
+        raise LLMDeadlineExceededError("framing exceeded the latency budget")
+    
+    chunks = []
+    while chunk is not None:
+        token = chunk['message']['content']
+        if token:
+            chunks.append(token)
+            yield 'token', token
+        chunk = next(stream, None)
+    
+    yield 'final', ''.join(chunks).strip('"').strip("'").strip()
+
+def process_without_personalization(user_input, conversation_manager, cbt_memory, personalization_type, session_data):
+    """Process message without personalization"""
+    # Save user response
+    conversation_manager.save_response_data(user_input)
+    
+    # Advance phase
+    conversation_manager.advance_phase()
+    phase = conversation_manager.get_current_phase()
+    
+    if phase == 'complete':
+        # Generate CBT formulation
+        print("📋 Generating CBT Formulation...")
+        ai_response = CBTFormulationEngine(conversation_manager).generate()
+        
+        log_turn(session_data, user_input, ai_response)
+        
+        return ai_response, True
+    else:
+        # Get next structured question WITHOUT personalization
+        next_question = conversation_manager.get_contextual_starter_without_personalization()
+        
+        if next_question:
+            # For non-personalized questions, we can still use AI framing since there's no bold formatting to preserve
+            framing_prompt = build_framing_prompt(user_input, next_question, conversation_manager.get_current_collection_phase())
+
+            base_prompt = load_prompt_template("cbt", "with_context")
+            system_prompt = conversation_manager.format_system_prompt(base_prompt)
+            
             try:
-                base_prompt = load_prompt_template("cbt", "with_context")
-                system_prompt = conversation_manager.format_system_prompt(base_prompt)
+                if llm.is_overloaded(TASK_FRAMING):
+                    raise LLMDeadlineExceededError("backend overloaded")
                 
-                response = ollama.chat(
-                    model="llama3.2",
-                    messages=[
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": framing_prompt}
-                    ]
+                # Wait no longer than the turn budget; a late framing is specific to this turn, so it is dropped
+                completed, response = call_with_budget(
+                    lambda: llm.chat(
+                        messages=[
+                            {"role": "system", "content": system_prompt},
+                            {"role": "user", "content": framing_prompt}
+                        ],
+                        task=TASK_FRAMING
+                    ),
+                    llm.budget.budget(TASK_FRAMING)
                 )
+                if not completed:
+                    raise LLMDeadlineExceededError("framing exceeded the latency budget")
                 
                 ai_response = response['message']['content']
-                ai_response = ai_response.strip('"').strip("'").strip()
+                # A reply with nothing usable left asks the question as-is
+                ai_response = ai_response.strip('"').strip("'").strip() or next_question
+            except (LLMQueueFullError, LLMDeadlineExceededError, LLMUnavailableError) as e:
+                # Too busy to frame the question - ask it as-is rather than failing the turn
+                print(f"Framing skipped under load: {e}")
+                ai_response = next_question
             
-                context = cbt_memory.get_context_for_conversation()
-                save_conversation(db_session, user.id, user_input, ai_response, context, personalization_type)
-                
-                return ai_response, False
-                
-            except Exception as e:
-                return f"I'm sorry, I encountered an error. Could you please try again? Error: {str(e)}", False
+            log_turn(session_data, user_input, ai_response)
+            
+            return ai_response, False
         else:
             return "Assessment complete!", True
 
@@ -321,12 +884,11 @@ Create ONE natural, flowing response that incorporates the question smoothly."""
 def download_report():
     """Generate and download conversation report"""
     try:
-        session_id = session.get('session_id')
+        session_data = load_chat_session(session.get('session_id'), session.get('user_identifier'))
         
-        if not session_id or session_id not in user_sessions:
+        if session_data is None:
             return jsonify({'error': 'Session not found'}), 400
             
-        session_data = user_sessions[session_id]
         conversation_history = session_data['conversation_history']
         personalization_type = session_data['personalization_type']
         session_start_time = session_data['session_start_time']
@@ -530,12 +1092,12 @@ def end_session():
     """End the current session"""
     session_id = session.get('session_id')
     
-    if session_id and session_id in user_sessions:
+    if session_id:
         # Clean up session
-        user_sessions[session_id]['db_session'].close()
-        del user_sessions[session_id]
+        session_store.delete(session_id)
     
     session.pop('session_id', None)
+    session.pop('user_identifier', None)
     
     return jsonify({'success': True, 'message': 'Session ended successfully'})
 